@@ -1,21 +1,37 @@
 import os
-import subprocess
 import json
-import io
 import logging
-from typing import TypedDict, List
-from datetime import datetime, timedelta
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict, List, Literal
 
 from dotenv import load_dotenv
-import hcl2
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import BaseMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-import boto3
+from pydantic import BaseModel, Field
+from cloudwatch_metrics import preset_queries, fetch_metrics, METRICS_WINDOW_HOURS, METRICS_PERIOD_SECONDS
+from metric_analysis import analyze_series, build_fleet_digest
+from resource_resolver import MonitoredResource, resolve_resources, DEBUG_MAX_RESOURCES
+from diagram_service import request_render
+from context_manager import (
+    build_conversation_context, build_summary_prompt, current_code_section,
+    estimate_tokens, messages_pending_summary, needs_summary,
+)
+from hcl_patch import apply_patch, PatchError
+from hcl_validation import check_hcl, parse_hcl
+from intent_classifier import classify_locally
+from llm_cache import CachedLLM, LLM_CACHE
+from llm_config import llm_for, NODE_MODELS
+from llm_resilience import LLMUnavailable
+from terraform_scheduler import TERRAFORM_SCHEDULER
+from telemetry import LOG_FORMAT, traced_node
+from terraform_runner import run_command, ensure_initialized, terraform_env, validate_config, plan_fingerprint, PLAN_CACHE, PLAN_FILE
 
 # Load environment variables
 load_dotenv()
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 
 # Define the state for our graph
 class GraphState(TypedDict):
@@ -30,45 +46,136 @@ class GraphState(TypedDict):
     apply_output: str
     clarification_questions: List[str]
     error_message: str
-
-# Initialize the LLM
+    conversation_summary: str
+    summarized_upto: int
+    last_plan_status: str
+    iac_parsed: dict
+    validation_errors: str
+    repair_attempts: int
+
+# Keys held only for the duration of a run (e.g. parsed HCL shared between nodes);
+# they are never persisted to session files or sent to the client.
+TRANSIENT_STATE_KEYS = ("iac_parsed", "validation_errors", "repair_attempts")
+
+# Initialize the per-node LLMs (see llm_config.NODE_MODELS for the tiering)
 try:
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.1)
+    for node in NODE_MODELS:
+        llm_for(node)
 except Exception as e:
     logging.error(f"FATAL: Error initializing LLM. Please check your GOOGLE_API_KEY. Details: {e}")
     raise
 
+# Response-cached views of the node LLMs. Opt-in per node: only for calls whose answer depends
+# on the prompt alone (routing, general chat); code edits and live debugging bypass it.
+cached_llms = {node: CachedLLM(llm_for(node), LLM_CACHE) for node in ("intent_router", "conversational_agent")}
+
+# Bounded worker pool for blocking tools (terraform, boto3, diagram rendering).
+# Keeps subprocess-heavy work off the event loop without letting a burst of
+# requests spawn an unbounded number of threads.
+TOOL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TOOL_MAX_WORKERS", "4")),
+    thread_name_prefix="tool-worker",
+)
+
+# Separate pool for CloudWatch fetches so a multi-resource debugging fan-out neither
+# waits behind terraform runs nor starves them; its size bounds the fan-out's parallelism.
+METRICS_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DEBUG_FETCH_CONCURRENCY", "8")),
+    thread_name_prefix="metrics-worker",
+)
+# Resources described in full in the debugging digest; the rest get one line each.
+DEBUG_DETAILED_RESOURCES = int(os.getenv("DEBUG_DETAILED_RESOURCES", "5"))
+
+# Code-modification pipeline: "two_step" (clarify, then generate) or "combined"
+# (one structured call that returns either questions or the full main.tf).
+AGENT_PIPELINE = os.getenv("AGENT_PIPELINE", "two_step")
+
+# How existing main.tf files are edited: "patch" (block-level operations, falling back
+# to a full rewrite if the patch fails) or "full" (always regenerate the whole file).
+HCL_EDIT_MODE = os.getenv("HCL_EDIT_MODE", "patch")
+
+# Generated code is checked with `terraform fmt` + `terraform validate` before the user
+# can plan it; failures are sent back to generate_code up to this many times.
+IAC_REPAIR_ATTEMPTS = int(os.getenv("IAC_REPAIR_ATTEMPTS", "2"))
+# Each repair adds two steps (generate_code, validate_code) to a code-modification run.
+GRAPH_RECURSION_LIMIT = 10 + 2 * IAC_REPAIR_ATTEMPTS
+
+# Tag attached to LLM calls whose tokens are user-visible and should be streamed
+# to the client (as opposed to internal routing/extraction calls).
+STREAM_TAG = "user_visible"
+
+async def run_tool(tool, *args, **kwargs):
+    """Runs a blocking tool function in the shared worker pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    # Copy the context so the worker's logs and spans keep the request's trace ID
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(TOOL_EXECUTOR, functools.partial(context.run, tool, *args, **kwargs))
+
 # --- TOOL DEFINITIONS ---
 
-def aws_sdk_tool(resource_id: str, metric: str, namespace: str, dimensions: list) -> dict:
+def aws_sdk_tool(resource_id: str, metric: str, namespace: str, dimension_key: str, window_hours: float = None) -> dict:
     """
-    A tool to fetch CloudWatch metrics for a given AWS resource.
-    Returns a dictionary with the data or an error message.
+    A tool to fetch CloudWatch metrics for a given AWS resource. The requested metric is
+    fetched in one batch together with the namespace's standard health metrics, and
+    each series is reduced locally to statistics, trend, level shifts and threshold
+    breaches. Returns a dictionary with the analyses or an error message.
     """
     logging.info(f"Executing aws_sdk_tool for resource:'{resource_id}' metric:'{metric}'")
     try:
         # Ensure your environment has AWS credentials configured (e.g., via ~/.aws/credentials)
-        client = boto3.client('cloudwatch')
-        response = client.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric,
-            Dimensions=dimensions,
-            StartTime=datetime.utcnow() - timedelta(hours=3),  # Check the last 3 hours
-            EndTime=datetime.utcnow(),
-            Period=300,  # 5-minute intervals
-            Statistics=['Average', 'Maximum'],
-        )
-        # Return a clean summary of datapoints, sorted by time
-        datapoints = sorted(response.get('Datapoints', []), key=lambda x: x['Timestamp'])
-        return {"status": "success", "data": datapoints}
+        queries = preset_queries(resource_id, namespace, dimension_key, extra_metrics=[metric] if metric else None)
+        series = fetch_metrics(queries, window_hours=window_hours)
+        analyses = [
+            analyze_series(item.query.resource_id, item.query.metric, item.query.stat, item.timestamps, item.values)
+            for item in series
+        ]
+        return {"status": "success", "analyses": analyses}
     except Exception as e:
         logging.error(f"boto3 tool error: {e}")
         # Return a structured error that the LLM can understand
         return {"status": "error", "message": f"An error occurred while fetching metrics: {str(e)}"}
 
+async def fetch_resource_metrics(resources: List[MonitoredResource], metric: str, window_hours: float = None) -> dict:
+    """
+    Runs aws_sdk_tool for every resource concurrently on the bounded metrics pool, so a
+    fan-out over many resources takes about as long as the slowest single fetch.
+    """
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(
+            METRICS_EXECUTOR,
+            functools.partial(contextvars.copy_context().run, aws_sdk_tool, r.resource_id, metric, r.namespace, r.dimension_key, window_hours),
+        )
+        for r in resources
+    ))
+    analyses, errors = {}, []
+    for resource, result in zip(resources, results):
+        name = f"{resource.resource_id} ({resource.label})" if resource.label else resource.resource_id
+        if result["status"] == "success":
+            analyses[name] = result["analyses"]
+        else:
+            errors.append(f"{name}: {result['message']}")
+    return {"analyses": analyses, "errors": errors}
+
 # --- AGENT NODE DEFINITIONS ---
 
-def intent_router_node(state: GraphState):
+async def summarize_history_node(state: GraphState):
+    """
+    Folds messages that have aged out of the verbatim window into the rolling
+    conversation summary. Only calls the LLM once every CONTEXT_SUMMARY_BATCH messages.
+    """
+    if not needs_summary(state):
+        return {}
+    logging.info("Executing summarize_history_node: Updating conversation summary...")
+    pending = messages_pending_summary(state)
+    response = await llm_for("summarize_history").ainvoke(build_summary_prompt(state))
+    return {
+        "conversation_summary": response.content.strip(),
+        "summarized_upto": state.get("summarized_upto", 0) + len(pending),
+    }
+
+
+async def intent_router_node(state: GraphState):
     """
     Classifies the user's intent to decide which path the graph should take.
     This is the new entry point of our logic, now with three categories.
@@ -76,6 +183,12 @@ def intent_router_node(state: GraphState):
     logging.info("Executing intent_router_node...")
     user_message = state['conversation_history'][-1].content
 
+    # Obvious messages are classified locally, saving a full LLM round trip
+    prediction = classify_locally(user_message)
+    if prediction:
+        logging.info(f"User intent classified locally as: {prediction.intent} ({prediction.source}, confidence {prediction.confidence:.2f})")
+        return {"intent": prediction.intent}
+
     prompt = f"""
     You are a master router for a DevOps AI assistant. Classify the user's latest message into one of three categories:
 
@@ -91,7 +204,7 @@ def intent_router_node(state: GraphState):
 
     Return ONLY the category name (`CODE_MODIFICATION`, `DEBUGGING_INQUIRY`, or `GENERAL_CHAT`).
     """
-    response = llm.invoke(prompt)
+    response = await cached_llms["intent_router"].ainvoke(prompt)
     intent = response.content.strip()
     logging.info(f"User intent classified as: {intent}")
     return {"intent": intent}
@@ -99,24 +212,28 @@ def intent_router_node(state: GraphState):
 
 # In agent_logic.py, replace the old debugging_agent with this one.
 
-def debugging_agent(state: GraphState):
+async def debugging_agent(state: GraphState):
     """
     Handles debugging inquiries by using tools to fetch live data and analyzing it.
     This version has improved NLU with conversation history.
     """
     logging.info("Executing debugging_agent...")
     
-    # --- IMPROVEMENT 1: Use the whole conversation history for context ---
-    conversation_for_prompt = "\n".join([f"{msg.type}: {msg.content}" for msg in state['conversation_history']])
+    # --- IMPROVEMENT 1: Use the (summarized, token-budgeted) conversation history for context ---
+    code_section = current_code_section(state)
+    conversation_for_prompt = build_conversation_context(state, "debugging_agent", reserved_tokens=estimate_tokens(code_section))
 
     # --- IMPROVEMENT 2: A much more robust NLU prompt ---
     nlu_prompt = f"""
     You are an expert at extracting key information from a user's request for monitoring.
     Your goal is to fill a JSON object based on the **entire conversation history**.
 
-    Analyze the conversation below. Identify the 'resource_id' (e.g., an instance ID) and infer the appropriate CloudWatch 'metric', 'namespace', and 'dimension_key'.
-    - If the user mentions slowness, high load, or performance, the metric is 'CPUUtilization'. The namespace for EC2 is 'AWS/EC2' and the dimension key is 'InstanceId'.
+    Analyze the conversation below. Identify every resource the user wants inspected and infer the appropriate CloudWatch 'metric'.
+    - "resources" is a list of objects with 'resource_id' (e.g., an instance ID), 'namespace' and 'dimension_key'. The namespace for EC2 is 'AWS/EC2' and the dimension key is 'InstanceId'; for RDS it is 'AWS/RDS' and 'DBInstanceIdentifier'.
+    - If the user mentions slowness, high load, or performance, the metric is 'CPUUtilization'.
     - If the user provides just an ID in their last message, use the context from the previous messages to fill in the other details.
+    - If the user refers to part of their infrastructure without giving IDs (e.g. "my web tier", "the database"), leave "resources" empty and set 'resource_filter' to a short name to look it up by (e.g. "web", "db"), or to "" to mean all of it.
+    - If the user asks about a specific time span (e.g. "since yesterday", "last 30 minutes"), set 'window_hours' to that span in hours.
     - If you cannot determine a value for a key, use `null`.
 
     Conversation History:
@@ -124,9 +241,11 @@ def debugging_agent(state: GraphState):
     {conversation_for_prompt}
     ---
 
-    Return a clean, raw JSON object with the keys: "resource_id", "metric", "namespace", "dimension_key". Do NOT use markdown fences like ```json.
+    {code_section}
+
+    Return a clean, raw JSON object with the keys: "resources", "resource_filter", "metric", "window_hours". Do NOT use markdown fences like ```json.
     """
-    nlu_response = llm.invoke(nlu_prompt)
+    nlu_response = await llm_for("debugging_nlu").ainvoke(nlu_prompt)
     
     # Add logging to see exactly what the LLM returned
     logging.info(f"NLU Raw Response: {nlu_response.content}")
@@ -136,65 +255,99 @@ def debugging_agent(state: GraphState):
         cleaned_response = nlu_response.content.strip().replace("```json", "").replace("```", "").strip()
         entities = json.loads(cleaned_response)
 
-        resource_id = entities.get('resource_id')
         metric = entities.get('metric')
-        namespace = entities.get('namespace')
-        dimension_key = entities.get('dimension_key')
+        window_hours = entities.get('window_hours')
+        window_hours = float(window_hours) if window_hours else None
+        resources = [
+            MonitoredResource(r['resource_id'], r.get('namespace') or 'AWS/EC2', r.get('dimension_key') or 'InstanceId')
+            for r in entities.get('resources') or [] if r.get('resource_id')
+        ][:DEBUG_MAX_RESOURCES]
+        resource_filter = entities.get('resource_filter')
+        if not resources and resource_filter is not None:
+            # The user named part of their stack; find its resources in the session's state and code
+            parsed = state.get("iac_parsed")
+            if parsed is None and state.get("iac_code"):
+                _, parsed = await _check_hcl(state["iac_code"])
+            resources = await run_tool(resolve_resources, state["work_dir"], parsed, resource_filter)
 
         # Check for missing essential information
-        if not all([resource_id, metric, namespace, dimension_key]):
+        if not resources:
              raise ValueError("Essential information for monitoring is missing.")
 
-        dimensions = [{'Name': dimension_key, 'Value': resource_id}]
-
-    except (json.JSONDecodeError, KeyError, ValueError) as e:
+    except (json.JSONDecodeError, KeyError, ValueError, TypeError, AttributeError) as e:
         logging.error(f"Failed to parse entities or essential info missing: {e}")
         return {"chat_response": "I'm sorry, I still need more information to proceed. Could you please specify the full resource ID and what you'd like to check (e.g., 'check CPU for i-012345abcdef')?"}
 
-    # --- Step 2 & 3 (Tool Use and Reasoning) remain the same ---
-    tool_data = aws_sdk_tool(resource_id, metric, namespace, dimensions)
+    # --- Step 2: fetch every resource's metrics concurrently; Step 3: one reasoning call over the ranked digest ---
+    tool_data = await fetch_resource_metrics(resources, metric, window_hours)
+    window = window_hours or METRICS_WINDOW_HOURS
+    analyses = tool_data["analyses"]
+
+    sections = []
+    if tool_data["errors"]:
+        sections.append("Fetches that failed:\n" + "\n".join(f"- {error}" for error in tool_data["errors"]))
+    if analyses and any(a.count for series in analyses.values() for a in series):
+        sections.append(
+            f"Pre-computed analysis of the last {window} hours for {len(analyses)} resource(s), "
+            f"ranked worst first:\n{build_fleet_digest(analyses, METRICS_PERIOD_SECONDS, DEBUG_DETAILED_RESOURCES)}"
+        )
+    elif analyses:
+        sections.append(f"No datapoints were returned for any metric in the last {window} hours.")
+    monitoring_data = "\n\n".join(sections)
 
     reasoning_prompt = f"""
     You are a Senior DevOps Engineer. You are helping a user debug a problem with their cloud infrastructure.
     - User's Question: "{state['conversation_history'][-1].content}"
-    - You have just fetched the following monitoring data from AWS CloudWatch:
-      {json.dumps(tool_data, indent=2, default=str)}
-
-    Analyze this data and provide a helpful, clear, and concise response.
-    - If the tool status is 'error', explain the error to the user and ask them to check if the resource ID is correct and if the application has the right permissions.
-    - If the data array is empty, state that no metrics were found for that resource in the last 3 hours and ask them to verify the resource ID and region.
-    - If there is data, analyze it. Look for trends, especially high average or maximum values (e.g., CPUUtilization > 80%).
+    - You have just fetched monitoring data from AWS CloudWatch:
+{monitoring_data}
+
+    Provide a helpful, clear, and concise response based on this analysis. The statistics, trends,
+    level shifts and threshold breaches above are already computed; do not recalculate them.
+    - If fetches failed, explain the error to the user and ask them to check if the resource IDs are correct and if the application has the right permissions.
+    - If no datapoints were returned, state that no metrics were found in that window and ask them to verify the resource IDs and region.
+    - Otherwise, explain which findings matter for the user's question, most severe first. When several resources were inspected, say whether the problem is isolated to a few of them or affects the whole group, and name the outliers.
+    - Relate metrics to each other where it helps (e.g. a CPU level shift at the same time as a network spike).
     - Provide a summary of your findings and suggest a concrete next step (e.g., "The CPU has been consistently high. You may want to consider upgrading the instance type.").
     """
-    final_response = llm.invoke(reasoning_prompt)
+    final_response = await llm_for("debugging_agent").ainvoke(reasoning_prompt, config={"tags": [STREAM_TAG]})
     return {"chat_response": final_response.content}
 
 
-def conversational_agent_node(state: GraphState):
+async def conversational_agent_node(state: GraphState):
     """
     Handles general questions and conversation. Does not generate code.
     """
     logging.info("Executing conversational_agent_node...")
-    conversation_for_prompt = "\n".join([f"{msg.type}: {msg.content}" for msg in state['conversation_history']])
+    code_section = current_code_section(state)
+    conversation_for_prompt = build_conversation_context(state, "conversational_agent", reserved_tokens=estimate_tokens(code_section))
 
     prompt = f"""
     You are a friendly and knowledgeable DevOps assistant. Your user is asking a question or having a general conversation.
     Provide a helpful, concise, and friendly answer based on the conversation history. Do not generate code unless specifically asked to show an example snippet within your explanation.
 
+    {code_section}
+
     Conversation History:
     {conversation_for_prompt}
 
     Your Answer:
     """
-    response = llm.invoke(prompt)
+    response = await cached_llms["conversational_agent"].ainvoke(prompt, config={"tags": [STREAM_TAG]})
     return {"chat_response": response.content}
 
 
-def iac_generation_agent(state: GraphState):
+async def iac_generation_agent(state: GraphState):
     logging.info("Executing iac_generation_agent: Architecting infrastructure...")
     aws_region = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
-    conversation_for_prompt = "\n".join([f"{msg.type}: {msg.content}" for msg in state['conversation_history']])
     existing_code = state.get("iac_code", "")
+    conversation_for_prompt = build_conversation_context(state, "generate_code", reserved_tokens=estimate_tokens(existing_code))
+    repair_section = validation_feedback(state)
+
+    if existing_code and "Error" not in existing_code and HCL_EDIT_MODE == "patch":
+        patch_result = await _generate_hcl_patch(state, existing_code, conversation_for_prompt, repair_section)
+        if patch_result is not None:
+            return patch_result
+        logging.warning("Patch generation failed; falling back to full main.tf regeneration.")
 
     if existing_code and "Error" not in existing_code:
         clean_existing_code = existing_code.replace("--- main.tf ---", "").strip()
@@ -212,6 +365,7 @@ def iac_generation_agent(state: GraphState):
         ```hcl
         {clean_existing_code}
         ```
+        {repair_section}
         Now, based on the last user message, return ONLY the full, updated, and raw HCL code for the new main.tf file.
         """
     else:
@@ -228,32 +382,150 @@ def iac_generation_agent(state: GraphState):
         Write the Terraform code now.
         """
 
-    response = llm.invoke(prompt)
+    response = await llm_for("generate_code").ainvoke(prompt, config={"tags": [STREAM_TAG]})
     hcl_code = response.content.strip().replace("```hcl", "").replace("```", "").strip()
+    return await _validate_and_save_hcl(state, hcl_code)
+
+
+async def _generate_hcl_patch(state: GraphState, existing_code: str, conversation_for_prompt: str, repair_section: str = ""):
+    """
+    Patch mode: asks the model only for the blocks that change and splices them into the
+    existing main.tf. Returns None if the patch cannot be produced, applied or validated,
+    so the caller can fall back to regenerating the whole file.
+    """
+    clean_existing_code = existing_code.replace("--- main.tf ---", "").strip()
+    prompt = f"""
+    You are an expert DevOps engineer who flawlessly modifies existing Terraform HCL code.
+    Instead of rewriting the file, describe the change as block-level operations on the existing main.tf.
+    *CRITICAL RULES:*
+    1.  Return ONLY a raw JSON list of operations. Do NOT use markdown fences like ```json.
+    2.  Each operation is {{"op": "add" | "replace" | "remove", "address": "<address>", "hcl": "<the complete block>"}}.
+        Addresses look like `aws_instance.web_server`, `data.aws_ami.ubuntu`, `provider.aws`, `variable.name`, `output.name`.
+    3.  "replace" and "add" must contain the complete HCL of exactly that one block; "remove" needs no "hcl".
+    4.  If adding a new resource that another resource depends on, add the new resource AND replace the existing resource so it references it.
+    5.  Resource names must remain consistent unless the user asks to change them. Leave unrelated blocks out of the list.
+    *Full Conversation History:*
+    {conversation_for_prompt}
+    **Existing main.tf to modify:**
+    ```hcl
+    {clean_existing_code}
+    ```
+    {repair_section}
+    Now, based on the last user message, return the JSON list of operations.
+    """
+    response = await llm_for("generate_code").ainvoke(prompt)
+    try:
+        cleaned_response = response.content.strip().replace("```json", "").replace("```", "").strip()
+        operations = json.loads(cleaned_response)
+        if not isinstance(operations, list):
+            raise PatchError("Expected a JSON list of operations.")
+        hcl_code = apply_patch(clean_existing_code, operations).strip()
+    except (json.JSONDecodeError, PatchError, AttributeError, TypeError) as e:
+        logging.warning(f"Could not apply HCL patch: {e}")
+        return None
+
+    error_msg, parsed = await _check_hcl(hcl_code)
+    if error_msg:
+        logging.warning(f"Patched HCL failed validation: {error_msg}")
+        return None
+    logging.info(f"Applied {len(operations)} block-level patch operation(s) to main.tf.")
+    return _save_hcl(state, hcl_code, parsed)
+
+
+def validation_feedback(state: GraphState) -> str:
+    """Prompt section asking generate_code to fix the errors `terraform validate` reported, if any."""
+    if not state.get("validation_errors"):
+        return ""
+    return f"""**The current main.tf fails `terraform validate`. Fix these errors while keeping the user's requested changes:**
+        {state["validation_errors"]}
+        """
+
 
+async def _check_hcl(hcl_code: str):
+    """
+    Parses and checks the HCL. Returns (error, parsed): a user-facing validation error
+    (empty if valid) and the parsed document for downstream nodes.
+    """
     try:
-        with io.StringIO(hcl_code) as f:
-            hcl2.load(f)
-        logging.info("HCL validation successful.")
+        parsed, issues = await run_tool(check_hcl, hcl_code)
     except Exception as e:
-        error_msg = f"**Validation Error:** Agent produced invalid HCL. Details: {e}\n\n---\n{hcl_code}"
-        logging.error(error_msg)
-        return {"iac_code": "", "error_message": error_msg}
+        return f"**Validation Error:** Agent produced invalid HCL. Details: {e}\n\n---\n{hcl_code}", None
+
+    if issues:
+        details = "\n".join(f"- {issue}" for issue in issues)
+        return f"**Validation Error:** The generated HCL has problems:\n{details}\n\n---\n{hcl_code}", None
+    return "", parsed
 
-    if "provider" not in hcl_code and "terraform {" not in hcl_code:
-        error_msg = f"Error: LLM returned invalid HCL (missing provider block).\n---\n{hcl_code}"
-        logging.error(error_msg)
-        return {"iac_code": "", "error_message": error_msg}
 
+def _save_hcl(state: GraphState, hcl_code: str, parsed: dict):
     iac_dir = state["work_dir"]
     with open(os.path.join(iac_dir, "main.tf"), "w") as f: f.write(hcl_code)
 
-    return {"iac_code": f"{hcl_code}", "error_message": ""}
+    return {"iac_code": f"{hcl_code}", "iac_parsed": parsed, "error_message": ""}
+
+
+async def _validate_and_save_hcl(state: GraphState, hcl_code: str):
+    """Validates generated HCL and writes it to the session's main.tf."""
+    error_msg, parsed = await _check_hcl(hcl_code)
+    if error_msg:
+        logging.error(error_msg)
+        return {"iac_code": "", "iac_parsed": None, "error_message": error_msg}
+    logging.info("HCL validation successful.")
+
+    return _save_hcl(state, hcl_code, parsed)
 
 
-def clarification_agent(state: GraphState):
+def static_validation_tool(state: GraphState):
+    """
+    Runs `terraform fmt` and `terraform validate` on the freshly written main.tf. Errors
+    are handed back to generate_code while repair attempts remain; after that they
+    become the turn's error message.
+    """
+    logging.info("Executing static_validation_tool...")
+    if not state.get("iac_code") or state.get("error_message"):
+        return {"validation_errors": "", "repair_attempts": 0}
+    iac_dir = state["work_dir"]
+    result = validate_config(iac_dir)
+    updates = {"validation_errors": "", "repair_attempts": 0}
+    if result.formatted:
+        with open(os.path.join(iac_dir, "main.tf"), "r") as f:
+            hcl_code = f.read()
+        updates.update({"iac_code": hcl_code, "iac_parsed": parse_hcl(hcl_code)})
+    if result.skipped:
+        logging.warning(f"Skipping terraform validate: {result.skipped}")
+        return updates
+    if not result.errors:
+        logging.info("terraform validate passed.")
+        return updates
+
+    details = "\n".join(f"- {error}" for error in result.errors)
+    attempts = state.get("repair_attempts", 0)
+    if attempts < IAC_REPAIR_ATTEMPTS:
+        logging.warning(f"terraform validate failed; repair attempt {attempts + 1}/{IAC_REPAIR_ATTEMPTS}:\n{details}")
+        updates.update({"validation_errors": details, "repair_attempts": attempts + 1})
+        return updates
+    logging.error(f"terraform validate still failing after {attempts} repair attempt(s):\n{details}")
+    updates["error_message"] = f"**Validation Error:** `terraform validate` reported errors in main.tf:\n{details}"
+    return updates
+
+
+async def validate_code_node(state: GraphState):
+    """
+    Graph node wrapper that runs the static terraform checks in the tool worker pool.
+    A chat turn never queues behind plans and applies: when no terraform slot is free,
+    the HCL checks generate_code already ran are all the validation this turn gets.
+    """
+    async with TERRAFORM_SCHEDULER.try_slot(state["work_dir"]) as acquired:
+        if not acquired:
+            logging.warning(f"No free terraform slot for {state['work_dir']}; skipping terraform validate this turn.")
+            return {"validation_errors": "", "repair_attempts": 0}
+        return await run_tool(static_validation_tool, state)
+
+
+async def clarification_agent(state: GraphState):
     logging.info("Executing clarification_agent: Analyzing request for details...")
-    conversation_for_prompt = "\n".join([f"{msg.type}: {msg.content}" for msg in state['conversation_history']])
+    code_section = current_code_section(state)
+    conversation_for_prompt = build_conversation_context(state, "clarification_agent", reserved_tokens=estimate_tokens(code_section))
 
     prompt = f"""
     You are a meticulous Cloud Architecture requirement analyst. Your goal is to gather key details before any code is written.
@@ -261,6 +533,7 @@ def clarification_agent(state: GraphState):
     ---
     {conversation_for_prompt}
     ---
+    {code_section}
     *Your Task & Rules*:
     1.  For any new resource request (like aws_s3_bucket, aws_instance), you MUST check if a user-defined name is provided.
     2.  If a name for a key resource is missing, you MUST ask for it.
@@ -274,7 +547,7 @@ def clarification_agent(state: GraphState):
     Your Output: []
     """
 
-    response = llm.invoke(prompt)
+    response = await llm_for("clarification_agent").ainvoke(prompt)
     try:
         cleaned_response = response.content.strip().replace("```json", "").replace("```", "").strip()
         clarification_questions = json.loads(cleaned_response)
@@ -284,37 +557,128 @@ def clarification_agent(state: GraphState):
         logging.error(f"Failed to decode JSON from clarification agent. Response: {response.content}")
         return {"clarification_questions": []}
 
+class DesignDecision(BaseModel):
+    """Structured output of the combined clarification + generation call."""
+    kind: Literal["clarification", "code"] = Field(description="'clarification' if key details are missing, otherwise 'code'.")
+    questions: List[str] = Field(default_factory=list, description="Questions for the user when kind is 'clarification'.")
+    hcl: str = Field(default="", description="The complete, raw main.tf HCL when kind is 'code'.")
+
+
+async def design_agent(state: GraphState):
+    """
+    Combined pipeline: a single structured LLM call that either asks clarification
+    questions or returns the complete main.tf, replacing the two sequential calls made
+    by clarification_agent and iac_generation_agent.
+    """
+    logging.info("Executing design_agent: Clarifying and generating in one call...")
+    aws_region = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
+    existing_code = state.get("iac_code", "")
+    conversation_for_prompt = build_conversation_context(state, "design_agent", reserved_tokens=estimate_tokens(existing_code))
+    if existing_code and "Error" not in existing_code:
+        existing_section = f"""**Existing main.tf to modify:**
+        ```hcl
+        {existing_code.replace("--- main.tf ---", "").strip()}
+        ```"""
+    else:
+        existing_section = "There is no existing main.tf; write one from scratch."
+
+    prompt = f"""
+    You are an expert DevOps engineer and meticulous Cloud Architecture requirement analyst who writes lean, correct Terraform HCL for AWS.
+    Analyze the user's last message in the context of the entire conversation and decide ONE of:
+    - kind = "clarification": a new key resource (like aws_s3_bucket, aws_instance) has no user-defined name, or an essential detail is missing.
+      Put the questions in `questions` (e.g., "What should I name the EC2 instance (e.g., 'web-server') and what instance_type should I use (e.g., 't2.micro')?").
+    - kind = "code": you have enough information. Put the **entire, complete, and updated main.tf file** in `hcl`.
+    *CODE RULES:*
+    1.  Fulfill the user's request exactly as stated; do not add extra resources unless explicitly requested.
+    2.  The AWS provider block MUST include the region. Use {aws_region} unless the existing code sets one.
+    3.  If adding a new resource that another resource depends on, add it AND update the existing resource to reference it.
+    4.  Resource names (e.g., aws_instance.web_server) must remain consistent unless the user asks to change them.
+    5.  `hcl` must be raw HCL without markdown fences or explanations.
+    *Full Conversation History:*
+    {conversation_for_prompt}
+    {existing_section}
+    """
+
+    try:
+        decision = await llm_for("design_agent").with_structured_output(DesignDecision).ainvoke(prompt)
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        logging.error(f"Combined design call failed: {e}")
+        return {"iac_code": "", "clarification_questions": [], "error_message": f"Error: Failed to generate a design. Details: {e}"}
+
+    if decision.kind == "clarification" and decision.questions:
+        logging.info(f"Clarification questions found: {decision.questions}")
+        return {"clarification_questions": decision.questions}
+
+    hcl_code = decision.hcl.strip().replace("```hcl", "").replace("```", "").strip()
+    result = await _validate_and_save_hcl(state, hcl_code)
+    result["clarification_questions"] = []
+    return result
+
 # --- NON-AGENT TOOL AND ROUTING FUNCTIONS ---
 
 def visualization_tool(state: GraphState):
     logging.info("Executing visualization_tool...")
     if not state.get("iac_code") or state.get("error_message"): return {"iac_diagram_path": ""}
     iac_dir = state["work_dir"]
-    script_path = os.path.join(os.path.dirname(__file__), "diagram_generator.py")
-    process = subprocess.run(["python", script_path, iac_dir], capture_output=True, text=True, check=False)
-    if process.returncode != 0: return {"iac_diagram_path": ""}
-    diagram_path = process.stdout.strip()
-    if diagram_path and os.path.exists(diagram_path):
-        relative_path = os.path.relpath(diagram_path, 'backend')
+    # Rendering happens in the background; the returned path becomes available once it finishes
+    diagram_path = request_render(iac_dir, state.get("iac_parsed"))
+    if diagram_path:
+        relative_path = os.path.relpath(diagram_path)
         api_accessible_path = f"/{relative_path.replace(os.path.sep, '/')}"
         return {"iac_diagram_path": api_accessible_path}
     return {"iac_diagram_path": ""}
 
-def deployment_planning_tool(state: GraphState):
+def deployment_planning_tool(state: GraphState, on_line=None, cancel_event=None):
     logging.info("Executing deployment_planning_tool...")
     iac_dir = state["work_dir"]
     chdir_arg = f"-chdir={iac_dir}"
-    init_process = subprocess.run(["terraform", chdir_arg, "init", "-no-color", "-upgrade"], capture_output=True, text=True)
-    if init_process.returncode != 0: return {"plan_output": f"Terraform Init Failed:\n{init_process.stderr}", "error_message": f"Terraform Init Failed:\n{init_process.stderr}"}
-    plan_process = subprocess.run(["terraform", chdir_arg, "plan", "-no-color"], capture_output=True, text=True)
-    return {"plan_output": plan_process.stdout + "\n" + plan_process.stderr}
-
-def execution_tool(state: GraphState):
+    saved = PLAN_CACHE.lookup(iac_dir)
+    if saved is not None:
+        message = "Configuration and state unchanged since the last plan; reusing the saved plan."
+        logging.info(f"{message} ({iac_dir})")
+        if on_line: on_line(message)
+        return {"plan_output": saved["output"], "exit_code": 0}
+    # Never leave an older plan file around to be applied against newer code
+    PLAN_CACHE.discard(iac_dir)
+    init_result = ensure_initialized(iac_dir, on_line=on_line, cancel_event=cancel_event)
+    if init_result.returncode != 0: return {"plan_output": f"Terraform Init Failed:\n{init_result.output}", "error_message": f"Terraform Init Failed:\n{init_result.output}", "exit_code": init_result.returncode}
+    fingerprint = plan_fingerprint(iac_dir)
+    plan_result = run_command(["terraform", chdir_arg, "plan", "-no-color", "-input=false", f"-out={PLAN_FILE}"], on_line=on_line, cancel_event=cancel_event, env=terraform_env())
+    if plan_result.timed_out:
+        return {"plan_output": plan_result.output, "error_message": f"Terraform Plan Timed Out:\n{plan_result.output}", "exit_code": plan_result.returncode}
+    if plan_result.cancelled:
+        return {"plan_output": plan_result.output, "exit_code": plan_result.returncode}
+    if plan_result.returncode != 0:
+        return {"plan_output": plan_result.output, "error_message": f"Terraform Plan Failed (exit code {plan_result.returncode}):\n{plan_result.output}", "exit_code": plan_result.returncode}
+    PLAN_CACHE.store(iac_dir, fingerprint, plan_result.output)
+    return {"plan_output": plan_result.output, "exit_code": plan_result.returncode}
+
+def execution_tool(state: GraphState, on_line=None, cancel_event=None):
     logging.info("Executing execution_tool...")
     iac_dir = state["work_dir"]
     chdir_arg = f"-chdir={iac_dir}"
-    apply_process = subprocess.run(["terraform", chdir_arg, "apply", "-auto-approve", "-no-color"], capture_output=True, text=True)
-    return {"apply_output": apply_process.stdout + "\n" + apply_process.stderr}
+    if PLAN_CACHE.lookup(iac_dir) is None:
+        # Never apply anything the user has not reviewed. Clearing plan_output makes the next
+        # apply request fail check_can_run until a fresh plan has been generated.
+        logging.info(f"No saved plan matches the current configuration in {iac_dir}; refusing to apply.")
+        message = "No saved plan matches the current configuration (it expired, main.tf changed, or it was already applied). Run a new plan and review it before applying."
+        return {"apply_output": "", "plan_output": "", "error_message": message}
+    # Applying the saved plan skips a second refresh and applies exactly what the user reviewed
+    command = ["terraform", chdir_arg, "apply", "-no-color", "-input=false", PLAN_FILE]
+    apply_result = run_command(command, on_line=on_line, cancel_event=cancel_event, env=terraform_env())
+    # A saved plan can be applied only once, and the state has (probably) moved on
+    PLAN_CACHE.discard(iac_dir)
+    if apply_result.timed_out:
+        return {"apply_output": apply_result.output, "error_message": f"Terraform Apply Timed Out:\n{apply_result.output}", "exit_code": apply_result.returncode}
+    if apply_result.returncode != 0 and not apply_result.cancelled:
+        return {"apply_output": apply_result.output, "error_message": f"Terraform Apply Failed (exit code {apply_result.returncode}):\n{apply_result.output}", "exit_code": apply_result.returncode}
+    return {"apply_output": apply_result.output, "exit_code": apply_result.returncode}
+
+async def visualization_node(state: GraphState):
+    """Graph node wrapper that renders the diagram in the tool worker pool."""
+    return await run_tool(visualization_tool, state)
 
 
 def route_by_intent(state: GraphState):
@@ -342,31 +706,56 @@ def route_after_clarification(state: GraphState):
     return "generate_code"
 
 
+def route_after_design(state: GraphState):
+    """In the combined pipeline, only validate and render when new code was produced."""
+    if state.get("error_message") or state.get("clarification_questions"):
+        return END
+    return "validate_code"
+
+
+def route_after_validation(state: GraphState):
+    """Sends validation errors back to generate_code for repair; otherwise draws the diagram."""
+    if state.get("validation_errors"):
+        logging.info("Validation errors found. Routing back to code generation for repair.")
+        return "generate_code"
+    return "generate_diagram"
+
+
 # --- GRAPH DEFINITION ---
 
-def create_graph() -> StateGraph:
+def create_graph(pipeline: str = AGENT_PIPELINE) -> StateGraph:
     """
     Builds the state machine graph with intelligent routing.
+    `pipeline` selects the code path: "two_step" (clarification_agent, then
+    generate_code) or "combined" (a single structured design_agent call).
     """
     workflow = StateGraph(GraphState)
+    combined = pipeline == "combined"
 
     # Add all nodes to the graph
-    workflow.add_node("intent_router", intent_router_node)
-    workflow.add_node("conversational_agent", conversational_agent_node)
-    workflow.add_node("debugging_agent", debugging_agent)
-    workflow.add_node("clarification_agent", clarification_agent)
-    workflow.add_node("generate_code", iac_generation_agent)
-    workflow.add_node("generate_diagram", visualization_tool)
+    workflow.add_node("summarize_history", traced_node("summarize_history", summarize_history_node))
+    workflow.add_node("intent_router", traced_node("intent_router", intent_router_node))
+    workflow.add_node("conversational_agent", traced_node("conversational_agent", conversational_agent_node))
+    workflow.add_node("debugging_agent", traced_node("debugging_agent", debugging_agent))
+    if combined:
+        workflow.add_node("design_agent", traced_node("design_agent", design_agent))
+    else:
+        workflow.add_node("clarification_agent", traced_node("clarification_agent", clarification_agent))
+    # In the combined pipeline generate_code is only reached to repair validation errors
+    workflow.add_node("generate_code", traced_node("generate_code", iac_generation_agent))
+    workflow.add_node("validate_code", traced_node("validate_code", validate_code_node))
+    workflow.add_node("generate_diagram", traced_node("generate_diagram", visualization_node))
 
     # Set the entry point
-    workflow.set_entry_point("intent_router")
+    workflow.set_entry_point("summarize_history")
+    workflow.add_edge("summarize_history", "intent_router")
 
     # Define the edges and conditional routes
     workflow.add_conditional_edges(
         "intent_router",
         route_by_intent,
         {
-            "clarification_agent": "clarification_agent",
+            "clarification_agent": "design_agent" if combined else "clarification_agent",
             "conversational_agent": "conversational_agent",
             "debugging_agent": "debugging_agent"
         }
@@ -377,15 +766,33 @@ def create_graph() -> StateGraph:
     workflow.add_edge("debugging_agent", END)
 
     # Define the code generation pipeline
+    if combined:
+        workflow.add_conditional_edges(
+            "design_agent",
+            route_after_design,
+            {
+                "validate_code": "validate_code",
+                END: END
+            }
+        )
+    else:
+        workflow.add_conditional_edges(
+            "clarification_agent",
+            route_after_clarification,
+            {
+                "generate_code": "generate_code",
+                END: END
+            }
+        )
+    workflow.add_edge("generate_code", "validate_code")
     workflow.add_conditional_edges(
-        "clarification_agent",
-        route_after_clarification,
+        "validate_code",
+        route_after_validation,
         {
             "generate_code": "generate_code",
-            END: END
+            "generate_diagram": "generate_diagram"
         }
     )
-    workflow.add_edge("generate_code", "generate_diagram")
     workflow.add_edge("generate_diagram", END)
 
     # Compile the graph
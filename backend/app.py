@@ -3,24 +3,46 @@ import uuid
 import tempfile
 import logging
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import Dict, Optional
 from dotenv import load_dotenv, set_key
 
-from agent_logic import app_graph, GraphState, deployment_planning_tool, execution_tool
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from agent_logic import app_graph, GraphState, deployment_planning_tool, execution_tool, run_tool, STREAM_TAG, GRAPH_RECURSION_LIMIT
+from langchain_core.messages import HumanMessage, AIMessage
+from jobs import JOBS
+from session_store import SESSION_STORE
+from state_delta import STATE_DELTAS
+from intent_classifier import INTENT_STATS
+from llm_cache import LLM_CACHE
+from llm_config import describe_models
+from llm_resilience import LLMUnavailable, UNAVAILABLE_MESSAGE, resilience_stats
+from cloudwatch_metrics import METRICS_CACHE
+from hcl_validation import PARSE_CACHE
+from diagram_service import render_status
+from terraform_runner import PLAN_CACHE
+from terraform_scheduler import TERRAFORM_SCHEDULER
+from telemetry import LOG_FORMAT, TraceMiddleware, metrics_payload
 
 # Load environment variables at startup
 load_dotenv()
 
-app = FastAPI()
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    SESSION_STORE.start()
+    yield
+    # Persist any sessions still waiting for the write-behind flush
+    await SESSION_STORE.stop()
+
+app = FastAPI(lifespan=lifespan)
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 
 # --- Middleware for CORS ---
 origins = [
@@ -34,6 +56,34 @@ app.add_middleware(
     allow_methods=["*"], allow_headers=["*"],
 )
 
+# --- Response compression ---
+# Brotli when the optional brotli-asgi package is installed (it falls back to gzip for
+# clients without br support), otherwise gzip.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+try:
+    from brotli_asgi import BrotliMiddleware as CompressionMiddleware
+except ImportError:
+    CompressionMiddleware = GZipMiddleware
+
+class CompressNonStreaming:
+    """Compresses regular responses; SSE endpoints bypass it so events are not held in the compressor's buffer."""
+
+    def __init__(self, app, **options):
+        self.app = app
+        self.compressed = CompressionMiddleware(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/stream"):
+            await self.app(scope, receive, send)
+        else:
+            await self.compressed(scope, receive, send)
+
+app.add_middleware(CompressNonStreaming, minimum_size=COMPRESS_MIN_BYTES)
+
+# --- Tracing ---
+# Added last so it is the outermost middleware and its timing covers compression too.
+app.add_middleware(TraceMiddleware)
+
 # --- Directory setup ---
 os.makedirs("generated_files", exist_ok=True)
 os.makedirs("sessions", exist_ok=True)
@@ -42,145 +92,275 @@ app.mount("/generated_files", StaticFiles(directory="generated_files"), name="ge
 # --- Pydantic Models ---
 class ApiRequest(BaseModel):
     session_id: str | None = None
+    # Last state_version the client has applied; responses then carry only what changed since
+    since_version: str | None = None
 
 class ChatRequest(ApiRequest):
     message: str
     
+class JobRequest(ApiRequest):
+    kind: str
+
 class ConfigRequest(BaseModel):
     google_api_key: Optional[str] = None
     aws_access_key_id: Optional[str] = None
     aws_secret_access_key: Optional[str] = None
     aws_default_region: Optional[str] = None
 
-# --- Session Serialization/Deserialization ---
-def serialize_history(history: List[BaseMessage]) -> List[Dict]:
-    serializable = []
-    for msg in history:
-        role = "user" if isinstance(msg, HumanMessage) else "assistant"
-        serializable.append({"role": role, "content": msg.content})
-    return serializable
-
-def deserialize_history(history_data: List[Dict]) -> List[BaseMessage]:
-    messages = []
-    for msg in history_data:
-        if msg['role'] == 'user':
-            messages.append(HumanMessage(content=msg['content']))
-        else:
-            messages.append(AIMessage(content=msg['content']))
-    return messages
-
 # --- Session Management ---
-SESSIONS: Dict[str, GraphState] = {} # This will now act as a cache
-
 def save_session_state(session_id: str, state: GraphState):
-    """Saves a session's state to a JSON file."""
-    session_file = os.path.join("sessions", f"{session_id}.json")
-    
-    # Create a serializable copy of the state
-    serializable_state = state.copy()
-    serializable_state["conversation_history"] = serialize_history(state["conversation_history"])
-    
-    with open(session_file, "w") as f:
-        json.dump(serializable_state, f, indent=2)
+    """Queues a session's state for the next write-behind flush."""
+    SESSION_STORE.save(session_id, state)
 
-def get_session_state(session_id: str | None) -> (str, GraphState):
-    """Retrieves state from file or creates a new session."""
-    sid = session_id or str(uuid.uuid4())
-    session_file = os.path.join("sessions", f"{sid}.json")
+def resolve_session_id(session_id: str | None) -> str:
+    return session_id or str(uuid.uuid4())
 
-    if sid in SESSIONS:
-        return sid, SESSIONS[sid]
+async def get_session_state(session_id: str | None) -> (str, GraphState):
+    """Retrieves state from the session store or creates a new session."""
+    sid = resolve_session_id(session_id)
 
-    if os.path.exists(session_file):
-        logging.info(f"Loading existing session {sid} from disk.")
-        with open(session_file, "r") as f:
-            state_data = json.load(f)
-        state_data["conversation_history"] = deserialize_history(state_data["conversation_history"])
-        SESSIONS[sid] = state_data
-        return sid, SESSIONS[sid]
+    state = await SESSION_STORE.get(sid)
+    if state is not None:
+        return sid, state
 
     logging.info(f"Creating new session: {sid}")
     temp_dir = tempfile.mkdtemp(dir="generated_files")
     new_state = GraphState(
         work_dir=temp_dir, initial_request="", conversation_history=[],
         intent="", chat_response="", iac_code="", iac_diagram_path="",
-        plan_output="", apply_output="", clarification_questions=[], error_message=""
+        plan_output="", apply_output="", clarification_questions=[], error_message="",
+        conversation_summary="", summarized_upto=0, last_plan_status=""
     )
-    SESSIONS[sid] = new_state
     save_session_state(sid, new_state)
     return sid, new_state
 
+# --- Turn Handling ---
+def build_response(session_id: str, state: GraphState, since_version: Optional[str] = None) -> Dict:
+    """
+    Builds the JSON-serializable session payload returned to the frontend: only the
+    fields and messages changed since `since_version`, or the full state when the
+    client has no usable version.
+    """
+    return STATE_DELTAS.build(session_id, state, since_version)
+
+def finalize_turn(state: GraphState, result_state: GraphState, code_before_run: str):
+    """Merges a finished graph run into the session and appends the assistant reply."""
+    response_text = ""
+    if result_state.get("chat_response"):
+        response_text = result_state["chat_response"]
+        result_state["chat_response"] = "" 
+    elif result_state.get("clarification_questions"):
+        questions = result_state["clarification_questions"]
+        response_text = "I have a few questions:\n- " + "\n- ".join(questions)
+    elif result_state.get("error_message"):
+        response_text = result_state["error_message"]
+    elif result_state.get("iac_code") and result_state["iac_code"] != code_before_run:
+        response_text = "I have updated the architecture. Review the code and diagram, and let me know what to do next."
+    
+    state.update(result_state)
+    if response_text:
+        state["conversation_history"].append(AIMessage(content=response_text))
+
+def sse_event(event: str, data: Dict) -> str:
+    """Formats a single Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
 # --- API Endpoints ---
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
-    session_id, current_state = get_session_state(request.session_id)
-    
-    # Handle initial load for an existing session
-    if request.message == "__initial_load__" and current_state["conversation_history"]:
-        pass # Just load the state and return it
-    else:
+    session_id = resolve_session_id(request.session_id)
+    async with SESSION_STORE.lock(session_id):
+        _, current_state = await get_session_state(session_id)
+        
+        # Handle initial load for an existing session
+        if request.message == "__initial_load__" and current_state["conversation_history"]:
+            return build_response(session_id, current_state, request.since_version) # Just load the state and return it
+
         code_before_run = current_state.get("iac_code", "")
         current_state["conversation_history"].append(HumanMessage(content=request.message))
         
         try:
-            result_state = app_graph.invoke(current_state, config={"recursion_limit": 10})
+            result_state = await app_graph.ainvoke(current_state, config={"recursion_limit": GRAPH_RECURSION_LIMIT})
+        except LLMUnavailable as e:
+            logging.error(f"LLM unavailable for session {session_id}: {e}")
+            result_state = {"chat_response": UNAVAILABLE_MESSAGE}
         except Exception as e:
             logging.error(f"Graph execution error for session {session_id}: {e}")
+            save_session_state(session_id, current_state)
             raise HTTPException(status_code=500, detail=f"Agent graph execution failed: {str(e)}")
 
-        response_text = ""
-        if result_state.get("chat_response"):
-            response_text = result_state["chat_response"]
-            result_state["chat_response"] = "" 
-        elif result_state.get("clarification_questions"):
-            questions = result_state["clarification_questions"]
-            response_text = "I have a few questions:\n- " + "\n- ".join(questions)
-        elif result_state.get("error_message"):
-            response_text = result_state["error_message"]
-        elif result_state.get("iac_code") and result_state["iac_code"] != code_before_run:
-            response_text = "I have updated the architecture. Review the code and diagram, and let me know what to do next."
-        
-        SESSIONS[session_id].update(result_state)
-        if response_text:
-            SESSIONS[session_id]["conversation_history"].append(AIMessage(content=response_text))
+        finalize_turn(current_state, result_state, code_before_run)
+        save_session_state(session_id, current_state)
+        return build_response(session_id, current_state, request.since_version)
 
-    save_session_state(session_id, SESSIONS[session_id])
-    
-    response_data = SESSIONS[session_id].copy()
-    response_data["session_id"] = session_id
-    response_data["conversation_history"] = serialize_history(response_data["conversation_history"])
-    return response_data
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streams a chat turn as Server-Sent Events: `node` events for LangGraph node
+    transitions, `token` events for user-visible LLM output (`token_reset` when a
+    retried call discards what was streamed), then a final `done` event carrying
+    the same payload as /api/chat.
+    """
+    session_id = resolve_session_id(request.session_id)
+
+    async def event_stream():
+        yield sse_event("session", {"session_id": session_id})
+        async with SESSION_STORE.lock(session_id):
+            async for frame in run_turn():
+                yield frame
+
+    async def run_turn():
+        _, current_state = await get_session_state(session_id)
+        code_before_run = current_state.get("iac_code", "")
+        current_state["conversation_history"].append(HumanMessage(content=request.message))
+        save_session_state(session_id, current_state)
+        result_state = None
+        streamed_nodes = set()
+        try:
+            async for event in app_graph.astream_events(current_state, config={"recursion_limit": GRAPH_RECURSION_LIMIT}, version="v2"):
+                kind = event["event"]
+                node = event.get("metadata", {}).get("langgraph_node")
+                if kind in ("on_chain_start", "on_chain_end") and node and event["name"] == node:
+                    yield sse_event("node", {"node": node, "status": "start" if kind == "on_chain_start" else "end"})
+                elif kind == "on_chat_model_start" and STREAM_TAG in event.get("tags", []) and node in streamed_nodes:
+                    # A retried call streams its reply again from the start
+                    streamed_nodes.discard(node)
+                    yield sse_event("token_reset", {"node": node})
+                elif kind == "on_chat_model_stream" and STREAM_TAG in event.get("tags", []):
+                    text = event["data"]["chunk"].content
+                    if text:
+                        streamed_nodes.add(node)
+                        yield sse_event("token", {"node": node, "text": text})
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    result_state = event["data"]["output"]
+        except LLMUnavailable as e:
+            logging.error(f"LLM unavailable for session {session_id}: {e}")
+            result_state = {"chat_response": UNAVAILABLE_MESSAGE}
+        except Exception as e:
+            logging.error(f"Graph execution error for session {session_id}: {e}")
+            yield sse_event("error", {"detail": f"Agent graph execution failed: {str(e)}"})
+            return
+
+        if result_state is None:
+            yield sse_event("error", {"detail": "Agent graph finished without producing a result."})
+            return
+
+        finalize_turn(current_state, result_state, code_before_run)
+        save_session_state(session_id, current_state)
+        yield sse_event("done", build_response(session_id, current_state, request.since_version))
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def terraform_step_failed(result: Dict) -> bool:
+    """A plan/apply failed if terraform exited non-zero, even when the tool reported no error message."""
+    return bool(result.get("error_message")) or result.get("exit_code", 0) != 0
+
+def record_plan_result(session_id: str, state: GraphState, plan_result: Dict):
+    state.update({key: value for key, value in plan_result.items() if key != "exit_code"})
+    state["apply_output"] = "" 
+    state["last_plan_status"] = "plan_failed" if terraform_step_failed(plan_result) else "planned"
+    save_session_state(session_id, state)
+
+def record_apply_result(session_id: str, state: GraphState, apply_result: Dict):
+    state.update({key: value for key, value in apply_result.items() if key != "exit_code"})
+    state["plan_output"] = "" 
+    state["last_plan_status"] = "apply_failed" if terraform_step_failed(apply_result) else "applied"
+    save_session_state(session_id, state)
+
+def check_can_run(kind: str, state: GraphState):
+    """Raises a 400 if the session is not ready for the requested terraform step."""
+    if kind == "plan" and not state.get("iac_code"):
+        raise HTTPException(status_code=400, detail="No IaC code available to plan.")
+    if kind == "apply" and not state.get("plan_output"):
+        raise HTTPException(status_code=400, detail="A plan must be generated before applying.")
+
+JOB_KINDS = {
+    "plan": (deployment_planning_tool, record_plan_result),
+    "apply": (execution_tool, record_apply_result),
+}
 
 @app.post("/api/plan")
 async def plan(request: ApiRequest):
-    session_id, current_state = get_session_state(request.session_id)
-    if not current_state.get("iac_code"):
-        raise HTTPException(status_code=400, detail="No IaC code available to plan.")
-    
-    plan_result = deployment_planning_tool(current_state)
-    current_state.update(plan_result)
-    current_state["apply_output"] = "" 
-    save_session_state(session_id, current_state)
-    
-    response_data = current_state.copy()
-    response_data["session_id"] = session_id
-    response_data["conversation_history"] = serialize_history(response_data["conversation_history"])
-    return response_data
+    session_id = resolve_session_id(request.session_id)
+    async with SESSION_STORE.lock(session_id):
+        _, current_state = await get_session_state(session_id)
+        check_can_run("plan", current_state)
+        async with TERRAFORM_SCHEDULER.slot(current_state["work_dir"]):
+            plan_result = await run_tool(deployment_planning_tool, current_state)
+        record_plan_result(session_id, current_state, plan_result)
+        return build_response(session_id, current_state, request.since_version)
 
 @app.post("/api/apply")
 async def apply(request: ApiRequest):
-    session_id, current_state = get_session_state(request.session_id)
-    if not current_state.get("plan_output"):
-         raise HTTPException(status_code=400, detail="A plan must be generated before applying.")
-    apply_result = execution_tool(current_state)
-    current_state.update(apply_result)
-    current_state["plan_output"] = "" 
-    save_session_state(session_id, current_state)
-    
-    response_data = current_state.copy()
-    response_data["session_id"] = session_id
-    response_data["conversation_history"] = serialize_history(response_data["conversation_history"])
-    return response_data
+    session_id = resolve_session_id(request.session_id)
+    async with SESSION_STORE.lock(session_id):
+        _, current_state = await get_session_state(session_id)
+        check_can_run("apply", current_state)
+        async with TERRAFORM_SCHEDULER.slot(current_state["work_dir"]):
+            apply_result = await run_tool(execution_tool, current_state)
+        record_apply_result(session_id, current_state, apply_result)
+        return build_response(session_id, current_state, request.since_version)
+
+# --- Background Terraform Jobs ---
+@app.post("/api/jobs")
+async def start_job(request: JobRequest):
+    """Starts a plan/apply run in the background and returns its job ID immediately."""
+    if request.kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind '{request.kind}'. Use 'plan' or 'apply'.")
+    session_id = resolve_session_id(request.session_id)
+    tool, record_result = JOB_KINDS[request.kind]
+
+    async def on_complete(job, result):
+        async with SESSION_STORE.lock(session_id):
+            _, state = await get_session_state(session_id)
+            record_result(session_id, state, result)
+
+    async with SESSION_STORE.lock(session_id):
+        _, current_state = await get_session_state(session_id)
+        check_can_run(request.kind, current_state)
+        # Checked and registered under the same lock, so a double-click cannot queue the job twice
+        existing = JOBS.active(session_id, request.kind)
+        if existing:
+            raise HTTPException(status_code=409, detail=f"A {request.kind} job is already queued or running for this session ({existing.id}).")
+        job = JOBS.start(session_id, request.kind, tool, current_state, on_complete=on_complete)
+    return job.to_dict(tail=0)
+
+def get_job_or_404(job_id: str):
+    job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str, tail: int = 100):
+    return get_job_or_404(job_id).to_dict(tail=tail)
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    return JOBS.cancel(job_id).to_dict(tail=0)
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, since: int = 0, since_version: Optional[str] = None):
+    """
+    Streams a job's output as Server-Sent Events: one `line` event per output line,
+    then a `done` event with the final job status and the updated session.
+    """
+    job = get_job_or_404(job_id)
+
+    async def event_stream():
+        async for seq, line in job.follow(since):
+            yield sse_event("line", {"seq": seq, "line": line})
+        _, state = await get_session_state(job.session_id)
+        yield sse_event("done", {"job": job.to_dict(tail=0), "session": build_response(job.session_id, state, since_version)})
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # --- Configuration & Session List Endpoints ---
 @app.post("/api/save_config")
@@ -211,31 +391,43 @@ async def get_config():
     }
 
 @app.get("/api/sessions")
-async def list_sessions():
-    sessions_dir = "sessions"
-    session_files = [f for f in os.listdir(sessions_dir) if f.endswith('.json')]
-    sessions_data = []
-    for filename in session_files:
-        session_id = filename.replace('.json', '')
-        filepath = os.path.join(sessions_dir, filename)
-        try:
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                history = data.get("conversation_history", [])
-                first_message = history[0]['content'] if history else "Empty Chat"
-                title = (first_message[:50] + '...') if len(first_message) > 50 else first_message
-                
-                sessions_data.append({
-                    "id": session_id,
-                    "title": title,
-                    "last_modified": os.path.getmtime(filepath)
-                })
-        except Exception as e:
-            logging.error(f"Could not read session file {filename}: {e}")
-            continue
-    # Sort by most recently modified
-    sessions_data.sort(key=lambda x: x['last_modified'], reverse=True)
-    return sessions_data
+async def list_sessions(cursor: Optional[str] = None, limit: int = 50, sort: str = "modified",
+                        order: Optional[str] = None, q: str = ""):
+    """
+    Pages through the session index. Pass the returned `next_cursor` back as `cursor`
+    for the next page; `sort` is one of modified, created, title or resources and `q`
+    filters by title.
+    """
+    try:
+        return await SESSION_STORE.list_sessions(
+            cursor=cursor, limit=max(1, min(limit, 200)), sort=sort, order=order, q=q.strip(),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/diagram_status")
+async def diagram_status(session_id: str):
+    """Whether the session's background diagram render has finished, and why it failed if it did."""
+    state = await SESSION_STORE.get(session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    return render_status(state["work_dir"])
+
+@app.get("/api/stats")
+async def stats():
+    """Runtime statistics for the agent's optimization layers."""
+    return {
+        "intent_classifier": INTENT_STATS.to_dict(), "llm_cache": LLM_CACHE.to_dict(),
+        "metrics_cache": METRICS_CACHE.to_dict(), "hcl_parse_cache": PARSE_CACHE.to_dict(),
+        "plan_cache": PLAN_CACHE.to_dict(), "terraform_scheduler": TERRAFORM_SCHEDULER.to_dict(),
+        "llm_models": describe_models(), "llm_resilience": resilience_stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus exposition of span, token and HTTP latency metrics."""
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
 
 # --- Static File Serving ---
 @app.get("/{full_path:path}")
@@ -0,0 +1,212 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+# Default look-back window and datapoint period; both can be overridden per call.
+METRICS_WINDOW_HOURS = float(os.getenv("METRICS_WINDOW_HOURS", "3"))
+METRICS_PERIOD_SECONDS = int(os.getenv("METRICS_PERIOD_SECONDS", "300"))
+# Fetched series are reused for this long (seconds) for the same resource/metric/window/period.
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "60"))
+# Point at a local CloudWatch fake (moto server, LocalStack) to run without AWS.
+CLOUDWATCH_ENDPOINT_URL = os.getenv("CLOUDWATCH_ENDPOINT_URL") or None
+
+# GetMetricData accepts at most this many queries per request.
+MAX_QUERIES_PER_CALL = 500
+
+# Metrics fetched together whenever a resource of a namespace is inspected:
+# (metric name, statistic). The dimension key identifies the resource.
+METRIC_PRESETS = {
+    "AWS/EC2": ("InstanceId", [
+        ("CPUUtilization", "Average"), ("CPUUtilization", "Maximum"),
+        ("NetworkIn", "Sum"), ("NetworkOut", "Sum"),
+        ("EBSReadOps", "Sum"), ("EBSWriteOps", "Sum"),
+        ("StatusCheckFailed", "Maximum"),
+    ]),
+    "AWS/RDS": ("DBInstanceIdentifier", [
+        ("CPUUtilization", "Average"), ("CPUUtilization", "Maximum"),
+        ("FreeableMemory", "Minimum"), ("DatabaseConnections", "Maximum"),
+        ("ReadLatency", "Average"), ("WriteLatency", "Average"),
+    ]),
+    "AWS/ApplicationELB": ("LoadBalancer", [
+        ("RequestCount", "Sum"), ("TargetResponseTime", "Average"),
+        ("HTTPCode_Target_5XX_Count", "Sum"), ("UnHealthyHostCount", "Maximum"),
+    ]),
+}
+
+
+@dataclass(frozen=True)
+class MetricQuery:
+    namespace: str
+    metric: str
+    stat: str
+    dimensions: Tuple[Tuple[str, str], ...]
+
+    @property
+    def resource_id(self) -> str:
+        return ",".join(value for _, value in self.dimensions)
+
+
+@dataclass
+class MetricSeries:
+    query: MetricQuery
+    timestamps: List[datetime] = field(default_factory=list)
+    values: List[float] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        return {
+            "resource_id": self.query.resource_id, "metric": self.query.metric, "stat": self.query.stat,
+            "datapoints": [{"Timestamp": ts, self.query.stat: value} for ts, value in zip(self.timestamps, self.values)],
+        }
+
+
+# --- Client pool ---
+_clients: Dict[Optional[str], object] = {}
+_clients_lock = threading.Lock()
+
+def get_client(region: Optional[str] = None):
+    """One CloudWatch client per region, created on first use and shared by all threads."""
+    region = region or os.getenv("AWS_DEFAULT_REGION")
+    with _clients_lock:
+        if region not in _clients:
+            _clients[region] = boto3.client(
+                "cloudwatch", region_name=region, endpoint_url=CLOUDWATCH_ENDPOINT_URL,
+                config=Config(retries={"max_attempts": 3, "mode": "adaptive"}, max_pool_connections=20),
+            )
+        return _clients[region]
+
+
+# --- Cache ---
+class MetricsCache:
+    """Short-TTL cache of fetched series keyed by (region, query, window, period)."""
+
+    def __init__(self, ttl: float = METRICS_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Tuple, Tuple[float, MetricSeries]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    def get(self, key: Tuple) -> Optional[MetricSeries]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or time.monotonic() - item[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Tuple, series: MetricSeries):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now, series)
+            # Expired entries are dropped on write so the cache never outgrows one TTL's worth of fetches
+            for stale in [k for k, (created, _) in self._entries.items() if now - created > self.ttl]:
+                del self._entries[stale]
+
+    def to_dict(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "api_calls": self.api_calls,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0, "entries": len(self._entries),
+        }
+
+
+METRICS_CACHE = MetricsCache()
+
+
+# --- Fetching ---
+def preset_queries(resource_id: str, namespace: str = "AWS/EC2", dimension_key: Optional[str] = None,
+                   extra_metrics: Optional[List[str]] = None) -> List[MetricQuery]:
+    """The standard batch of queries for one resource, plus any explicitly requested metrics."""
+    preset_key, metrics = METRIC_PRESETS.get(namespace, (dimension_key, []))
+    dimensions = ((dimension_key or preset_key, resource_id),)
+    pairs = list(metrics)
+    for metric in extra_metrics or []:
+        if not any(name == metric for name, _ in pairs):
+            pairs += [(metric, "Average"), (metric, "Maximum")]
+    return [MetricQuery(namespace, metric, stat, dimensions) for metric, stat in pairs]
+
+
+def fetch_metrics(queries: List[MetricQuery], window_hours: Optional[float] = None, period: Optional[int] = None,
+                  region: Optional[str] = None, client=None) -> List[MetricSeries]:
+    """
+    Fetches every query's series through batched GetMetricData calls, serving repeats
+    from the TTL cache. The window end is aligned to the period so that requests made
+    within the same period share cache entries. Returns series in query order.
+    """
+    window_hours = window_hours or METRICS_WINDOW_HOURS
+    period = period or METRICS_PERIOD_SECONDS
+    cache_keys = [(region, query, window_hours, period) for query in queries]
+    results: Dict[MetricQuery, MetricSeries] = {}
+    missing = []
+    for query, key in zip(queries, cache_keys):
+        cached = METRICS_CACHE.get(key)
+        if cached is not None:
+            results[query] = cached
+        elif query not in missing:
+            missing.append(query)
+
+    if missing:
+        end = int(time.time()) // period * period
+        start = end - int(window_hours * 3600)
+        client = client or get_client(region)
+        for offset in range(0, len(missing), MAX_QUERIES_PER_CALL):
+            batch = missing[offset:offset + MAX_QUERIES_PER_CALL]
+            for query, series in _get_metric_data(client, batch, start, end, period).items():
+                results[query] = series
+                METRICS_CACHE.set((region, query, window_hours, period), series)
+    return [results[query] for query in queries]
+
+
+def _get_metric_data(client, queries: List[MetricQuery], start: int, end: int, period: int) -> Dict[MetricQuery, MetricSeries]:
+    by_id = {f"q{i}": query for i, query in enumerate(queries)}
+    series = {query: MetricSeries(query) for query in queries}
+    request = {
+        "MetricDataQueries": [
+            {
+                "Id": query_id,
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": query.namespace, "MetricName": query.metric,
+                        "Dimensions": [{"Name": name, "Value": value} for name, value in query.dimensions],
+                    },
+                    "Period": period, "Stat": query.stat,
+                },
+                "ReturnData": True,
+            }
+            for query_id, query in by_id.items()
+        ],
+        "StartTime": datetime.fromtimestamp(start, tz=timezone.utc),
+        "EndTime": datetime.fromtimestamp(end, tz=timezone.utc),
+        "ScanBy": "TimestampAscending",
+    }
+    calls = 0
+    while True:
+        calls += 1
+        response = client.get_metric_data(**request)
+        for result in response.get("MetricDataResults", []):
+            target = series[by_id[result["Id"]]]
+            target.timestamps.extend(result.get("Timestamps", []))
+            target.values.extend(result.get("Values", []))
+        next_token = response.get("NextToken")
+        if not next_token:
+            break
+        request["NextToken"] = next_token
+
+    for item in series.values():
+        # Fakes and partial pages do not always honour ScanBy; keep every series ascending
+        if item.timestamps and any(a > b for a, b in zip(item.timestamps, item.timestamps[1:])):
+            pairs = sorted(zip(item.timestamps, item.values))
+            item.timestamps, item.values = [ts for ts, _ in pairs], [value for _, value in pairs]
+    METRICS_CACHE.api_calls += calls
+    logging.info(f"Fetched {len(queries)} CloudWatch series in {calls} GetMetricData call(s)")
+    return series
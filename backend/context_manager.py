@@ -0,0 +1,94 @@
+import os
+from typing import List
+
+from langchain_core.messages import BaseMessage
+
+# Number of most recent messages that are always sent verbatim.
+RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "8"))
+# Older messages are folded into the rolling summary once this many have aged out.
+SUMMARY_BATCH = int(os.getenv("CONTEXT_SUMMARY_BATCH", "6"))
+
+# Approximate prompt token budget for the conversation context of each node.
+DEFAULT_TOKEN_BUDGET = 6000
+NODE_TOKEN_BUDGETS = {
+    "intent_router": 1000,
+    "clarification_agent": 3000,
+    "debugging_agent": 3000,
+    "conversational_agent": 6000,
+    "generate_code": 8000,
+    "design_agent": 8000,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting."""
+    return len(text) // 4 + 1
+
+
+def format_message(msg: BaseMessage) -> str:
+    return f"{msg.type}: {msg.content}"
+
+
+def messages_pending_summary(state) -> List[BaseMessage]:
+    """Messages that have aged out of the verbatim window but are not yet summarized."""
+    history = state['conversation_history']
+    start = state.get("summarized_upto", 0)
+    end = max(start, len(history) - RECENT_MESSAGES)
+    return history[start:end]
+
+
+def needs_summary(state) -> bool:
+    return len(messages_pending_summary(state)) >= SUMMARY_BATCH
+
+
+def build_summary_prompt(state) -> str:
+    previous_summary = state.get("conversation_summary") or "(no summary yet)"
+    new_messages = "\n".join(format_message(msg) for msg in messages_pending_summary(state))
+    return f"""
+    You maintain a running summary of a conversation between a user and a DevOps assistant that writes Terraform for AWS.
+    Update the existing summary with the new messages. Keep every decision, requirement, resource name, resource ID,
+    region and open question; drop pleasantries and any code (the current main.tf is always provided separately).
+    Reply with the updated summary only, in at most 200 words.
+
+    Existing summary:
+    {previous_summary}
+
+    New messages:
+    {new_messages}
+    """
+
+
+def current_code_section(state) -> str:
+    """The session's current main.tf, provided to prompts instead of being inferred from chat."""
+    code = state.get("iac_code", "")
+    if not code or "Error" in code:
+        return "Current main.tf: (none yet)"
+    return f"Current main.tf:\n```hcl\n{code.strip()}\n```"
+
+
+def build_conversation_context(state, node: str, reserved_tokens: int = 0) -> str:
+    """
+    Renders the conversation for a node's prompt: the rolling summary of older turns
+    followed by as many recent messages as fit in the node's token budget (minus
+    `reserved_tokens` already used by other prompt sections). The latest message is
+    always included.
+    """
+    history = state['conversation_history']
+    budget = NODE_TOKEN_BUDGETS.get(node, DEFAULT_TOKEN_BUDGET) - reserved_tokens
+    summarized_upto = min(state.get("summarized_upto", 0), len(history))
+
+    summary = state.get("conversation_summary", "")
+    summary_section = f"Summary of earlier conversation:\n{summary}\n\n" if summary and summarized_upto else ""
+    budget -= estimate_tokens(summary_section)
+
+    lines = []
+    for index in range(len(history) - 1, summarized_upto - 1, -1):
+        line = format_message(history[index])
+        cost = estimate_tokens(line)
+        if lines and cost > budget:
+            break
+        lines.append(line)
+        budget -= cost
+    lines.reverse()
+
+    return summary_section + "\n".join(lines)
@@ -1,12 +1,228 @@
-
 import os
+import re
 import sys
-import hcl2
+import json
+import logging
 import traceback
+from collections import defaultdict
 from diagrams import Diagram, Cluster, Edge
-from diagrams.aws.compute import EC2, EC2AutoScaling
+from diagrams.aws.compute import EC2, EC2AutoScaling, Lambda
 from diagrams.aws.database import RDS
-from diagrams.aws.network import ELB, VPC, InternetGateway
+from diagrams.aws.network import ELB, VPC, InternetGateway, NATGateway
+from diagrams.aws.storage import S3
+
+from hcl_validation import parse_hcl, typed_blocks
+
+RESOURCE_MAP = {
+    "aws_instance": EC2, "aws_autoscaling_group": EC2AutoScaling, 
+    "aws_db_instance": RDS, "aws_rds_cluster": RDS, "aws_lb": ELB, "aws_alb": ELB, "aws_elb": ELB,
+    "aws_vpc": VPC, "aws_internet_gateway": InternetGateway, "aws_nat_gateway": NATGateway,
+    "aws_lambda_function": Lambda, "aws_s3_bucket": S3
+}
+
+# Layout tier of each drawn type; edges always point from a lower to a higher tier so
+# the diagram reads top-down from the internet edge to the data layer.
+TIERS = {
+    "aws_internet_gateway": 0, "aws_nat_gateway": 1, "aws_lb": 1, "aws_alb": 1, "aws_elb": 1,
+    "aws_autoscaling_group": 2, "aws_instance": 2, "aws_lambda_function": 2,
+    "aws_db_instance": 3, "aws_rds_cluster": 3, "aws_s3_bucket": 3, "aws_vpc": 0,
+}
+EDGE_LABELS = {
+    ("aws_lb", "aws_instance"): "routes traffic", ("aws_alb", "aws_instance"): "routes traffic",
+    ("aws_lb", "aws_autoscaling_group"): "routes traffic", ("aws_alb", "aws_autoscaling_group"): "routes traffic",
+    ("aws_instance", "aws_db_instance"): "SQL Connection", ("aws_instance", "aws_rds_cluster"): "SQL Connection",
+}
+CONTAINER_TYPES = ("aws_vpc", "aws_subnet")
+# Shared supporting resources that many others reference; connecting everything that
+# touches them would invent edges, so they are not contracted into drawn edges.
+SHARED_TYPE_PREFIXES = ("aws_security_group", "aws_route_table", "aws_iam_", "aws_key_pair", "aws_kms_")
+
+# Upper bound on drawn edges so graphviz layout stays fast for large stacks.
+MAX_DIAGRAM_EDGES = int(os.getenv("MAX_DIAGRAM_EDGES", "150"))
+
+# Matches `aws_x.y` and `data.aws_x.y` references inside interpolations and depends_on.
+REFERENCE_RE = re.compile(r"(?<![\w.])(data\.)?([a-z][a-z0-9]*_[a-z0-9_]+)\.([A-Za-z_][\w-]*)")
+
+def collect_resources(tf_data: dict, all_resources: dict = None) -> dict:
+    """Indexes the `resource` blocks of a parsed HCL document as {type: {name: config}}."""
+    all_resources = {} if all_resources is None else all_resources
+    for r_type, r_name, r_config in typed_blocks(tf_data or {}, "resource"):
+        all_resources.setdefault(r_type, {})[r_name] = r_config
+    return all_resources
+
+def load_resources(tf_files_dir: str) -> dict:
+    """Parses every .tf file under a directory and collects its resources."""
+    all_resources = {}
+    for root, _, files in os.walk(tf_files_dir):
+        for filename in files:
+            if filename.endswith(".tf"):
+                filepath = os.path.join(root, filename)
+                try:
+                    with open(filepath, 'r', encoding='utf-8') as f:
+                        collect_resources(parse_hcl(f.read()), all_resources)
+                except Exception:
+                    continue
+    return all_resources
+
+def build_dependency_graph(all_resources: dict):
+    """
+    Resolves `${aws_x.y.attr}` references and `depends_on` entries between resources.
+    Returns the resource index {address: (type, name)} and a dict mapping each address
+    to the set of addresses it depends on.
+    """
+    index = {f"{r_type}.{r_name}": (r_type, r_name) for r_type, configs in all_resources.items() for r_name in configs}
+    dependencies = {address: set() for address in index}
+    for address, (r_type, r_name) in index.items():
+        config_text = json.dumps(all_resources[r_type][r_name], default=str)
+        for is_data, ref_type, ref_name in REFERENCE_RE.findall(config_text):
+            target = f"{ref_type}.{ref_name}"
+            if not is_data and target in index and target != address:
+                dependencies[address].add(target)
+    return index, dependencies
+
+
+def _container_of(address, index, dependencies):
+    """The subnet or VPC a resource lives in, looking through one undrawn hop (e.g. a security group)."""
+    direct = dependencies[address]
+    for container_type in CONTAINER_TYPES[::-1]:
+        for target in sorted(direct):
+            if index[target][0] == container_type:
+                return target
+    for via in sorted(direct):
+        if index[via][0] not in RESOURCE_MAP and index[via][0] not in CONTAINER_TYPES:
+            for target in sorted(dependencies[via]):
+                if index[target][0] in CONTAINER_TYPES:
+                    return target
+    return None
+
+
+def extract_architecture(all_resources: dict) -> dict:
+    """
+    Builds the drawable architecture: the nodes to draw, their VPC/subnet clusters
+    and a bounded list of (source, target, label) edges. Edges come from direct
+    references between drawn resources, plus references that pass through undrawn
+    glue resources (target groups, attachments, listeners...), which are contracted.
+    """
+    index, dependencies = build_dependency_graph(all_resources)
+    drawn = {address for address, (r_type, _) in index.items() if r_type in RESOURCE_MAP}
+    containers = {address for address, (r_type, _) in index.items() if r_type in CONTAINER_TYPES}
+
+    # Clusters: subnets nest inside the VPC they reference; other resources go in their subnet or VPC
+    parent = {}
+    for address in containers | drawn:
+        if index[address][0] == "aws_vpc":
+            continue
+        container = _container_of(address, index, dependencies)
+        if container and container != address:
+            parent[address] = container
+    members = defaultdict(list)
+    for address, container in parent.items():
+        members[container].append(address)
+    # A VPC with nothing inside is drawn as a plain node rather than an empty cluster
+    cluster_vpcs = {address for address in containers if index[address][0] == "aws_vpc" and members[address]}
+    drawn -= cluster_vpcs
+
+    def ordered(a, b):
+        tier_a, tier_b = TIERS.get(index[a][0], 2), TIERS.get(index[b][0], 2)
+        return (b, a) if tier_b < tier_a else (a, b)
+
+    edges = []
+    seen = set()
+    truncated = False
+    def add_edge(a, b):
+        nonlocal truncated
+        if len(edges) >= MAX_DIAGRAM_EDGES:
+            truncated = True
+            return
+        source, target = ordered(a, b)
+        if source != target and (source, target) not in seen:
+            seen.add((source, target))
+            label = EDGE_LABELS.get((index[source][0], index[target][0]))
+            edges.append((source, target, label))
+
+    for address in sorted(drawn):
+        for target in sorted(dependencies[address]):
+            if target in drawn:
+                add_edge(address, target)
+
+    # Contract connected groups of undrawn, non-container resources into drawn-to-drawn edges
+    glue = {
+        address for address, (r_type, _) in index.items()
+        if address not in drawn and address not in containers and not r_type.startswith(SHARED_TYPE_PREFIXES)
+    }
+    neighbours = defaultdict(set)
+    for address, targets in dependencies.items():
+        for target in targets:
+            neighbours[address].add(target)
+            neighbours[target].add(address)
+    visited = set()
+    for start in sorted(glue):
+        if start in visited:
+            continue
+        component, stack, touching = set(), [start], set()
+        while stack:
+            current = stack.pop()
+            if current in component:
+                continue
+            component.add(current)
+            for other in neighbours[current]:
+                if other in glue:
+                    stack.append(other)
+                elif other in drawn:
+                    touching.add(other)
+        visited |= component
+        touching = sorted(touching, key=lambda a: (TIERS.get(index[a][0], 2), a))
+        for i, a in enumerate(touching):
+            if truncated:
+                break
+            for b in touching[i + 1:]:
+                if TIERS.get(index[a][0], 2) != TIERS.get(index[b][0], 2):
+                    add_edge(a, b)
+
+    if truncated:
+        logging.warning(f"Diagram edge budget reached; drawing only the first {MAX_DIAGRAM_EDGES} edges.")
+    return {
+        "index": index, "drawn": drawn, "parent": parent, "members": members,
+        "cluster_vpcs": cluster_vpcs, "edges": edges,
+    }
+
+
+def render_diagram(all_resources: dict, diagram_path: str):
+    """Renders the architecture diagram to `<diagram_path>.png`."""
+    architecture = extract_architecture(all_resources)
+    index, drawn, members = architecture["index"], architecture["drawn"], architecture["members"]
+    parent, cluster_vpcs = architecture["parent"], architecture["cluster_vpcs"]
+
+    with Diagram("Cloud Architecture", filename=diagram_path, show=False, outformat="png", direction="TB", graph_attr={"bgcolor": "transparent", "pad": "0.5"}):
+        nodes = {}
+
+        def draw_members(container):
+            for address in sorted(members[container]):
+                r_type, r_name = index[address]
+                if r_type == "aws_subnet":
+                    with Cluster(f"Subnet {r_name}"):
+                        draw_members(address)
+                elif address in drawn:
+                    nodes[address] = RESOURCE_MAP[r_type](r_name)
+
+        for vpc in sorted(cluster_vpcs):
+            with Cluster(f"VPC {index[vpc][1]}"):
+                draw_members(vpc)
+        # Subnets whose VPC is not managed in this configuration
+        for address in sorted(members):
+            if index[address][0] == "aws_subnet" and address not in parent:
+                with Cluster(f"Subnet {index[address][1]}"):
+                    draw_members(address)
+        for address in sorted(drawn):
+            if address not in nodes:
+                r_type, r_name = index[address]
+                nodes[address] = RESOURCE_MAP[r_type](r_name)
+
+        for source, target, label in architecture["edges"]:
+            if label:
+                nodes[source] >> Edge(label=label) >> nodes[target]
+            else:
+                nodes[source] >> nodes[target]
 
 def main():
     """Main function to handle logic and error catching."""
@@ -21,63 +237,14 @@ def main():
         
     try:
         
-        all_resources = {}
-        for root, _, files in os.walk(tf_files_dir):
-            for filename in files:
-                if filename.endswith(".tf"):
-                    filepath = os.path.join(root, filename)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            tf_data = hcl2.load(f)
-                            if tf_data and 'resource' in tf_data:
-                                for resource_block in tf_data['resource']:
-                                    for r_type, r_configs in resource_block.items():
-                                        if r_type not in all_resources:
-                                            all_resources[r_type] = {}
-                                        for r_name, r_config in r_configs.items():
-                                            all_resources[r_type][r_name] = r_config
-                    except Exception:
-                       
-                        continue
+        all_resources = load_resources(tf_files_dir)
         
         if not all_resources:
             print("") 
             return
 
         diagram_path = os.path.join(tf_files_dir, "architecture_diagram")
-        
-        with Diagram("Cloud Architecture", filename=diagram_path, show=False, outformat="png", direction="TB", graph_attr={"bgcolor": "transparent", "pad": "0.5"}):
-            
-            nodes = {r_type: {} for r_type in all_resources.keys()}
-            
-            
-            RESOURCE_MAP = {
-                "aws_instance": EC2, "aws_autoscaling_group": EC2AutoScaling, 
-                "aws_db_instance": RDS, "aws_lb": ELB, "aws_alb": ELB, 
-                "aws_vpc": VPC, "aws_internet_gateway": InternetGateway
-            }
-
-            for r_type, r_details in all_resources.items():
-                if r_type in RESOURCE_MAP:
-                    for r_name in r_details.keys():
-                        nodes[r_type][r_name] = RESOURCE_MAP[r_type](r_name)
-
-            if 'aws_internet_gateway' in nodes and 'aws_lb' in nodes:
-                for igw in nodes['aws_internet_gateway'].values():
-                    for lb in nodes['aws_lb'].values():
-                        igw >> lb
-
-            if 'aws_lb' in nodes and 'aws_instance' in nodes:
-                 for lb in nodes['aws_lb'].values():
-                    for instance in nodes['aws_instance'].values():
-                        lb >> Edge(label="routes traffic") >> instance
-            
-            if 'aws_instance' in nodes and 'aws_db_instance' in nodes:
-                 for instance in nodes['aws_instance'].values():
-                    for rds in nodes['aws_db_instance'].values():
-                        instance >> Edge(label="SQL Connection") >> rds
-
-
+        render_diagram(all_resources, diagram_path)
         
         print(f"{diagram_path}.png")
 
@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import contextvars
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+# Imported once at startup so each render reuses the warm `diagrams`/graphviz modules
+# instead of paying interpreter startup and imports in a subprocess.
+import diagram_generator
+
+DIAGRAM_BASENAME = "architecture_diagram"
+HASH_FILE = ".diagram_hash"
+
+# Renders are serialized on one background thread, off the request path.
+DIAGRAM_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diagram-renderer")
+
+# Latest requested graph hash per work dir, so superseded renders can be skipped.
+_latest_requests = {}
+# Outcome of the latest render per work dir: {"status": "rendering"|"ready"|"failed", "error": str}
+_render_status: Dict[str, Dict[str, str]] = {}
+_lock = threading.Lock()
+
+
+def resource_graph_hash(all_resources: dict) -> str:
+    return hashlib.sha256(json.dumps(all_resources, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _read_hash(work_dir: str) -> str:
+    try:
+        with open(os.path.join(work_dir, HASH_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _set_status(work_dir: str, graph_hash: str, status: str, error: str = ""):
+    """Records a render outcome unless a newer request for the work dir superseded it."""
+    with _lock:
+        if _latest_requests.get(work_dir) == graph_hash:
+            _render_status[work_dir] = {"status": status, "error": error}
+
+
+def render_status(work_dir: str) -> Dict[str, str]:
+    """Outcome of the work dir's latest diagram render; status is "none" if none was requested."""
+    with _lock:
+        return dict(_render_status.get(work_dir, {"status": "none", "error": ""}))
+
+
+def _render(work_dir: str, all_resources: dict, graph_hash: str):
+    with _lock:
+        if _latest_requests.get(work_dir) != graph_hash:
+            logging.info(f"Skipping superseded diagram render for {work_dir}")
+            return
+    error_log_path = os.path.join(work_dir, "diagram_error.log")
+    tmp_path = os.path.join(work_dir, f"{DIAGRAM_BASENAME}.rendering")
+    try:
+        diagram_generator.render_diagram(all_resources, tmp_path)
+        # Swap the finished PNG in atomically so clients never load a partial file
+        os.replace(f"{tmp_path}.png", os.path.join(work_dir, f"{DIAGRAM_BASENAME}.png"))
+        with open(os.path.join(work_dir, HASH_FILE), "w") as f:
+            f.write(graph_hash)
+        if os.path.exists(error_log_path):
+            os.remove(error_log_path)
+        _set_status(work_dir, graph_hash, "ready")
+        logging.info(f"Diagram rendered for {work_dir}")
+    except Exception as e:
+        logging.error(f"Diagram rendering failed for {work_dir}: {e}")
+        _set_status(work_dir, graph_hash, "failed", f"{type(e).__name__}: {e}")
+        with open(error_log_path, "w") as f:
+            f.write("An error occurred while rendering the diagram:\n\n")
+            f.write(traceback.format_exc())
+    finally:
+        # Leftovers of a failed render: the graphviz source and a partial PNG
+        for leftover in (tmp_path, f"{tmp_path}.png"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def request_render(work_dir: str, parsed_hcl: Optional[dict] = None) -> str:
+    """
+    Schedules a background render of the work dir's architecture diagram and returns
+    the path the PNG will be written to, or "" if there is nothing to draw. Uses the
+    already-parsed HCL when available and skips rendering when the resource graph is
+    unchanged since the last successful render. `render_status` reports whether the
+    PNG has appeared or why rendering failed.
+    """
+    if parsed_hcl is not None:
+        all_resources = diagram_generator.collect_resources(parsed_hcl)
+    else:
+        all_resources = diagram_generator.load_resources(work_dir)
+    if not all_resources:
+        with _lock:
+            _latest_requests.pop(work_dir, None)
+            _render_status.pop(work_dir, None)
+        return ""
+
+    diagram_path = os.path.join(work_dir, f"{DIAGRAM_BASENAME}.png")
+    graph_hash = resource_graph_hash(all_resources)
+    if graph_hash == _read_hash(work_dir) and os.path.exists(diagram_path):
+        logging.info(f"Resource graph unchanged; reusing diagram for {work_dir}")
+        with _lock:
+            _latest_requests[work_dir] = graph_hash
+            _render_status[work_dir] = {"status": "ready", "error": ""}
+        return diagram_path
+
+    with _lock:
+        _latest_requests[work_dir] = graph_hash
+        _render_status[work_dir] = {"status": "rendering", "error": ""}
+    # Drop the stale image so clients wait for the new one instead of showing the old graph
+    if os.path.exists(diagram_path):
+        os.remove(diagram_path)
+    # Carries the trace ID into the render thread's logs
+    DIAGRAM_EXECUTOR.submit(contextvars.copy_context().run, _render, work_dir, all_resources, graph_hash)
+    return diagram_path
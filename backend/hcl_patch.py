@@ -0,0 +1,125 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+class PatchError(Exception):
+    """Raised when a block-level patch cannot be applied to the existing HCL."""
+
+
+@dataclass
+class Block:
+    address: str  # e.g. "aws_instance.web", "data.aws_ami.ubuntu", "provider.aws", "terraform"
+    start: int
+    end: int      # Exclusive offset, just after the closing brace
+
+
+HEADER_TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|([A-Za-z_][\w-]*)')
+HEREDOC_RE = re.compile(r'<<-?\s*([A-Za-z_]\w*)\n')
+
+
+def block_address(header_tokens: List[str]) -> Optional[str]:
+    """Maps a block header to the address used in patch operations."""
+    if not header_tokens:
+        return None
+    block_type, labels = header_tokens[0], header_tokens[1:]
+    if block_type == "resource" and len(labels) == 2:
+        return f"{labels[0]}.{labels[1]}"
+    if block_type == "data" and len(labels) == 2:
+        return f"data.{labels[0]}.{labels[1]}"
+    return ".".join([block_type, *labels])
+
+
+def normalize_address(address: str) -> str:
+    address = address.strip()
+    return address[len("resource."):] if address.startswith("resource.") else address
+
+
+def split_blocks(code: str) -> List[Block]:
+    """
+    Locates the top-level blocks of an HCL file without a full parse. Strings,
+    comments and heredocs are skipped so braces inside them are not counted.
+    """
+    blocks = []
+    depth = 0
+    header_start = None
+    block_start = None
+    i, n = 0, len(code)
+    while i < n:
+        ch = code[i]
+        if ch == '"':
+            i += 1
+            while i < n and code[i] != '"':
+                i += 2 if code[i] == "\\" else 1
+        elif ch == "#" or code.startswith("//", i):
+            newline = code.find("\n", i)
+            i = n if newline == -1 else newline
+            continue
+        elif code.startswith("/*", i):
+            close = code.find("*/", i + 2)
+            i = n if close == -1 else close + 2
+            continue
+        elif code.startswith("<<", i) and (heredoc := HEREDOC_RE.match(code, i)):
+            terminator = re.compile(rf"^\s*{re.escape(heredoc.group(1))}\s*$", re.MULTILINE)
+            end = terminator.search(code, heredoc.end())
+            i = n if end is None else end.end()
+            continue
+        elif depth == 0 and not ch.isspace() and ch not in "{}" and header_start is None:
+            header_start = i
+        elif ch == "{":
+            if depth == 0:
+                block_start = header_start if header_start is not None else i
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth < 0:
+                raise PatchError("Unbalanced closing brace in HCL.")
+            if depth == 0:
+                header = code[block_start:code.index("{", block_start)]
+                tokens = [quoted if quoted else bare for quoted, bare in HEADER_TOKEN_RE.findall(header)]
+                address = block_address(tokens)
+                if address:
+                    blocks.append(Block(address, block_start, i + 1))
+                header_start = None
+        i += 1
+    if depth != 0:
+        raise PatchError("Unbalanced braces in HCL.")
+    return blocks
+
+
+def apply_patch(code: str, operations: List[dict]) -> str:
+    """
+    Applies block-level operations to `code` and returns the new file. Each operation is
+    {"op": "add" | "replace" | "remove", "address": "aws_instance.web", "hcl": "<block>"}.
+    Unchanged blocks are carried over byte for byte.
+    """
+    for operation in operations:
+        op = operation.get("op")
+        address = normalize_address(operation.get("address", ""))
+        new_block = (operation.get("hcl") or "").strip()
+        blocks = {block.address: block for block in split_blocks(code)}
+
+        if op in ("add", "replace") and not new_block:
+            raise PatchError(f"Operation '{op}' on {address} has no HCL.")
+        if op in ("add", "replace"):
+            new_blocks = split_blocks(new_block)
+            if len(new_blocks) != 1 or new_blocks[0].address != address:
+                raise PatchError(f"Operation '{op}' on {address} must contain exactly that one block.")
+
+        if op == "add":
+            if address in blocks:
+                raise PatchError(f"Cannot add {address}: it already exists.")
+            code = f"{code.rstrip()}\n\n{new_block}\n"
+        elif op == "replace":
+            if address not in blocks:
+                raise PatchError(f"Cannot replace {address}: it does not exist.")
+            block = blocks[address]
+            code = code[:block.start] + new_block + code[block.end:]
+        elif op == "remove":
+            if address not in blocks:
+                raise PatchError(f"Cannot remove {address}: it does not exist.")
+            block = blocks[address]
+            code = code[:block.start].rstrip() + "\n\n" + code[block.end:].lstrip()
+        else:
+            raise PatchError(f"Unknown patch operation '{op}'.")
+    return code.strip() + "\n"
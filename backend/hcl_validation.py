@@ -0,0 +1,152 @@
+import io
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+import hcl2
+
+# Parsed documents kept in memory, keyed by a hash of the source text.
+HCL_PARSE_CACHE_SIZE = int(os.getenv("HCL_PARSE_CACHE_SIZE", "64"))
+
+# `var.x`, `local.x`, `module.x`, `data.type.name` and `type.name` references inside expressions
+REFERENCE_RE = re.compile(r"(?<![\w.])(var|local|module|data\.[a-z][a-z0-9_]*|[a-z][a-z0-9]*_[a-z0-9_]+)\.([A-Za-z_][\w-]*)")
+INTERPOLATION_RE = re.compile(r"\$\{(.*?)\}", re.DOTALL)
+
+
+class ParseCache:
+    """LRU of parsed HCL keyed by content hash. Cached documents are shared; treat them as read-only."""
+
+    def __init__(self, max_entries: int = HCL_PARSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, hcl_code: str) -> dict:
+        key = hashlib.sha256(hcl_code.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # Parse outside the lock; a concurrent parse of the same text just stores the same result twice
+        with io.StringIO(hcl_code) as f:
+            parsed = hcl2.load(f)
+        with self._lock:
+            self._entries[key] = parsed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return parsed
+
+    def to_dict(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+PARSE_CACHE = ParseCache()
+
+
+def parse_hcl(hcl_code: str) -> dict:
+    """Parses HCL through the shared cache; raises the hcl2 error on invalid syntax."""
+    return PARSE_CACHE.parse(hcl_code)
+
+
+# --- Structured checks ---
+# Newer python-hcl2 releases keep the quotes around block labels and mark block bodies
+# with "__is_block__"; both layouts are accepted.
+BLOCK_MARKER = "__is_block__"
+
+def _label(label: str) -> str:
+    return label.strip('"')
+
+
+def _blocks(parsed: dict, section: str) -> Iterator[Tuple[str, dict]]:
+    """(label, body) for single-label blocks such as provider, variable, module."""
+    for block in parsed.get(section, []):
+        for label, body in block.items():
+            if label != BLOCK_MARKER:
+                yield _label(label), body if isinstance(body, dict) else {}
+
+
+def typed_blocks(parsed: dict, section: str) -> Iterator[Tuple[str, str, dict]]:
+    """(type, name, body) for two-label blocks: resource and data."""
+    for block in parsed.get(section, []):
+        for r_type, configs in block.items():
+            if r_type == BLOCK_MARKER or not isinstance(configs, dict):
+                continue
+            for r_name, body in configs.items():
+                if r_name != BLOCK_MARKER:
+                    yield _label(r_type), _label(r_name), body if isinstance(body, dict) else {}
+
+
+def _expressions(parsed: dict) -> Iterator[str]:
+    """The contents of every `${...}` interpolation in the document."""
+    text = json.dumps(parsed, default=str)
+    for match in INTERPOLATION_RE.finditer(text):
+        yield match.group(1)
+
+
+def find_issues(parsed: dict) -> List[str]:
+    """
+    Checks a parsed document for problems a syntax-only parse misses: no provider
+    configuration, an AWS provider without a region, duplicate resource/data
+    addresses, and references to variables, locals, modules, resources or data
+    sources that are not declared.
+    """
+    issues = []
+    providers = list(_blocks(parsed, "provider"))
+    if not providers and not parsed.get("terraform"):
+        issues.append("No provider or terraform block is configured.")
+    for name, body in providers:
+        if name == "aws" and not body.get("region"):
+            issues.append('The "aws" provider block does not set a region.')
+
+    declared = {"var": set(), "local": set(), "module": set()}
+    declared["var"].update(name for name, _ in _blocks(parsed, "variable"))
+    declared["module"].update(name for name, _ in _blocks(parsed, "module"))
+    for block in parsed.get("locals", []):
+        declared["local"].update(key for key in block if key != BLOCK_MARKER)
+
+    addresses = set()
+    for section, prefix in (("resource", ""), ("data", "data.")):
+        seen = set()
+        for r_type, r_name, _ in typed_blocks(parsed, section):
+            address = f"{prefix}{r_type}.{r_name}"
+            if address in seen:
+                issues.append(f"Duplicate block address {address}.")
+            seen.add(address)
+        addresses |= seen
+    # Only check resource-style references whose provider prefix is in use; this keeps
+    # iterator names in dynamic blocks (e.g. `setting.value`) from being flagged.
+    prefixes = {address.split("_", 1)[0].removeprefix("data.") for address in addresses}
+    prefixes.update(name for name, _ in providers)
+
+    dangling = []
+    for expression in _expressions(parsed):
+        for kind, name in REFERENCE_RE.findall(expression):
+            reference = f"{kind}.{name}"
+            if kind in declared:
+                ok = name in declared[kind]
+            elif kind.startswith("data.") or kind.split("_", 1)[0] in prefixes:
+                ok = reference in addresses
+            else:
+                continue
+            if not ok and reference not in dangling:
+                dangling.append(reference)
+    issues += [f"Reference to undeclared {reference}." for reference in dangling]
+    return issues
+
+
+def check_hcl(hcl_code: str) -> Tuple[dict, List[str]]:
+    """Parses once (cached) and runs the structured checks. Raises on syntax errors."""
+    parsed = parse_hcl(hcl_code)
+    return parsed, find_issues(parsed)
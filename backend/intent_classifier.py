@@ -0,0 +1,165 @@
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+CODE_MODIFICATION = "CODE_MODIFICATION"
+DEBUGGING_INQUIRY = "DEBUGGING_INQUIRY"
+GENERAL_CHAT = "GENERAL_CHAT"
+INTENTS = (CODE_MODIFICATION, DEBUGGING_INQUIRY, GENERAL_CHAT)
+
+# Minimum confidence for a local prediction to be used instead of the LLM router.
+FAST_PATH_ENABLED = os.getenv("INTENT_FAST_PATH", "1").lower() not in ("0", "false", "no")
+FAST_PATH_THRESHOLD = float(os.getenv("INTENT_FAST_PATH_THRESHOLD", "0.85"))
+# Optional scikit-learn style pipeline (joblib file) exposing predict_proba() and classes_.
+LOCAL_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "")
+
+
+@dataclass
+class Prediction:
+    intent: str
+    confidence: float
+    source: str
+
+
+# --- Rule definitions ---
+
+SMALL_TALK_RE = re.compile(
+    r"^\s*(hi|hello|hey|yo|thanks|thank you|thank you so much|thx|ty|cheers|ok|okay|cool|great|nice|awesome|"
+    r"perfect|got it|bye|goodbye|good (morning|afternoon|evening))[\s!.,:)]*$",
+    re.IGNORECASE,
+)
+RESOURCE_ID_RE = re.compile(
+    r"\b(i-[0-9a-f]{8,17}|vol-[0-9a-f]{8,17}|sg-[0-9a-f]{8,17}|subnet-[0-9a-f]{8,17}|vpc-[0-9a-f]{8,17}|"
+    r"eni-[0-9a-f]{8,17}|nat-[0-9a-f]{8,17}|arn:aws:[a-z0-9-]+:[^\s]+)\b",
+    re.IGNORECASE,
+)
+HEALTH_WORDS_RE = re.compile(
+    r"\b(slow|slowness|cpu|memory|load|latency|status|health|healthy|down|running|traffic|errors?|"
+    r"metrics?|utili[sz]ation|performance|throttl\w*|spik\w*|unreachable|responding|why is)\b",
+    re.IGNORECASE,
+)
+CHANGE_VERBS_RE = re.compile(
+    r"\b(create|add|remove|delete|destroy|deploy|provision|change|update|modify|rename|resize|attach|"
+    r"detach|replace|increase|decrease|enable|disable|spin up|set up|setup|build|make)\b",
+    re.IGNORECASE,
+)
+DEPLOY_RE = re.compile(r"^\s*(please\s+)?(deploy|apply|ship)\b.*\b(changes?|it|this|infrastructure|code)\b", re.IGNORECASE)
+RESOURCE_NOUNS_RE = re.compile(
+    r"\b(s3|bucket|ec2|instances?|vpc|subnets?|security group|rds|database|db|load balancer|alb|elb|lambda|"
+    r"dynamodb|table|iam|role|policy|cloudfront|route ?53|internet gateway|nat gateway|autoscaling|asg|"
+    r"eks|ecs|cluster|queue|sqs|sns|topic|ebs|volume|terraform|main\.tf)\b",
+    re.IGNORECASE,
+)
+QUESTION_RE = re.compile(
+    r"^\s*(what|what's|whats|why|how|explain|describe|tell me|can you explain|difference between|"
+    r"when should|should i|is it)\b",
+    re.IGNORECASE,
+)
+
+
+def rule_based_prediction(message: str) -> Optional[Prediction]:
+    """Classifies unambiguous messages with keyword/regex rules; returns None when unsure."""
+    text = message.strip()
+    if not text:
+        return None
+
+    if SMALL_TALK_RE.match(text):
+        return Prediction(GENERAL_CHAT, 0.97, "rules")
+
+    has_resource_id = bool(RESOURCE_ID_RE.search(text))
+    has_change_verb = bool(CHANGE_VERBS_RE.search(text))
+    has_resource_noun = bool(RESOURCE_NOUNS_RE.search(text))
+
+    if DEPLOY_RE.match(text):
+        return Prediction(CODE_MODIFICATION, 0.93, "rules")
+
+    if has_resource_id and not has_change_verb:
+        confidence = 0.95 if HEALTH_WORDS_RE.search(text) else 0.87
+        return Prediction(DEBUGGING_INQUIRY, confidence, "rules")
+
+    if has_change_verb and has_resource_noun and not has_resource_id and not QUESTION_RE.match(text):
+        return Prediction(CODE_MODIFICATION, 0.9, "rules")
+
+    if QUESTION_RE.match(text) and not has_resource_id and not has_change_verb and not HEALTH_WORDS_RE.search(text):
+        return Prediction(GENERAL_CHAT, 0.86, "rules")
+
+    return None
+
+
+# --- Optional local model ---
+
+_local_model = None
+if LOCAL_MODEL_PATH:
+    try:
+        import joblib
+        _local_model = joblib.load(LOCAL_MODEL_PATH)
+        logging.info(f"Loaded local intent model from {LOCAL_MODEL_PATH}")
+    except Exception as e:
+        logging.warning(f"Local intent model could not be loaded from {LOCAL_MODEL_PATH}: {e}")
+
+
+def model_prediction(message: str) -> Optional[Prediction]:
+    if _local_model is None:
+        return None
+    try:
+        probabilities = _local_model.predict_proba([message])[0]
+        best = max(range(len(probabilities)), key=lambda i: probabilities[i])
+        intent = str(_local_model.classes_[best])
+        if intent not in INTENTS:
+            return None
+        return Prediction(intent, float(probabilities[best]), "model")
+    except Exception as e:
+        logging.warning(f"Local intent model prediction failed: {e}")
+        return None
+
+
+# --- Stats ---
+
+class IntentStats:
+    """Counts how many turns were resolved locally versus by the LLM router."""
+
+    def __init__(self):
+        self.total = 0
+        self.fast_path_hits = {"rules": 0, "model": 0}
+        self.by_intent = {intent: 0 for intent in INTENTS}
+        self.llm_fallbacks = 0
+
+    def record(self, prediction: Optional[Prediction]):
+        self.total += 1
+        if prediction:
+            self.fast_path_hits[prediction.source] += 1
+            self.by_intent[prediction.intent] += 1
+        else:
+            self.llm_fallbacks += 1
+
+    @property
+    def hit_rate(self) -> float:
+        return (sum(self.fast_path_hits.values()) / self.total) if self.total else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total, "fast_path_hits": dict(self.fast_path_hits),
+            "fast_path_by_intent": dict(self.by_intent), "llm_fallbacks": self.llm_fallbacks,
+            "hit_rate": round(self.hit_rate, 4),
+        }
+
+
+INTENT_STATS = IntentStats()
+
+
+def classify_locally(message: str) -> Optional[Prediction]:
+    """
+    Returns a confident local prediction for the message, or None if the LLM router
+    should decide. Every call is counted in INTENT_STATS.
+    """
+    prediction = None
+    if FAST_PATH_ENABLED:
+        candidates = [p for p in (rule_based_prediction(message), model_prediction(message)) if p]
+        confident = [p for p in candidates if p.confidence >= FAST_PATH_THRESHOLD]
+        # Only trust the fast path when confident predictions agree with each other
+        if confident and len({p.intent for p in confident}) == 1:
+            prediction = max(confident, key=lambda p: p.confidence)
+    INTENT_STATS.record(prediction)
+    return prediction
@@ -0,0 +1,167 @@
+import os
+import uuid
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import deque, OrderedDict
+from typing import Callable, Dict, Optional
+
+from agent_logic import run_tool
+from terraform_scheduler import TERRAFORM_SCHEDULER
+
+# Lines of log kept per job (ring buffer) and number of finished jobs remembered.
+JOB_LOG_MAX_LINES = int(os.getenv("JOB_LOG_MAX_LINES", "2000"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "200"))
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class Job:
+    """A background terraform plan/apply run with a bounded, followable log."""
+
+    def __init__(self, session_id: str, kind: str):
+        self.id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.kind = kind
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.lines = deque(maxlen=JOB_LOG_MAX_LINES)
+        self.line_count = 0  # Total lines ever produced; sequence number of the next line
+        self.cancel_event = threading.Event()
+        self.task: Optional[asyncio.Task] = None
+        self._loop = asyncio.get_running_loop()
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def append_line(self, line: str):
+        """Thread-safe: called from the worker thread running terraform."""
+        self._loop.call_soon_threadsafe(self._publish, line)
+
+    def _publish(self, line: Optional[str] = None):
+        if line is not None:
+            self.lines.append((self.line_count, line))
+            self.line_count += 1
+        # Wake every follower, then arm a fresh event for the next update
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def lines_since(self, since: int) -> list:
+        return [line for seq, line in self.lines if seq >= since]
+
+    async def follow(self, since: int = 0):
+        """Yields (sequence, line) pairs as they are produced until the job finishes."""
+        while True:
+            updated = self._updated
+            first_seq = self.lines[0][0] if self.lines else self.line_count
+            if since < first_seq:
+                yield since, f"... ({first_seq - since} lines dropped from log buffer)"
+                since = first_seq
+            for seq, line in list(self.lines):
+                if seq >= since:
+                    yield seq, line
+                    since = seq + 1
+            if self.finished:
+                return
+            await updated.wait()
+
+    def to_dict(self, tail: int = 100) -> Dict:
+        return {
+            "job_id": self.id, "session_id": self.session_id, "kind": self.kind,
+            "status": self.status, "created_at": self.created_at,
+            "started_at": self.started_at, "finished_at": self.finished_at,
+            "line_count": self.line_count,
+            "log_tail": [line for _, line in list(self.lines)[-tail:]] if tail else [],
+        }
+
+
+class JobManager:
+    """Tracks background jobs and retains a bounded history of finished ones."""
+
+    def __init__(self):
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._tasks = set()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def active(self, session_id: str, kind: str) -> Optional[Job]:
+        """The session's queued or running job of this kind, if any."""
+        return next((job for job in self.jobs.values()
+                     if job.session_id == session_id and job.kind == kind and not job.finished), None)
+
+    def start(self, session_id: str, kind: str, tool: Callable, state: Dict, on_complete: Callable[[Job, Dict], None]) -> Job:
+        job = Job(session_id, kind)
+        self.jobs[job.id] = job
+        self._prune()
+        task = job.task = asyncio.create_task(self._run(job, tool, state, on_complete))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._finish_unstarted(job))
+        return job
+
+    @staticmethod
+    def _finish_unstarted(job: Job):
+        """A task cancelled before its first step never runs _run; mark the job cancelled anyway."""
+        if not job.finished:
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            job._publish()
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job and not job.finished:
+            logging.info(f"Cancellation requested for job {job_id}")
+            job.cancel_event.set()
+            if job.status == "queued" and job.task:
+                # Still waiting for a terraform slot: leave the queue right away
+                job.task.cancel()
+        return job
+
+    async def _run(self, job: Job, tool: Callable, state: Dict, on_complete: Callable[[Job, Dict], None]):
+        try:
+            # Stays "queued" until the scheduler admits it; the slot is released before
+            # on_complete so recording the result never holds up other terraform runs
+            async with TERRAFORM_SCHEDULER.slot(state["work_dir"]):
+                if job.cancel_event.is_set():
+                    result = {}
+                else:
+                    job.status = "running"
+                    job.started_at = time.time()
+                    job._publish()
+                    result = await run_tool(tool, state, on_line=job.append_line, cancel_event=job.cancel_event)
+            if job.cancel_event.is_set():
+                job.status = "cancelled"
+            else:
+                outcome = on_complete(job, result)
+                if inspect.isawaitable(outcome):
+                    await outcome
+                # Only mark the job finished once the session holds its result, so followers
+                # woken by the final output lines never report a stale session
+                job.status = "failed" if result.get("error_message") or result.get("exit_code", 0) != 0 else "succeeded"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            logging.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.status = "failed"
+            job._publish(f"Job failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            # Yield once so pending call_soon_threadsafe line callbacks land before the final wake-up
+            await asyncio.sleep(0)
+            job._publish()
+            logging.info(f"Job {job.id} ({job.kind}) finished with status {job.status}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self.jobs) - JOB_HISTORY_LIMIT)]:
+            del self.jobs[job_id]
+
+
+JOBS = JobManager()
@@ -0,0 +1,193 @@
+import os
+import re
+import time
+import json
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from langchain_core.messages import AIMessage
+
+# "memory" (in-process LRU), "sqlite" (LRU in front of an on-disk SQLite cache) or "none".
+CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", os.path.join(os.path.dirname(__file__), "llm_cache.sqlite3"))
+CACHE_DB_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", "20000"))
+
+# A cached entry is (response content, latency in seconds of the original call).
+Entry = Tuple[str, float]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace so indentation-only differences share a cache entry."""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def cache_key(model: str, temperature, prompt: str) -> str:
+    payload = json.dumps([model, temperature, normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """Bounded in-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Entry]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Entry]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        created_at, entry = item
+        if time.time() - created_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: Entry, created_at: Optional[float] = None):
+        self._entries[key] = (created_at or time.time(), entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk cache shared across restarts, evicting least recently used rows beyond max_entries."""
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, latency REAL NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[float, Entry]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, latency, created_at FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[2], (row[0], row[1])
+
+    def set(self, key: str, entry: Entry):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, content, latency, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, entry[0], entry[1], now, now),
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class ResponseCache:
+    """
+    Memory LRU, optionally backed by SQLite, with hit/miss and saved-latency accounting.
+    SQLite reads and writes run in a worker thread to keep them off the event loop.
+    """
+
+    def __init__(self, backend: str = CACHE_BACKEND):
+        self.enabled = backend != "none"
+        self.memory = MemoryCacheBackend(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+        self.disk = None
+        if backend == "sqlite":
+            try:
+                self.disk = SQLiteCacheBackend(CACHE_DB_PATH, CACHE_DB_MAX_ENTRIES, CACHE_TTL_SECONDS)
+            except sqlite3.Error as e:
+                logging.warning(f"SQLite LLM cache unavailable, using memory only: {e}")
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    async def get(self, key: str) -> Optional[Entry]:
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            item = await asyncio.to_thread(self.disk.get, key)
+            if item is not None:
+                created_at, entry = item
+                self.memory.set(key, entry, created_at=created_at)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_seconds += entry[1]
+        return entry
+
+    async def set(self, key: str, entry: Entry):
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, entry)
+            except sqlite3.Error as e:
+                logging.warning(f"Failed to write LLM cache entry to SQLite: {e}")
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled, "backend": "sqlite" if self.disk else "memory",
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3), "memory_entries": len(self.memory),
+        }
+
+
+class CachedLLM:
+    """
+    Wraps a chat model so deterministic prompts are answered from the response cache.
+    Only nodes whose output depends solely on the prompt should call through this
+    wrapper; everything else keeps using the underlying model directly.
+    """
+
+    def __init__(self, llm, cache: ResponseCache):
+        self.llm = llm
+        self.cache = cache
+
+    def _key(self, prompt: str) -> str:
+        model = getattr(self.llm, "model", None) or getattr(self.llm, "model_name", "") or type(self.llm).__name__
+        return cache_key(model, getattr(self.llm, "temperature", None), prompt)
+
+    async def ainvoke(self, prompt: str, config=None, **kwargs):
+        if not self.cache.enabled:
+            return await self.llm.ainvoke(prompt, config=config, **kwargs)
+        key = self._key(prompt)
+        entry = await self.cache.get(key)
+        if entry is not None:
+            logging.info(f"LLM cache hit (saved ~{entry[1]:.2f}s)")
+            return AIMessage(content=entry[0])
+        started = time.perf_counter()
+        response = await self.llm.ainvoke(prompt, config=config, **kwargs)
+        await self.cache.set(key, (response.content, time.perf_counter() - started))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+LLM_CACHE = ResponseCache()
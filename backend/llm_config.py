@@ -0,0 +1,170 @@
+import os
+import json
+import logging
+import itertools
+from dataclasses import dataclass, asdict, replace
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from llm_resilience import ResilientLLM
+
+# "google" (Gemini via langchain-google-genai) or "stub" (canned offline replies for tests).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "google").lower()
+# The two tiers nodes are assigned to; individual nodes can still be overridden below.
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gemini-1.5-flash")
+STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "gemini-1.5-pro")
+# JSON file of {node: reply or [replies]} used by the stub backend instead of its defaults.
+STUB_RESPONSES_PATH = os.getenv("LLM_STUB_RESPONSES", "")
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    model: str
+    temperature: float = 0.1
+    max_output_tokens: Optional[int] = None
+    timeout: Optional[float] = None  # Seconds per request
+    max_retries: int = 2
+    deadline: float = 60.0  # Seconds for the whole call, retries included
+    hedge: bool = False  # Send a duplicate request once a call outlives the node's p95
+
+
+# Classification, extraction and short answers go to the fast tier with tight output
+# limits; authoring main.tf goes to the strong tier. Only short, non-streamed calls are
+# hedged: a duplicate streamed call would send its tokens to the client twice.
+NODE_MODELS = {
+    "summarize_history": ModelConfig(FAST_MODEL, 0.1, max_output_tokens=400, timeout=30, deadline=45, hedge=True),
+    "intent_router": ModelConfig(FAST_MODEL, 0.0, max_output_tokens=10, timeout=10, deadline=20, hedge=True),
+    "clarification_agent": ModelConfig(FAST_MODEL, 0.1, max_output_tokens=300, timeout=30, deadline=45, hedge=True),
+    "debugging_nlu": ModelConfig(FAST_MODEL, 0.0, max_output_tokens=300, timeout=20, deadline=30, hedge=True),
+    "debugging_agent": ModelConfig(FAST_MODEL, 0.2, max_output_tokens=1024, timeout=60, deadline=90),
+    "conversational_agent": ModelConfig(FAST_MODEL, 0.3, max_output_tokens=1024, timeout=60, deadline=90),
+    "generate_code": ModelConfig(STRONG_MODEL, 0.1, max_output_tokens=8192, timeout=120, deadline=240),
+    "design_agent": ModelConfig(STRONG_MODEL, 0.1, max_output_tokens=8192, timeout=120, deadline=240),
+}
+
+
+def _env_overrides(node: str, config: ModelConfig) -> ModelConfig:
+    """Applies LLM_<NODE>_MODEL / _TEMPERATURE / _MAX_TOKENS / _TIMEOUT / _RETRIES / _DEADLINE / _HEDGE."""
+    prefix = f"LLM_{node.upper()}_"
+    fields = {"MODEL": ("model", str), "TEMPERATURE": ("temperature", float),
+              "MAX_TOKENS": ("max_output_tokens", int), "TIMEOUT": ("timeout", float), "RETRIES": ("max_retries", int),
+              "DEADLINE": ("deadline", float), "HEDGE": ("hedge", lambda v: v.lower() in ("1", "true", "yes"))}
+    changes = {}
+    for suffix, (name, cast) in fields.items():
+        value = os.getenv(prefix + suffix)
+        if value:
+            changes[name] = cast(value)
+    return replace(config, **changes) if changes else config
+
+
+def model_config(node: str) -> ModelConfig:
+    return _env_overrides(node, NODE_MODELS.get(node, ModelConfig(FAST_MODEL)))
+
+
+# --- Stub backend ---
+STUB_HCL = """provider "aws" {
+  region = "us-east-1"
+}
+
+resource "aws_s3_bucket" "stub" {
+  bucket = "terraformancer-stub-bucket"
+}"""
+
+STUB_DEFAULTS = {
+    "summarize_history": "The user is working on AWS infrastructure with the assistant.",
+    "intent_router": "GENERAL_CHAT",
+    "clarification_agent": "[]",
+    "debugging_nlu": json.dumps({"resources": [], "resource_filter": None, "metric": None, "window_hours": None}),
+    "generate_code": STUB_HCL,
+    "design_agent": json.dumps({"kind": "code", "questions": [], "hcl": STUB_HCL}),
+}
+
+
+def _load_stub_responses() -> Dict[str, List[str]]:
+    responses = {node: [reply] for node, reply in STUB_DEFAULTS.items()}
+    if STUB_RESPONSES_PATH:
+        with open(STUB_RESPONSES_PATH) as f:
+            for node, reply in json.load(f).items():
+                responses[node] = reply if isinstance(reply, list) else [reply]
+    return responses
+
+
+class StubChatModel(BaseChatModel):
+    """Offline chat model replying with canned text per node (cycling through lists); streams word by word."""
+
+    node: str
+    model: str = "stub"
+    temperature: float = 0.0
+    replies: List[str] = []
+    _cycle: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _next_reply(self) -> str:
+        if self._cycle is None:
+            self._cycle = itertools.cycle(self.replies or [f"This is a stub reply from the offline '{self.node}' model."])
+        return next(self._cycle)
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._next_reply()))])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for piece in self._next_reply().split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs):
+        return RunnableLambda(lambda _: schema.model_validate_json(self._next_reply()))
+
+
+# --- Model instances ---
+_clients: Dict[str, BaseChatModel] = {}
+_instances: Dict[str, ResilientLLM] = {}
+_stub_responses: Optional[Dict[str, List[str]]] = None
+
+
+def _build(node: str, config: ModelConfig) -> BaseChatModel:
+    global _stub_responses
+    if LLM_BACKEND == "stub":
+        if _stub_responses is None:
+            _stub_responses = _load_stub_responses()
+        return StubChatModel(node=node, replies=_stub_responses.get(node, []))
+    # Retries are made by ResilientLLM (with backoff and a deadline), so the client tries once
+    return ChatGoogleGenerativeAI(
+        model=config.model, temperature=config.temperature, max_output_tokens=config.max_output_tokens,
+        timeout=config.timeout, max_retries=1,
+    )
+
+
+def llm_for(node: str) -> ResilientLLM:
+    """
+    The chat model configured for a graph node, wrapped with its deadline, retries,
+    hedging and circuit breaker. Nodes with identical client settings share one
+    client; the stub backend keeps one client per node so replies stay per node.
+    """
+    if node not in _instances:
+        config = model_config(node)
+        client_settings = {k: v for k, v in asdict(config).items() if k not in ("max_retries", "deadline", "hedge")}
+        key = node if LLM_BACKEND == "stub" else json.dumps(client_settings, sort_keys=True)
+        if key not in _clients:
+            logging.info(f"LLM for {node}: {LLM_BACKEND} {config}")
+            _clients[key] = _build(node, config)
+        _instances[node] = ResilientLLM(
+            _clients[key], node, config.model, deadline=config.deadline, attempt_timeout=config.timeout,
+            attempts=config.max_retries + 1, hedge=config.hedge,
+        )
+    return _instances[node]
+
+
+def describe_models() -> Dict[str, Dict]:
+    """Effective per-node settings, for /api/stats."""
+    return {node: {"backend": LLM_BACKEND, **asdict(model_config(node))} for node in NODE_MODELS}
@@ -0,0 +1,245 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+from telemetry import span, record_tokens
+
+# Jittered exponential backoff between attempts: uniform(0, min(cap, base * 2**attempt)) seconds.
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "8"))
+# A hedged second request is sent once a call outlives the node's recent p95 latency,
+# but only after this many successful calls have been observed.
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LATENCY_WINDOW = 200
+# Consecutive failed calls that open the circuit, and how long it stays open (seconds).
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+UNAVAILABLE_MESSAGE = (
+    "I'm having trouble reaching the language model right now, so I couldn't process that request. "
+    "Nothing in your session was changed; please try again in a minute."
+)
+
+
+class LLMUnavailable(Exception):
+    """The provider is failing or too slow: the circuit is open, or retries or the deadline ran out."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls and rejects calls until `reset_seconds`
+    have passed; then a single trial call is let through, closing the circuit on success.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def abandon_trial(self):
+        """A cancelled call says nothing about the provider: let the next call be the trial."""
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.trial_in_flight or self.consecutive_failures >= self.failures:
+            if self.opened_at is None or self.trial_in_flight:
+                logging.warning(f"LLM circuit opened after {self.consecutive_failures} consecutive failure(s)")
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def to_dict(self) -> Dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures, "rejected": self.rejected}
+
+
+class NodeStats:
+    """Recent latencies and outcome counters of one node's LLM calls."""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def to_dict(self) -> Dict:
+        ordered = sorted(self.latencies)
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3) if ordered else None
+        return {
+            "calls": self.calls, "retries": self.retries, "timeouts": self.timeouts, "failures": self.failures,
+            "hedges": self.hedges, "hedge_wins": self.hedge_wins, "p50_seconds": pct(0.5), "p95_seconds": pct(0.95),
+        }
+
+
+# One breaker per model: a degraded model fails fast for every node using it.
+BREAKERS: Dict[str, CircuitBreaker] = {}
+NODE_STATS: Dict[str, NodeStats] = {}
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Timeouts, rate limits and server errors are retried; bad requests and parse errors are not."""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 429):
+        return False
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+
+class ResilientLLM:
+    """
+    Wraps a chat model (or a structured-output runnable) for one graph node: every call
+    gets an overall deadline, per-attempt timeouts, jittered exponential backoff between
+    retries, an optional hedged duplicate request past the node's p95 latency, and the
+    model's circuit breaker. Raises LLMUnavailable when it gives up.
+    """
+
+    def __init__(self, llm, node: str, model: str, deadline: float, attempt_timeout: Optional[float],
+                 attempts: int, hedge: bool):
+        self.llm = llm
+        self.node = node
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.attempts = max(1, attempts)
+        self.hedge = hedge
+        self.breaker = BREAKERS.setdefault(model, CircuitBreaker())
+        self.stats = NODE_STATS.setdefault(node, NodeStats())
+        self._model = model
+
+    def with_structured_output(self, schema, **kwargs) -> "ResilientLLM":
+        return ResilientLLM(self.llm.with_structured_output(schema, **kwargs), self.node, self._model,
+                            self.deadline, self.attempt_timeout, self.attempts, self.hedge)
+
+    async def ainvoke(self, prompt, config=None, **kwargs):
+        with span("llm", self.node):
+            response = await self._invoke(prompt, config, **kwargs)
+        record_tokens(self.node, response)
+        return response
+
+    async def _invoke(self, prompt, config=None, **kwargs):
+        is_trial = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            raise LLMUnavailable(f"LLM circuit for {self._model} is open; failing fast ({self.node})")
+        self.stats.calls += 1
+        try:
+            return await self._call_with_retries(prompt, config, **kwargs)
+        except asyncio.CancelledError:
+            # Client disconnects and outer timeouts cancel the call without an outcome
+            if is_trial:
+                self.breaker.abandon_trial()
+            raise
+
+    async def _call_with_retries(self, prompt, config=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        last_error: Optional[Exception] = None
+        for attempt in range(self.attempts):
+            remaining = deadline_at - loop.time()
+            if remaining <= 0:
+                break
+            timeout = min(self.attempt_timeout or remaining, remaining)
+            started = loop.time()
+            try:
+                result = await self._attempt(lambda: self.llm.ainvoke(prompt, config=config, **kwargs), timeout)
+            except Exception as e:
+                last_error = e
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats.timeouts += 1
+                if not _is_retryable(e):
+                    # The provider answered; the request itself is at fault
+                    self.breaker.record_success()
+                    raise
+                logging.warning(f"LLM call for {self.node} failed (attempt {attempt + 1}/{self.attempts}): {e!r}")
+                if attempt + 1 < self.attempts:
+                    self.stats.retries += 1
+                    backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                    await asyncio.sleep(min(backoff, max(0.0, deadline_at - loop.time())))
+                continue
+            self.stats.latencies.append(loop.time() - started)
+            self.breaker.record_success()
+            return result
+
+        self.stats.failures += 1
+        self.breaker.record_failure()
+        raise LLMUnavailable(f"LLM call for {self.node} failed after {self.attempts} attempt(s) "
+                             f"within {self.deadline:.0f}s: {last_error!r}") from last_error
+
+    async def _attempt(self, call, timeout: float):
+        """One attempt, hedged with a duplicate request when it outlives the node's p95."""
+        delay = self.stats.p95() if self.hedge else None
+        if delay is None or max(delay, HEDGE_MIN_DELAY) >= timeout:
+            return await asyncio.wait_for(call(), timeout)
+
+        loop = asyncio.get_running_loop()
+        timeout_at = loop.time() + timeout
+        primary = asyncio.ensure_future(call())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, HEDGE_MIN_DELAY))
+            if not done:
+                self.stats.hedges += 1
+                tasks.add(asyncio.ensure_future(call()))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=max(0.0, timeout_at - loop.time()),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+def resilience_stats() -> Dict:
+    return {
+        "breakers": {model: breaker.to_dict() for model, breaker in BREAKERS.items()},
+        "nodes": {node: stats.to_dict() for node, stats in NODE_STATS.items()},
+    }
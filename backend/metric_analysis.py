@@ -0,0 +1,219 @@
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Maximum change points reported per series, and the minimum points on each side of one.
+MAX_CHANGE_POINTS = int(os.getenv("METRICS_MAX_CHANGE_POINTS", "3"))
+MIN_SEGMENT_POINTS = 3
+# A split only counts as a change point when the mean shifts by at least this many
+# within-segment standard deviations (and by a non-trivial fraction of the level).
+CHANGE_POINT_SIGMA = 2.0
+CHANGE_POINT_MIN_RELATIVE = 0.1
+
+# (metric, direction, limit): values breaching the limit are flagged in the digest.
+THRESHOLDS = {
+    "CPUUtilization": (">", 80.0),
+    "StatusCheckFailed": (">", 0.0),
+    "UnHealthyHostCount": (">", 0.0),
+    "HTTPCode_Target_5XX_Count": (">", 0.0),
+    "DatabaseConnections": (">", 500.0),
+    "TargetResponseTime": (">", 1.0),
+    "ReadLatency": (">", 0.02),
+    "WriteLatency": (">", 0.02),
+}
+
+
+@dataclass
+class ChangePoint:
+    at: datetime
+    before: float
+    after: float
+
+
+@dataclass
+class Breach:
+    direction: str
+    limit: float
+    points: int
+    longest_run: int
+    first_at: datetime
+    last_at: datetime
+
+
+@dataclass
+class SeriesAnalysis:
+    resource_id: str
+    metric: str
+    stat: str
+    count: int
+    latest: Optional[float] = None
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    percentiles: Dict[int, float] = field(default_factory=dict)
+    slope_per_hour: Optional[float] = None
+    change_points: List[ChangePoint] = field(default_factory=list)
+    breach: Optional[Breach] = None
+
+    @property
+    def severity(self) -> float:
+        """Rough ranking score: breaching series first, then by how much of the window breached."""
+        if not self.breach:
+            return 0.0
+        return 1.0 + self.breach.points / max(self.count, 1)
+
+
+def _seconds(timestamps: Sequence[datetime]) -> np.ndarray:
+    return np.array([ts.timestamp() for ts in timestamps], dtype=float)
+
+
+def trend_slope(seconds: np.ndarray, values: np.ndarray) -> Optional[float]:
+    """Least-squares slope in units per hour."""
+    if len(values) < 2 or np.ptp(seconds) == 0:
+        return None
+    if np.ptp(values) == 0:
+        return 0.0
+    # Centered: raw epoch hours (~5e5) make the fit ill-conditioned
+    hours = seconds / 3600.0
+    slope, _ = np.polyfit(hours - hours.mean(), values - values.mean(), 1)
+    return float(slope)
+
+
+def _best_split(values: np.ndarray) -> Tuple[Optional[int], float]:
+    """Index splitting `values` into two segments with the largest drop in squared error."""
+    n = len(values)
+    if n < 2 * MIN_SEGMENT_POINTS:
+        return None, 0.0
+    csum = np.cumsum(values)
+    csum2 = np.cumsum(values ** 2)
+    k = np.arange(MIN_SEGMENT_POINTS, n - MIN_SEGMENT_POINTS + 1)
+    left_sse = csum2[k - 1] - csum[k - 1] ** 2 / k
+    right_sum = csum[-1] - csum[k - 1]
+    right_sse = (csum2[-1] - csum2[k - 1]) - right_sum ** 2 / (n - k)
+    total_sse = csum2[-1] - csum[-1] ** 2 / n
+    gain = total_sse - (left_sse + right_sse)
+    best = int(np.argmax(gain))
+    return int(k[best]), float(gain[best])
+
+
+def change_points(values: np.ndarray, offset: int = 0, limit: int = MAX_CHANGE_POINTS) -> List[int]:
+    """Level shifts found by binary segmentation; returns split indices in ascending order."""
+    if limit <= 0:
+        return []
+    split, _ = _best_split(values)
+    if split is None:
+        return []
+    left, right = values[:split], values[split:]
+    shift = abs(right.mean() - left.mean())
+    noise = np.sqrt((left.var() * len(left) + right.var() * len(right)) / len(values))
+    level = max(abs(left.mean()), abs(right.mean()), 1e-9)
+    if shift < CHANGE_POINT_SIGMA * noise or shift < CHANGE_POINT_MIN_RELATIVE * level:
+        return []
+    found = [offset + split]
+    found += change_points(left, offset, limit - 1)
+    found += change_points(right, offset + split, limit - len(found))
+    return sorted(found)[:limit]
+
+
+def _breach(metric: str, timestamps: Sequence[datetime], values: np.ndarray) -> Optional[Breach]:
+    if metric not in THRESHOLDS:
+        return None
+    direction, limit = THRESHOLDS[metric]
+    mask = values > limit if direction == ">" else values < limit
+    if not mask.any():
+        return None
+    # Longest run of consecutive breaching points
+    edges = np.diff(np.concatenate(([0], mask.astype(int), [0])))
+    longest = int((np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max())
+    hits = np.flatnonzero(mask)
+    return Breach(direction, limit, int(mask.sum()), longest, timestamps[hits[0]], timestamps[hits[-1]])
+
+
+def analyze_series(resource_id: str, metric: str, stat: str,
+                   timestamps: Sequence[datetime], values: Sequence[float]) -> SeriesAnalysis:
+    result = SeriesAnalysis(resource_id, metric, stat, len(values))
+    if not len(values):
+        return result
+    data = np.asarray(values, dtype=float)
+    p50, p90, p99 = np.percentile(data, [50, 90, 99])
+    result.latest = float(data[-1])
+    result.mean, result.std = float(data.mean()), float(data.std())
+    result.minimum, result.maximum = float(data.min()), float(data.max())
+    result.percentiles = {50: float(p50), 90: float(p90), 99: float(p99)}
+    result.slope_per_hour = trend_slope(_seconds(timestamps), data)
+    bounds = [0, *change_points(data), len(data)]
+    result.change_points = [
+        ChangePoint(timestamps[split], float(data[start:split].mean()), float(data[split:end].mean()))
+        for start, split, end in zip(bounds, bounds[1:], bounds[2:])
+    ]
+    result.breach = _breach(metric, timestamps, data)
+    return result
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.3g}" if abs(value) < 1000 else f"{value:,.0f}"
+
+
+def describe(analysis: SeriesAnalysis, period_seconds: int) -> str:
+    """One compact line summarizing a series for the reasoning prompt."""
+    head = f"{analysis.resource_id} {analysis.metric} ({analysis.stat}, {analysis.count} pts)"
+    if not analysis.count:
+        return f"{head}: no datapoints"
+    p = analysis.percentiles
+    parts = [
+        f"latest {_fmt(analysis.latest)}, mean {_fmt(analysis.mean)}, min {_fmt(analysis.minimum)}, "
+        f"max {_fmt(analysis.maximum)}, p50 {_fmt(p[50])}, p90 {_fmt(p[90])}, p99 {_fmt(p[99])}"
+    ]
+    if analysis.slope_per_hour is not None:
+        parts.append(f"trend {analysis.slope_per_hour:+.3g}/h")
+    for change in analysis.change_points:
+        parts.append(f"level shift at {change.at:%H:%M} UTC {_fmt(change.before)} -> {_fmt(change.after)}")
+    if analysis.breach:
+        b = analysis.breach
+        parts.append(
+            f"{b.direction} {_fmt(b.limit)} for {b.points}/{analysis.count} pts "
+            f"(longest {b.longest_run * period_seconds // 60} min, {b.first_at:%H:%M}-{b.last_at:%H:%M} UTC)"
+        )
+    return f"{head}: " + "; ".join(parts)
+
+
+def build_digest(analyses: List[SeriesAnalysis], period_seconds: int) -> str:
+    """Digest of all series, breaching ones first, for the LLM to reason over instead of raw datapoints."""
+    ordered = sorted(analyses, key=lambda a: a.severity, reverse=True)
+    return "\n".join(f"- {describe(analysis, period_seconds)}" for analysis in ordered)
+
+
+def rank_resources(analyses_by_resource: Dict[str, List[SeriesAnalysis]]) -> List[Tuple[str, List[SeriesAnalysis]]]:
+    """Resources ordered worst first: by their most severe series, then by peak p90 of the primary metric."""
+    def score(item):
+        _, analyses = item
+        severity = max((a.severity for a in analyses), default=0.0)
+        primary = next((a for a in analyses if a.count), None)
+        return severity, primary.percentiles[90] if primary else float("-inf")
+    return sorted(analyses_by_resource.items(), key=score, reverse=True)
+
+
+def build_fleet_digest(analyses_by_resource: Dict[str, List[SeriesAnalysis]], period_seconds: int,
+                       detailed: int = 5) -> str:
+    """
+    Digest across many resources: the `detailed` worst resources get every series
+    described, the rest one line each with their primary metric and any breaches.
+    """
+    lines = []
+    for rank, (resource_id, analyses) in enumerate(rank_resources(analyses_by_resource)):
+        if rank < detailed:
+            lines.append(f"{resource_id}:")
+            lines.append(build_digest(analyses, period_seconds))
+            continue
+        primary = next((a for a in analyses if a.count), None)
+        if primary is None:
+            lines.append(f"{resource_id}: no datapoints")
+            continue
+        breached = [a.metric for a in analyses if a.breach]
+        summary = f"{primary.metric} {primary.stat} p50 {_fmt(primary.percentiles[50])}, p90 {_fmt(primary.percentiles[90])}"
+        lines.append(f"{resource_id}: {summary}; " + (f"breaching {', '.join(breached)}" if breached else "no breaches"))
+    return "\n".join(lines)
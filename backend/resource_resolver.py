@@ -0,0 +1,120 @@
+import os
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import boto3
+
+from diagram_generator import collect_resources
+
+# Upper bound on resources inspected in one debugging turn.
+DEBUG_MAX_RESOURCES = int(os.getenv("DEBUG_MAX_RESOURCES", "25"))
+
+
+@dataclass(frozen=True)
+class MonitoredResource:
+    resource_id: str
+    namespace: str
+    dimension_key: str
+    label: str = ""  # Terraform address it was resolved from, if any
+
+
+# Terraform resource type -> (namespace, dimension key, state attribute holding the dimension value)
+STATE_TARGETS = {
+    "aws_instance": ("AWS/EC2", "InstanceId", "id"),
+    "aws_db_instance": ("AWS/RDS", "DBInstanceIdentifier", "identifier"),
+    "aws_lb": ("AWS/ApplicationELB", "LoadBalancer", "arn_suffix"),
+    "aws_alb": ("AWS/ApplicationELB", "LoadBalancer", "arn_suffix"),
+}
+# Same, for the literal arguments available in HCL before anything is applied
+HCL_TARGETS = {
+    "aws_db_instance": ("AWS/RDS", "DBInstanceIdentifier", "identifier"),
+    "aws_autoscaling_group": ("AWS/EC2", "AutoScalingGroupName", "name"),
+}
+
+
+def _matches(hint: str, *candidates) -> bool:
+    hint = hint.lower()
+    return any(hint in str(candidate).lower() for candidate in candidates if candidate)
+
+
+def _asg_instances(asg_name: str, label: str) -> List[MonitoredResource]:
+    """Expands an Auto Scaling group into its instances; falls back to the group-level EC2 metrics."""
+    try:
+        groups = boto3.client("autoscaling").describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
+        instances = [
+            MonitoredResource(instance["InstanceId"], "AWS/EC2", "InstanceId", label)
+            for group in groups.get("AutoScalingGroups", []) for instance in group.get("Instances", [])
+        ]
+        if instances:
+            return instances
+    except Exception as e:
+        logging.warning(f"Could not list instances of Auto Scaling group {asg_name}: {e}")
+    return [MonitoredResource(asg_name, "AWS/EC2", "AutoScalingGroupName", label)]
+
+
+def from_state(work_dir: str, hint: str = "") -> List[MonitoredResource]:
+    """Monitorable resources recorded in the work dir's terraform.tfstate."""
+    state_path = os.path.join(work_dir, "terraform.tfstate")
+    if not os.path.exists(state_path):
+        return []
+    with open(state_path) as f:
+        tf_state = json.load(f)
+
+    found = []
+    for resource in tf_state.get("resources", []):
+        if resource.get("mode") != "managed":
+            continue
+        r_type, r_name = resource.get("type"), resource.get("name")
+        label = f"{r_type}.{r_name}"
+        for instance in resource.get("instances", []):
+            attributes = instance.get("attributes") or {}
+            if hint and not _matches(hint, r_name, r_type, (attributes.get("tags") or {}).get("Name")):
+                continue
+            if r_type == "aws_autoscaling_group" and attributes.get("name"):
+                found += _asg_instances(attributes["name"], label)
+            elif r_type in STATE_TARGETS:
+                namespace, dimension_key, attribute = STATE_TARGETS[r_type]
+                if attributes.get(attribute):
+                    found.append(MonitoredResource(attributes[attribute], namespace, dimension_key, label))
+    return found
+
+
+def from_hcl(parsed_hcl: Optional[dict], hint: str = "") -> List[MonitoredResource]:
+    """Resources whose CloudWatch identity is a literal in the HCL (DB identifiers, ASG names)."""
+    found = []
+    for r_type, resources in collect_resources(parsed_hcl or {}).items():
+        if r_type not in HCL_TARGETS:
+            continue
+        namespace, dimension_key, attribute = HCL_TARGETS[r_type]
+        for r_name, config in resources.items():
+            value = config.get(attribute)
+            # Interpolated values are only known after apply
+            if not isinstance(value, str) or "${" in value:
+                continue
+            value = value.strip('"')  # python-hcl2 8.x keeps string literals quoted
+            if hint and not _matches(hint, r_name, r_type, value):
+                continue
+            label = f"{r_type}.{r_name}"
+            if r_type == "aws_autoscaling_group":
+                found += _asg_instances(value, label)
+            else:
+                found.append(MonitoredResource(value, namespace, dimension_key, label))
+    return found
+
+
+def resolve_resources(work_dir: str, parsed_hcl: Optional[dict], hint: str = "") -> List[MonitoredResource]:
+    """
+    Resources to inspect when the user names a part of their infrastructure rather than
+    IDs: applied state first, then literals in the HCL. A hint that matches nothing is
+    ignored rather than returning an empty list.
+    """
+    for candidates in (lambda h: from_state(work_dir, h), lambda h: from_hcl(parsed_hcl, h)):
+        found = candidates(hint) or (candidates("") if hint else [])
+        if found:
+            unique = list(dict.fromkeys(found))
+            if len(unique) > DEBUG_MAX_RESOURCES:
+                logging.info(f"Resolved {len(unique)} resources; inspecting the first {DEBUG_MAX_RESOURCES}")
+            return unique[:DEBUG_MAX_RESOURCES]
+    return []
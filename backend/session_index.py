@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import base64
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TITLE_LENGTH = 50
+
+# Sort name -> (column, default direction) accepted by /api/sessions.
+SORT_COLUMNS = {
+    "modified": ("modified", "desc"),
+    "created": ("created", "desc"),
+    "title": ("title", "asc"),
+    "resources": ("resource_count", "desc"),
+}
+
+RESOURCE_BLOCK_RE = re.compile(r'^\s*resource\s+"', re.MULTILINE)
+
+
+def session_title(history: List) -> str:
+    if not history:
+        return "Empty Chat"
+    first = history[0]
+    first_message = first["content"] if isinstance(first, dict) else first.content
+    return (first_message[:TITLE_LENGTH] + '...') if len(first_message) > TITLE_LENGTH else first_message
+
+
+def session_metadata(state: Dict) -> Dict:
+    """The listing row for a session, from either a live state or its serialized form."""
+    return {
+        "title": session_title(state.get("conversation_history", [])),
+        "resource_count": len(RESOURCE_BLOCK_RE.findall(state.get("iac_code") or "")),
+        "last_plan_status": state.get("last_plan_status", ""),
+    }
+
+
+def encode_cursor(sort_value, session_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_value, session_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    try:
+        sort_value, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid pagination cursor.")
+    return sort_value, session_id
+
+
+class SessionIndex:
+    """
+    SQLite table of per-session listing metadata, kept current by the session store on
+    every flush so listing never has to open session files. Pages are fetched with
+    keyset cursors, so each page costs the same regardless of how many sessions exist.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_index ("
+            "id TEXT PRIMARY KEY, title TEXT NOT NULL, created REAL NOT NULL, modified REAL NOT NULL, "
+            "resource_count INTEGER NOT NULL, last_plan_status TEXT NOT NULL)"
+        )
+        for column, _ in SORT_COLUMNS.values():
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS session_index_{column} ON session_index ({column}, id)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM session_index").fetchone()[0]
+
+    def upsert_many(self, rows: Iterable[Tuple[str, Dict, float]]):
+        """Inserts or refreshes (session_id, metadata, modified) rows; creation time is kept."""
+        params = [
+            (session_id, meta["title"], modified, modified, meta["resource_count"], meta["last_plan_status"])
+            for session_id, meta, modified in rows
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO session_index (id, title, created, modified, resource_count, last_plan_status) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET title = excluded.title, "
+                "modified = excluded.modified, resource_count = excluded.resource_count, "
+                "last_plan_status = excluded.last_plan_status",
+                params,
+            )
+            self._conn.commit()
+
+    def query(self, sort: str = "modified", order: Optional[str] = None, q: str = "",
+              cursor: Optional[str] = None, limit: int = 50) -> Dict:
+        """Returns {"sessions": [...], "next_cursor": str | None} for one page of the listing."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort '{sort}'. Use one of: {', '.join(SORT_COLUMNS)}.")
+        column, default_order = SORT_COLUMNS[sort]
+        order = (order or default_order).lower()
+        if order not in ("asc", "desc"):
+            raise ValueError("Order must be 'asc' or 'desc'.")
+        op = "<" if order == "desc" else ">"
+
+        clauses, params = [], []
+        if q:
+            escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("title LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if cursor:
+            sort_value, last_id = decode_cursor(cursor)
+            clauses.append(f"({column} {op} ? OR ({column} = ? AND id {op} ?))")
+            params.extend([sort_value, sort_value, last_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT id, title, created, modified, resource_count, last_plan_status FROM session_index "
+            f"{where} ORDER BY {column} {order}, id {order} LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, [*params, limit + 1]).fetchall()
+
+        sessions = [
+            {"id": row[0], "title": row[1], "created": row[2], "last_modified": row[3],
+             "resource_count": row[4], "last_plan_status": row[5]}
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            sort_value = {"modified": last[3], "created": last[2], "title": last[1], "resources": last[4]}[sort]
+            next_cursor = encode_cursor(sort_value, last[0])
+        return {"sessions": sessions, "next_cursor": next_cursor}
+
+
+def rebuild_rows(sessions: Iterable[Tuple[str, Dict, float]]) -> Iterable[Tuple[str, Dict, float]]:
+    """Index rows for sessions read straight from a backend (used to backfill an empty index)."""
+    for session_id, data, modified in sessions:
+        yield session_id, session_metadata(data), modified
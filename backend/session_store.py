@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+
+from agent_logic import GraphState, TRANSIENT_STATE_KEYS
+from session_index import SessionIndex, session_metadata, rebuild_rows
+from telemetry import span
+
+# "file" (one JSON document per session) or "sqlite" (single database file).
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "file").lower()
+SESSIONS_DIR = os.getenv("SESSIONS_DIR", "sessions")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(SESSIONS_DIR, "sessions.db"))
+# Listing metadata lives in its own SQLite index whichever backend stores the sessions.
+SESSION_INDEX_PATH = os.getenv("SESSION_INDEX_PATH", os.path.join(SESSIONS_DIR, "index.db"))
+# Maximum sessions kept in memory; least recently used ones are evicted.
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "500"))
+# Dirty sessions are written to the backend at most this often (seconds).
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+# Journal events appended per session before they are compacted into a new snapshot.
+SESSION_COMPACT_EVERY = int(os.getenv("SESSION_COMPACT_EVERY", "50"))
+
+
+# --- Session Serialization/Deserialization ---
+def serialize_history(history: List[BaseMessage]) -> List[Dict]:
+    serializable = []
+    for msg in history:
+        role = "user" if isinstance(msg, HumanMessage) else "assistant"
+        serializable.append({"role": role, "content": msg.content})
+    return serializable
+
+def deserialize_history(history_data: List[Dict]) -> List[BaseMessage]:
+    messages = []
+    for msg in history_data:
+        if msg['role'] == 'user':
+            messages.append(HumanMessage(content=msg['content']))
+        else:
+            messages.append(AIMessage(content=msg['content']))
+    return messages
+
+def serialize_state(state: GraphState) -> Dict:
+    """JSON-serializable copy of a session, without run-only keys."""
+    data = {k: v for k, v in state.items() if k not in TRANSIENT_STATE_KEYS}
+    data["conversation_history"] = serialize_history(state["conversation_history"])
+    return data
+
+def deserialize_state(data: Dict) -> GraphState:
+    data["conversation_history"] = deserialize_history(data["conversation_history"])
+    return data
+
+
+# --- Journal ---
+# A session is persisted as a snapshot plus an append-only journal of events, each
+# {"seq": n, "messages": [...], "set": {...}, "unset": [...]}. A snapshot taken at
+# sequence n already contains every event up to n, so replay skips those.
+SNAPSHOT_SEQ_KEY = "_journal_seq"
+
+def apply_event(data: Dict, event: Dict):
+    data.setdefault("conversation_history", []).extend(event.get("messages", []))
+    data.update(event.get("set", {}))
+    for key in event.get("unset", []):
+        data.pop(key, None)
+
+def replay(snapshot: Optional[Dict], events: Iterable[Dict]) -> Optional[Tuple[Dict, int, int]]:
+    """Rebuilds a session from its snapshot and journal; returns (data, last seq, events replayed)."""
+    data = dict(snapshot) if snapshot else {}
+    seq = data.pop(SNAPSHOT_SEQ_KEY, 0)
+    replayed = 0
+    for event in events:
+        if event["seq"] <= seq:
+            continue
+        apply_event(data, event)
+        seq = event["seq"]
+        replayed += 1
+    if "conversation_history" not in data:
+        return None
+    return data, seq, replayed
+
+
+@dataclass
+class JournalCursor:
+    """What is already persisted for a session, so a flush only writes what changed."""
+    history_len: int
+    fields: Dict
+    seq: int
+    events: int  # Journal events written since the last snapshot
+
+def persisted_fields(data: Dict) -> Dict:
+    # Lists are copied so in-place edits still show up as changes
+    return {
+        k: list(v) if isinstance(v, list) else v
+        for k, v in data.items()
+        if k != "conversation_history" and k not in TRANSIENT_STATE_KEYS
+    }
+
+
+# --- Backends ---
+class FileSessionBackend:
+    """Per session, a compact JSON snapshot plus a JSON-lines journal appended on every write."""
+
+    def __init__(self, directory: str = SESSIONS_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _journal_path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.journal")
+
+    def _read_journal(self, session_id: str) -> List[Dict]:
+        path = self._journal_path(session_id)
+        if not os.path.exists(path):
+            return []
+        events = []
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn final line from an interrupted append; everything before it is intact
+                    logging.warning(f"Ignoring truncated journal entry for session {session_id}")
+                    break
+        return events
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict, int, int]]:
+        path = self._path(session_id)
+        snapshot = None
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                snapshot = json.load(f)
+        return replay(snapshot, self._read_journal(session_id))
+
+    def append(self, session_id: str, event: Dict):
+        with open(self._journal_path(session_id), "a") as f:
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    def compact(self, session_id: str, data: Dict, seq: int):
+        path = self._path(session_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({**data, SNAPSHOT_SEQ_KEY: seq}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        # Safe to drop the journal now: the snapshot covers every event up to `seq`
+        journal_path = self._journal_path(session_id)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def iter_sessions(self) -> Iterator[Tuple[str, Dict, float]]:
+        session_ids = {
+            os.path.splitext(filename)[0] for filename in os.listdir(self.directory)
+            if filename.endswith((".json", ".journal"))
+        }
+        for session_id in session_ids:
+            try:
+                loaded = self.load(session_id)
+                if loaded is None:
+                    continue
+                modified = max(
+                    os.path.getmtime(path) for path in (self._path(session_id), self._journal_path(session_id))
+                    if os.path.exists(path)
+                )
+                yield session_id, loaded[0], modified
+            except Exception as e:
+                logging.error(f"Could not read session {session_id}: {e}")
+
+
+class SQLiteSessionBackend:
+    """All sessions in one SQLite database: a snapshot row per session plus an events table."""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, modified REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_events ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (session_id, seq))"
+        )
+        self._conn.commit()
+
+    def _load_locked(self, session_id: str) -> Optional[Tuple[Dict, int, int]]:
+        row = self._conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        events = self._conn.execute(
+            "SELECT event FROM session_events WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        return replay(json.loads(row[0]) if row else None, (json.loads(event) for event, in events))
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict, int, int]]:
+        with self._lock:
+            return self._load_locked(session_id)
+
+    def append(self, session_id: str, event: Dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_events (session_id, seq, event) VALUES (?, ?, ?)",
+                (session_id, event["seq"], json.dumps(event, separators=(",", ":"))),
+            )
+            self._conn.execute("UPDATE sessions SET modified = ? WHERE id = ?", (time.time(), session_id))
+            self._conn.commit()
+
+    def compact(self, session_id: str, data: Dict, seq: int):
+        payload = json.dumps({**data, SNAPSHOT_SEQ_KEY: seq}, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, modified) VALUES (?, ?, ?)",
+                (session_id, payload, time.time()),
+            )
+            self._conn.execute("DELETE FROM session_events WHERE session_id = ? AND seq <= ?", (session_id, seq))
+            self._conn.commit()
+
+    def iter_sessions(self) -> Iterator[Tuple[str, Dict, float]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, modified FROM sessions").fetchall()
+            loaded = [(session_id, self._load_locked(session_id), modified) for session_id, modified in rows]
+        for session_id, data, modified in loaded:
+            if data is not None:
+                yield session_id, data[0], modified
+
+
+def create_backend(kind: str = SESSION_BACKEND):
+    if kind == "sqlite":
+        return SQLiteSessionBackend()
+    return FileSessionBackend()
+
+
+# --- Store ---
+class SessionStore:
+    """
+    Bounded LRU cache of live sessions in front of a persistence backend. Writes are
+    write-behind: `save` only marks a session dirty, and a background task flushes
+    dirty sessions (coalescing repeated saves) every SESSION_FLUSH_INTERVAL seconds.
+    Each flush appends only what changed since the last write (new messages and
+    changed fields) to the session's journal; every SESSION_COMPACT_EVERY events the
+    journal is folded into a fresh snapshot.
+    """
+
+    def __init__(self, backend, index: SessionIndex, max_cached: int = SESSION_CACHE_SIZE, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.backend = backend
+        self.index = index
+        self.max_cached = max_cached
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, GraphState]" = OrderedDict()
+        self._dirty = set()
+        # Dirty sessions evicted from the cache, kept until their changes are written
+        self._evicted: Dict[str, GraphState] = {}
+        self._cursors: Dict[str, JournalCursor] = {}
+        # A session's lock lives as long as someone holds or waits on it, independent of the
+        # LRU cache, so every writer of a session always serializes on the same lock
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-writer")
+        self._flush_task: Optional[asyncio.Task] = None
+        # Flushes must not overlap: each computes its delta against the last committed cursor
+        self._flush_lock = asyncio.Lock()
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """Per-session lock serializing concurrent requests that mutate the same session."""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def get(self, session_id: str) -> Optional[GraphState]:
+        if session_id in self._cache:
+            self._cache.move_to_end(session_id)
+            return self._cache[session_id]
+        if session_id in self._evicted:
+            self.save(session_id, self._evicted.pop(session_id))
+            return self._cache[session_id]
+        # Loads go through the writer thread so they are ordered after pending writes
+        loop = asyncio.get_running_loop()
+        with span("session", "load"):
+            loaded = await loop.run_in_executor(self._writer, self.backend.load, session_id)
+        if loaded is None:
+            return None
+        if session_id in self._cache:
+            # Another request loaded it while we were waiting
+            return self._cache[session_id]
+        data, seq, replayed = loaded
+        logging.info(f"Loading existing session {session_id} from storage ({replayed} journal events replayed).")
+        self._cursors[session_id] = JournalCursor(len(data["conversation_history"]), persisted_fields(data), seq, replayed)
+        state = deserialize_state(data)
+        self._insert(session_id, state)
+        return state
+
+    def save(self, session_id: str, state: GraphState):
+        """Marks the session for the next coalesced flush."""
+        self._evicted.pop(session_id, None)
+        self._insert(session_id, state)
+        self._dirty.add(session_id)
+
+    def _insert(self, session_id: str, state: GraphState):
+        self._cache[session_id] = state
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.max_cached:
+            evicted_id, evicted_state = self._cache.popitem(last=False)
+            if evicted_id in self._dirty:
+                self._evicted[evicted_id] = evicted_state
+            else:
+                self._cursors.pop(evicted_id, None)
+
+    def _next_write(self, session_id: str, state: GraphState) -> Tuple[Optional[Tuple], JournalCursor]:
+        """The backend operation persisting `state`, and the cursor once it succeeds."""
+        cursor = self._cursors.get(session_id)
+        history = state["conversation_history"]
+        fields = persisted_fields(state)
+        if cursor is None or len(history) < cursor.history_len or cursor.events >= SESSION_COMPACT_EVERY:
+            seq = cursor.seq if cursor else 0
+            return ("compact", serialize_state(state), seq), JournalCursor(len(history), fields, seq, 0)
+
+        event = {"seq": cursor.seq + 1}
+        if len(history) > cursor.history_len:
+            event["messages"] = serialize_history(history[cursor.history_len:])
+        changed = {k: v for k, v in fields.items() if k not in cursor.fields or cursor.fields[k] != v}
+        if changed:
+            event["set"] = changed
+        removed = [k for k in cursor.fields if k not in fields]
+        if removed:
+            event["unset"] = removed
+        if len(event) == 1:
+            return None, cursor
+        return ("append", event), JournalCursor(len(history), fields, event["seq"], cursor.events + 1)
+
+    async def flush(self):
+        """Writes every dirty session's changes to the backend in the writer thread."""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        batch = {}
+        for session_id in self._dirty:
+            state = self._cache.get(session_id) or self._evicted.get(session_id)
+            if state is None:
+                continue
+            write, cursor = self._next_write(session_id, state)
+            if write is not None:
+                batch[session_id] = (write, cursor, session_metadata(state))
+        self._dirty.clear()
+        if not batch:
+            return
+        loop = asyncio.get_running_loop()
+        writes = {k: (write, meta) for k, (write, _, meta) in batch.items()}
+        with span("session", "flush"):
+            failed = await loop.run_in_executor(self._writer, self._write_batch, writes)
+        for session_id, (_, cursor, _) in batch.items():
+            if session_id in failed:
+                # Retry on the next flush, computing the delta against the last successful write
+                self._dirty.add(session_id)
+                continue
+            self._cursors[session_id] = cursor
+            if self._evicted.pop(session_id, None) is not None and session_id not in self._cache:
+                self._cursors.pop(session_id, None)
+
+    def _write_batch(self, batch: Dict[str, Tuple]) -> List[str]:
+        failed = []
+        indexed = []
+        now = time.time()
+        for session_id, ((kind, *args), meta) in batch.items():
+            try:
+                if kind == "append":
+                    self.backend.append(session_id, *args)
+                else:
+                    self.backend.compact(session_id, *args)
+                indexed.append((session_id, meta, now))
+            except Exception as e:
+                logging.error(f"Failed to persist session {session_id}: {e}")
+                failed.append(session_id)
+        try:
+            self.index.upsert_many(indexed)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update session index: {e}")
+        return failed
+
+    def _backfill_index(self):
+        """Builds the listing index from the backend the first time it is found empty."""
+        if len(self.index):
+            return
+        rows = list(rebuild_rows(self.backend.iter_sessions()))
+        self.index.upsert_many(rows)
+        logging.info(f"Indexed {len(rows)} existing sessions.")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Session flush failed: {e}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._writer.submit(self._backfill_index)
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def list_sessions(self, **query) -> Dict:
+        """One page of the session listing (see SessionIndex.query), after flushing pending writes."""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, lambda: self.index.query(**query))
+
+
+SESSION_STORE = SessionStore(create_backend(), SessionIndex(SESSION_INDEX_PATH))
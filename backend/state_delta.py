@@ -0,0 +1,98 @@
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from agent_logic import GraphState, TRANSIENT_STATE_KEYS
+from session_store import serialize_history
+
+# Number of sessions whose version history is kept, and versions remembered per session.
+DELTA_MAX_SESSIONS = int(os.getenv("DELTA_MAX_SESSIONS", "1000"))
+DELTA_MAX_VERSIONS = int(os.getenv("DELTA_MAX_VERSIONS", "50"))
+
+# Versions are only meaningful within one server process; a client holding a version
+# from before a restart gets a full snapshot.
+EPOCH = uuid.uuid4().hex[:8]
+
+
+class SessionVersions:
+    """Version history of one session: when each field last changed and the history length per version."""
+
+    def __init__(self):
+        self.version = 0
+        self.fields: Dict = {}
+        self.field_versions: Dict[str, int] = {}
+        self.history_len: "OrderedDict[int, int]" = OrderedDict()
+
+
+class StateDeltas:
+    """
+    Assigns each session a version that advances whenever its client-visible state
+    changes, and builds responses holding only what changed since the version the
+    client last saw. Unknown or expired versions get a full snapshot.
+    """
+
+    def __init__(self, max_sessions: int = DELTA_MAX_SESSIONS, max_versions: int = DELTA_MAX_VERSIONS):
+        self.max_sessions = max_sessions
+        self.max_versions = max_versions
+        self._sessions: "OrderedDict[str, SessionVersions]" = OrderedDict()
+
+    def _track(self, session_id: str, state: GraphState) -> SessionVersions:
+        tracked = self._sessions.get(session_id)
+        if tracked is None:
+            tracked = self._sessions[session_id] = SessionVersions()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+
+        fields = {k: v for k, v in state.items() if k != "conversation_history" and k not in TRANSIENT_STATE_KEYS}
+        changed = [k for k, v in fields.items() if k not in tracked.fields or tracked.fields[k] != v]
+        changed += [k for k in tracked.fields if k not in fields]
+        history_len = len(state["conversation_history"])
+        last_len = next(reversed(tracked.history_len.values()), None)
+        if changed or history_len != last_len:
+            tracked.version += 1
+            for key in changed:
+                tracked.field_versions[key] = tracked.version
+            # Lists are copied so later in-place edits still register as changes
+            tracked.fields = {k: list(v) if isinstance(v, list) else v for k, v in fields.items()}
+            if last_len is not None and history_len < last_len:
+                # History was rewritten; no earlier version can be patched forward
+                tracked.history_len.clear()
+            tracked.history_len[tracked.version] = history_len
+            while len(tracked.history_len) > self.max_versions:
+                tracked.history_len.popitem(last=False)
+        return tracked
+
+    def build(self, session_id: str, state: GraphState, since_version: Optional[str] = None) -> Dict:
+        """Session payload for the client: a delta from `since_version` when possible, else the full state."""
+        tracked = self._track(session_id, state)
+        payload = {"session_id": session_id, "state_version": f"{EPOCH}.{tracked.version}"}
+        since = self._parse(since_version)
+        history = state["conversation_history"]
+
+        if since is None or since not in tracked.history_len or since > tracked.version:
+            payload["full"] = True
+            payload.update(tracked.fields)
+            payload["conversation_history"] = serialize_history(history)
+            return payload
+
+        start = tracked.history_len[since]
+        payload["full"] = False
+        payload.update({k: v for k, v in tracked.fields.items() if tracked.field_versions.get(k, 0) > since})
+        payload["removed"] = [k for k, v in tracked.field_versions.items() if v > since and k not in tracked.fields]
+        payload["history_start"] = start
+        payload["new_messages"] = serialize_history(history[start:])
+        return payload
+
+    @staticmethod
+    def _parse(since_version: Optional[str]) -> Optional[int]:
+        if not since_version:
+            return None
+        epoch, _, number = since_version.partition(".")
+        if epoch != EPOCH or not number.isdigit():
+            return None
+        return int(number)
+
+
+STATE_DELTAS = StateDeltas()
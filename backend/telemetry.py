@@ -0,0 +1,122 @@
+import time
+import uuid
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Trace ID of the HTTP request (or background job) the current code runs for; it is
+# stamped on every log record and copied into worker threads by run_tool.
+TRACE_ID: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+# Spans range from sub-millisecond cache lookups to long terraform applies.
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+SPAN_SECONDS = Histogram(
+    "terraformancer_span_seconds", "Duration of instrumented operations.", ["kind", "name"], buckets=SPAN_BUCKETS,
+)
+SPAN_ERRORS = Counter("terraformancer_span_errors_total", "Instrumented operations that raised.", ["kind", "name"])
+LLM_TOKENS = Counter("terraformancer_llm_tokens_total", "LLM tokens by node and direction.", ["node", "type"])
+HTTP_SECONDS = Histogram(
+    "terraformancer_http_request_seconds", "HTTP request latency (time to the end of the response body).",
+    ["method", "route", "status"], buckets=SPAN_BUCKETS,
+)
+
+
+# --- Trace IDs in logs ---
+_default_record_factory = logging.getLogRecordFactory()
+
+def _record_factory(*args, **kwargs):
+    record = _default_record_factory(*args, **kwargs)
+    record.trace_id = TRACE_ID.get()
+    return record
+
+logging.setLogRecordFactory(_record_factory)
+LOG_FORMAT = "%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s"
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+# --- Spans ---
+@contextmanager
+def span(kind: str, name: str):
+    """Times the block, records it in the span histogram and logs it with the current trace ID."""
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        SPAN_ERRORS.labels(kind, name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_SECONDS.labels(kind, name).observe(elapsed)
+        logging.info(f"span kind={kind} name={name} status={status} duration_ms={elapsed * 1000:.1f}")
+
+
+def traced_node(name: str, node):
+    """Wraps an async LangGraph node function in a `node` span."""
+    @functools.wraps(node)
+    async def wrapper(state):
+        with span("node", name):
+            return await node(state)
+    return wrapper
+
+
+def record_tokens(node: str, response) -> Optional[dict]:
+    """Counts prompt/completion tokens from a LangChain message's usage metadata, when present."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+    LLM_TOKENS.labels(node, "prompt").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(node, "completion").inc(usage.get("output_tokens", 0))
+    return usage
+
+
+# --- HTTP ---
+class TraceMiddleware:
+    """
+    Gives every HTTP request a trace ID (the caller's X-Request-ID if sent), returns it
+    as X-Trace-ID and records the request's latency by route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        trace_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or new_trace_id()
+        token = TRACE_ID.set(trace_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            route = scope.get("route")
+            HTTP_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"), str(status)).observe(
+                time.perf_counter() - started
+            )
+            TRACE_ID.reset(token)
+
+
+def metrics_payload():
+    """(body, content type) of the Prometheus exposition."""
+    return generate_latest(), CONTENT_TYPE_LATEST
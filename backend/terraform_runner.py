@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from hcl_validation import parse_hcl
+from telemetry import span
+
+
+# Maximum number of output lines retained per command. Older lines are dropped so a
+# very long `terraform apply` cannot grow memory without bound.
+MAX_OUTPUT_LINES = int(os.getenv("TERRAFORM_OUTPUT_MAX_LINES", "5000"))
+# Commands running longer than this (seconds) are terminated; 0 disables the limit.
+COMMAND_TIMEOUT = float(os.getenv("TERRAFORM_TIMEOUT_SECONDS", "1800"))
+# Tighter limit for the fmt/init/validate checks that run inside a chat turn.
+VALIDATE_TIMEOUT = float(os.getenv("TERRAFORM_VALIDATE_TIMEOUT_SECONDS", "300"))
+
+# Provider plugins are shared across all session work dirs instead of being downloaded
+# into each one. Offline hosts can point TF_PROVIDER_MIRROR_DIR at a directory created
+# with `terraform providers mirror` and set TF_OFFLINE=1 to never reach the registry.
+PLUGIN_CACHE_DIR = os.path.abspath(os.getenv("TF_PLUGIN_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".terraform-plugin-cache")))
+PROVIDER_MIRROR_DIR = os.getenv("TF_PROVIDER_MIRROR_DIR", "")
+OFFLINE = os.getenv("TF_OFFLINE", "").lower() in ("1", "true", "yes")
+
+LOCK_FILE = ".terraform.lock.hcl"
+INIT_FINGERPRINT_FILE = os.path.join(".terraform", "terraformancer-init.sha256")
+
+# `terraform plan -out` target and the record of what it was planned from. A saved plan
+# is reused for this long (seconds); after that the plan is recomputed to pick up drift.
+PLAN_FILE = "tfplan"
+PLAN_RECORD_FILE = os.path.join(".terraform", "terraformancer-plan.json")
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "600"))
+STATE_FILE = "terraform.tfstate"
+
+
+@dataclass
+class CommandResult:
+    returncode: int
+    output: str
+    cancelled: bool = False
+    timed_out: bool = False
+    errors: str = ""  # stderr, for commands run by capture_command
+
+
+def _watch_process(process: subprocess.Popen, cancel_event: threading.Event, timeout: float, timed_out: threading.Event):
+    """Terminates the process as soon as cancellation is requested or it outlives `timeout` seconds."""
+    deadline = time.monotonic() + timeout if timeout else None
+    while process.poll() is None:
+        if cancel_event.wait(0.2):
+            logging.info(f"Cancelling process {process.pid}...")
+        elif deadline is not None and time.monotonic() >= deadline:
+            logging.warning(f"Process {process.pid} exceeded its {timeout:.0f}s timeout; terminating...")
+            timed_out.set()
+        else:
+            continue
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        return
+
+
+def run_command(
+    cmd: List[str],
+    on_line: Optional[Callable[[str], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    env: Optional[dict] = None,
+    timeout: float = COMMAND_TIMEOUT,
+) -> CommandResult:
+    """
+    Runs a command, streaming its combined stdout/stderr line by line to `on_line`.
+    Only the last MAX_OUTPUT_LINES lines are kept in the returned output. The process
+    is terminated on cancellation or after `timeout` seconds.
+    """
+    # Spans are named after the subcommand (init, plan, apply, validate, fmt)
+    subcommand = next((arg for arg in cmd[1:] if not arg.startswith("-")), cmd[0])
+    with span("terraform", subcommand):
+        lines = deque(maxlen=MAX_OUTPUT_LINES)
+        total_lines = 0
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, bufsize=1, env=env,
+        )
+        timed_out = threading.Event()
+        if cancel_event is not None or timeout:
+            threading.Thread(
+                target=_watch_process, args=(process, cancel_event or threading.Event(), timeout, timed_out), daemon=True,
+            ).start()
+
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            lines.append(line)
+            total_lines += 1
+            if on_line:
+                on_line(line)
+        process.wait()
+        if timed_out.is_set():
+            lines.append(f"Command timed out after {timeout:.0f}s and was terminated.")
+            if on_line:
+                on_line(lines[-1])
+
+        output = "\n".join(lines)
+        if total_lines > len(lines):
+            output = f"... ({total_lines - len(lines)} earlier lines truncated)\n{output}"
+        cancelled = bool(cancel_event and cancel_event.is_set())
+        return CommandResult(returncode=process.returncode, output=output, cancelled=cancelled, timed_out=timed_out.is_set())
+
+
+def capture_command(cmd: List[str], env: Optional[dict] = None, timeout: float = COMMAND_TIMEOUT) -> CommandResult:
+    """
+    Runs a command whose stdout is machine-readable (e.g. `-json`): `output` holds
+    stdout only, so warnings on stderr cannot corrupt it; stderr goes to `errors`.
+    """
+    subcommand = next((arg for arg in cmd[1:] if not arg.startswith("-")), cmd[0])
+    with span("terraform", subcommand):
+        try:
+            process = subprocess.run(cmd, capture_output=True, text=True, env=env, timeout=timeout or None)
+        except subprocess.TimeoutExpired as e:
+            logging.warning(f"{' '.join(cmd)} exceeded its {timeout:.0f}s timeout and was terminated")
+            stdout = e.stdout.decode() if isinstance(e.stdout, bytes) else (e.stdout or "")
+            message = f"Command timed out after {timeout:.0f}s and was terminated."
+            return CommandResult(returncode=-1, output=stdout, errors=message, timed_out=True)
+        return CommandResult(returncode=process.returncode, output=process.stdout, errors=process.stderr)
+
+
+# --- Provider cache & init skipping ---
+
+def _write_cli_config() -> str:
+    """Writes a Terraform CLI config that installs providers from the local mirror first."""
+    config_path = os.path.join(PLUGIN_CACHE_DIR, "terraform.rc")
+    mirror = os.path.abspath(PROVIDER_MIRROR_DIR).replace("\\", "/")
+    cache_dir = PLUGIN_CACHE_DIR.replace("\\", "/")
+    direct = "" if OFFLINE else "  direct {}\n"
+    content = (
+        f'plugin_cache_dir = "{cache_dir}"\n'
+        f'provider_installation {{\n  filesystem_mirror {{\n    path = "{mirror}"\n  }}\n{direct}}}\n'
+    )
+    if not os.path.exists(config_path) or open(config_path).read() != content:
+        with open(config_path, "w") as f:
+            f.write(content)
+    return config_path
+
+
+def terraform_env() -> dict:
+    """Environment for terraform subprocesses, wired to the shared provider plugin cache."""
+    os.makedirs(PLUGIN_CACHE_DIR, exist_ok=True)
+    env = os.environ.copy()
+    env["TF_PLUGIN_CACHE_DIR"] = PLUGIN_CACHE_DIR
+    env["TF_IN_AUTOMATION"] = "1"
+    if PROVIDER_MIRROR_DIR:
+        env["TF_CLI_CONFIG_FILE"] = _write_cli_config()
+    return env
+
+
+def init_fingerprint(work_dir: str) -> Optional[str]:
+    """
+    Hashes everything that determines the outcome of `terraform init`: the `terraform`
+    settings blocks, provider blocks, module sources, the providers implied by resource
+    and data source types, and the dependency lock file. Returns None if the
+    configuration cannot be parsed, in which case init must always run.
+    """
+    requirements = {"terraform": [], "provider": [], "module": [], "implied_providers": set()}
+    try:
+        for filename in sorted(os.listdir(work_dir)):
+            if not filename.endswith(".tf"):
+                continue
+            with open(os.path.join(work_dir, filename), "r", encoding="utf-8") as f:
+                # Usually a cache hit: main.tf was just parsed by the validation step
+                tf_data = parse_hcl(f.read())
+            requirements["terraform"].extend(tf_data.get("terraform", []))
+            requirements["provider"].extend(sorted(p for block in tf_data.get("provider", []) for p in block))
+            for block in tf_data.get("module", []):
+                for name, config in block.items():
+                    requirements["module"].append([name, config.get("source"), config.get("version")])
+            for section in ("resource", "data"):
+                for block in tf_data.get(section, []):
+                    requirements["implied_providers"].update(r_type.split("_", 1)[0] for r_type in block)
+    except Exception as e:
+        logging.warning(f"Could not fingerprint terraform config in {work_dir}: {e}")
+        return None
+
+    requirements["implied_providers"] = sorted(requirements["implied_providers"])
+    digest = hashlib.sha256(json.dumps(requirements, sort_keys=True, default=str).encode())
+    lock_path = os.path.join(work_dir, LOCK_FILE)
+    if os.path.exists(lock_path):
+        with open(lock_path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def ensure_initialized(work_dir: str, on_line=None, cancel_event=None, extra_args: Optional[List[str]] = None,
+                       timeout: float = COMMAND_TIMEOUT) -> CommandResult:
+    """Runs `terraform init` only when provider/module requirements or the lock file changed."""
+    fingerprint_path = os.path.join(work_dir, INIT_FINGERPRINT_FILE)
+    fingerprint = init_fingerprint(work_dir)
+    if fingerprint and os.path.exists(os.path.join(work_dir, LOCK_FILE)) and os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as f:
+            if f.read().strip() == fingerprint:
+                message = "Terraform providers unchanged since last init; skipping terraform init."
+                logging.info(f"{message} ({work_dir})")
+                if on_line:
+                    on_line(message)
+                return CommandResult(returncode=0, output=message)
+
+    result = run_command(
+        ["terraform", f"-chdir={work_dir}", "init", "-no-color", "-input=false", *(extra_args or [])],
+        on_line=on_line, cancel_event=cancel_event, env=terraform_env(), timeout=timeout,
+    )
+    if result.returncode == 0 and not result.cancelled:
+        # The lock file may have just been created, so fingerprint again after init
+        fingerprint = init_fingerprint(work_dir)
+        if fingerprint:
+            os.makedirs(os.path.dirname(fingerprint_path), exist_ok=True)
+            with open(fingerprint_path, "w") as f:
+                f.write(fingerprint)
+    return result
+
+
+# --- Saved plans ---
+
+def plan_fingerprint(work_dir: str) -> str:
+    """Hashes what a plan depends on locally: the .tf files, the lock file and the state's lineage/serial."""
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(work_dir)):
+        if filename.endswith(".tf") or filename == LOCK_FILE:
+            digest.update(filename.encode())
+            with open(os.path.join(work_dir, filename), "rb") as f:
+                digest.update(f.read())
+    state_path = os.path.join(work_dir, STATE_FILE)
+    if os.path.exists(state_path):
+        try:
+            with open(state_path) as f:
+                tf_state = json.load(f)
+            digest.update(f"{tf_state.get('lineage')}:{tf_state.get('serial')}".encode())
+        except ValueError:
+            digest.update(b"unreadable-state")
+    return digest.hexdigest()
+
+
+class PlanCache:
+    """
+    Tracks the saved plan file of each work dir. A plan is reused, and applied from
+    its file, only while the configuration, lock file and state it was computed from
+    are unchanged and it is younger than PLAN_CACHE_TTL. The record lives next to the
+    init fingerprint, so it survives restarts.
+    """
+
+    def __init__(self, ttl: float = PLAN_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, work_dir: str) -> Optional[dict]:
+        """The record of a still-valid saved plan ({"fingerprint", "created", "output"}), or None."""
+        record_path = os.path.join(work_dir, PLAN_RECORD_FILE)
+        record = None
+        if os.path.exists(record_path) and os.path.exists(os.path.join(work_dir, PLAN_FILE)):
+            try:
+                with open(record_path) as f:
+                    record = json.load(f)
+            except ValueError:
+                record = None
+        if (record is None or time.time() - record.get("created", 0) > self.ttl
+                or record.get("fingerprint") != plan_fingerprint(work_dir)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record
+
+    def store(self, work_dir: str, fingerprint: str, output: str):
+        record_path = os.path.join(work_dir, PLAN_RECORD_FILE)
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        with open(record_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "created": time.time(), "output": output}, f)
+
+    def discard(self, work_dir: str):
+        """Forgets the saved plan; called before re-planning and after every apply."""
+        for path in (PLAN_RECORD_FILE, PLAN_FILE):
+            try:
+                os.remove(os.path.join(work_dir, path))
+            except FileNotFoundError:
+                pass
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+PLAN_CACHE = PlanCache()
+
+
+# --- Static validation ---
+
+@dataclass
+class ValidationResult:
+    errors: List[str]
+    formatted: bool = False  # `terraform fmt` rewrote main.tf
+    skipped: str = ""  # Why validation could not run, if it did not
+
+
+def _format_diagnostic(diagnostic: dict) -> str:
+    message = diagnostic.get("summary", "")
+    if diagnostic.get("detail"):
+        message += f": {diagnostic['detail']}"
+    location = diagnostic.get("range") or {}
+    if location.get("filename"):
+        message = f"{location['filename']}:{(location.get('start') or {}).get('line', '?')}: {message}"
+    return message
+
+
+def validate_config(work_dir: str, on_line=None, cancel_event=None) -> ValidationResult:
+    """
+    Offline checks run before a plan: `terraform fmt` normalizes main.tf in place and
+    `terraform validate` checks the configuration against the provider schemas from
+    the shared plugin cache. No provider API is called. Validation is skipped (not
+    failed) when terraform is unavailable, init cannot install the providers or a
+    step outlives VALIDATE_TIMEOUT.
+    """
+    env = terraform_env()
+    chdir_arg = f"-chdir={work_dir}"
+    try:
+        fmt_result = run_command(
+            ["terraform", chdir_arg, "fmt", "-no-color", "-list=true"], env=env, cancel_event=cancel_event, timeout=VALIDATE_TIMEOUT,
+        )
+    except FileNotFoundError:
+        return ValidationResult(errors=[], skipped="terraform is not installed")
+    if fmt_result.timed_out:
+        return ValidationResult(errors=[], skipped="terraform fmt timed out")
+    if fmt_result.returncode != 0:
+        return ValidationResult(errors=[line for line in fmt_result.output.splitlines() if line.strip()])
+    formatted = bool(fmt_result.output.strip())
+
+    init_result = ensure_initialized(work_dir, on_line=on_line, cancel_event=cancel_event, timeout=VALIDATE_TIMEOUT)
+    if init_result.returncode != 0 or init_result.cancelled:
+        return ValidationResult(errors=[], formatted=formatted, skipped=f"terraform init failed:\n{init_result.output}")
+
+    validate_result = capture_command(["terraform", chdir_arg, "validate", "-json", "-no-color"], env=env, timeout=VALIDATE_TIMEOUT)
+    if validate_result.timed_out:
+        return ValidationResult(errors=[], formatted=formatted, skipped=validate_result.errors)
+    try:
+        report = json.loads(validate_result.output)
+    except ValueError:
+        if validate_result.returncode == 0:
+            return ValidationResult(errors=[], formatted=formatted)
+        return ValidationResult(errors=[(validate_result.errors or validate_result.output).strip()], formatted=formatted)
+    errors = [_format_diagnostic(d) for d in report.get("diagnostics", []) if d.get("severity") == "error"]
+    return ValidationResult(errors=errors, formatted=formatted)
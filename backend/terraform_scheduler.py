@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict
+
+# Terraform runs allowed at once across all sessions. Runs for the same work dir
+# never overlap regardless of this limit.
+TERRAFORM_MAX_CONCURRENT = int(os.getenv("TERRAFORM_MAX_CONCURRENT", "2"))
+
+
+class TerraformScheduler:
+    """
+    Admission control for terraform runs. Each work dir runs at most one command at a
+    time, at most `max_concurrent` run overall, and free slots are handed out round-robin
+    across work dirs so one session queueing many runs cannot starve the others.
+    """
+
+    def __init__(self, max_concurrent: int = TERRAFORM_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()  # key -> futures in arrival order
+        self._active = set()
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue_depth = 0
+        self.skipped = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        """Holds a run slot for `key` (a work dir) for the duration of the block."""
+        queued_at = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, deque()).append(waiter)
+        self._dispatch()
+        if not waiter.done():
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            logging.info(f"Terraform run for {key} queued ({self.queue_depth} waiting, {len(self._active)} running)")
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was granted just as we were cancelled; pass it on
+                    self._release(key)
+                else:
+                    self._forget(key, waiter)
+                raise
+
+        waited = time.monotonic() - queued_at
+        self.started += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    @asynccontextmanager
+    async def try_slot(self, key: str):
+        """
+        Like `slot`, but never queues: yields False without holding anything when `key`
+        is busy or every slot is taken, for optional runs that must not wait.
+        """
+        if key in self._active or key in self._waiting or len(self._active) >= self.max_concurrent:
+            self.skipped += 1
+            yield False
+            return
+        self._active.add(key)
+        self.started += 1
+        try:
+            yield True
+        finally:
+            self._release(key)
+
+    def _forget(self, key: str, waiter: asyncio.Future):
+        waiters = self._waiting.get(key)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiting[key]
+
+    def _release(self, key: str):
+        self._active.discard(key)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grants free slots, taking the first eligible work dir and moving it to the back of the line."""
+        while len(self._active) < self.max_concurrent:
+            key = next((k for k in self._waiting if k not in self._active), None)
+            if key is None:
+                return
+            waiters = self._waiting.pop(key)
+            # Skip waiters cancelled in this same loop tick: their task has not run yet to forget them
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                continue
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting[key] = waiters  # Re-inserted at the end: round-robin
+            self._active.add(key)
+            waiter.set_result(None)
+
+    def to_dict(self) -> Dict:
+        return {
+            "max_concurrent": self.max_concurrent, "running": len(self._active),
+            "queue_depth": self.queue_depth, "max_queue_depth": self.max_queue_depth,
+            "started": self.started, "skipped": self.skipped,
+            "avg_wait_seconds": round(self.total_wait / self.started, 3) if self.started else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+        }
+
+
+TERRAFORM_SCHEDULER = TerraformScheduler()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The backend is a flat set of modules run from backend/; import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Offline canned LLM replies instead of Gemini
+os.environ.setdefault("LLM_BACKEND", "stub")
+# Module-level session store and index must not write into the working directory
+os.environ.setdefault("SESSIONS_DIR", tempfile.mkdtemp(prefix="terraformancer-sessions-"))
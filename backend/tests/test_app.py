@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app
+from jobs import JobManager
+
+
+@pytest.fixture(autouse=True)
+def no_persist(monkeypatch):
+    monkeypatch.setattr(app, "save_session_state", lambda session_id, state: None)
+
+
+def test_plan_status_follows_exit_code():
+    state = {"plan_output": "", "apply_output": "old", "error_message": ""}
+    app.record_plan_result("s", state, {"plan_output": "Plan: 1 to add", "exit_code": 0})
+    assert state["last_plan_status"] == "planned" and state["apply_output"] == ""
+    assert "exit_code" not in state
+
+    # Non-zero exit without an error message (e.g. a cancelled run) is still a failure
+    app.record_plan_result("s", state, {"plan_output": "Interrupt received", "exit_code": 1})
+    assert state["last_plan_status"] == "plan_failed"
+
+
+def test_apply_status_follows_exit_code():
+    state = {"plan_output": "Plan: 1 to add", "apply_output": "", "error_message": ""}
+    app.record_apply_result("s", state, {"apply_output": "Error: boom", "exit_code": 1})
+    assert state["last_plan_status"] == "apply_failed" and state["plan_output"] == ""
+
+    app.record_apply_result("s", state, {"apply_output": "Apply complete!", "exit_code": 0})
+    assert state["last_plan_status"] == "applied"
+
+    app.record_apply_result("s", state, {"apply_output": "", "error_message": "Terraform Apply Timed Out"})
+    assert state["last_plan_status"] == "apply_failed"
+
+
+def test_second_job_of_a_kind_is_refused_while_the_first_is_pending(monkeypatch, tmp_path):
+    state = {"work_dir": str(tmp_path), "iac_code": "resource {}", "plan_output": ""}
+
+    async def get_session_state(session_id):
+        return session_id, state
+
+    def slow_plan(state, on_line=None, cancel_event=None):
+        cancel_event.wait(5)
+        return {"plan_output": "", "exit_code": 1}
+
+    monkeypatch.setattr(app, "get_session_state", get_session_state)
+    monkeypatch.setattr(app, "JOBS", JobManager())
+    monkeypatch.setitem(app.JOB_KINDS, "plan", (slow_plan, app.record_plan_result))
+
+    async def main():
+        first = await app.start_job(app.JobRequest(session_id="s", kind="plan"))
+        with pytest.raises(HTTPException) as refused:
+            await app.start_job(app.JobRequest(session_id="s", kind="plan"))
+        assert refused.value.status_code == 409 and first["job_id"] in refused.value.detail
+        # Other sessions are unaffected
+        other = await app.start_job(app.JobRequest(session_id="t", kind="plan"))
+        jobs = [app.JOBS.cancel(job_id) for job_id in (first["job_id"], other["job_id"])]
+        await asyncio.wait([job.task for job in jobs])
+        assert app.JOBS.active("s", "plan") is None
+
+    asyncio.run(main())
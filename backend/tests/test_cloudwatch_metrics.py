@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+import cloudwatch_metrics
+from cloudwatch_metrics import MetricsCache, fetch_metrics, preset_queries
+
+T0 = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(cloudwatch_metrics, "METRICS_CACHE", MetricsCache(ttl=60))
+    client = boto3.client("cloudwatch", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def _result(query_id, minutes, values):
+    return {"Id": query_id, "Label": query_id, "StatusCode": "Complete",
+            "Timestamps": [T0 + timedelta(minutes=m) for m in minutes], "Values": values}
+
+
+def test_presets_are_fetched_in_one_paginated_batch(client):
+    client, stubber = client
+    queries = preset_queries("i-123", "AWS/EC2")
+    params = {"MetricDataQueries": ANY, "StartTime": ANY, "EndTime": ANY, "ScanBy": "TimestampAscending"}
+    stubber.add_response("get_metric_data", {
+        "MetricDataResults": [_result("q0", [5], [40.0])] + [_result(f"q{i}", [], []) for i in range(1, len(queries))],
+        "NextToken": "page-2",
+    }, params)
+    stubber.add_response("get_metric_data", {
+        "MetricDataResults": [_result("q0", [0], [30.0])],
+    }, {**params, "NextToken": "page-2"})
+
+    series = fetch_metrics(queries, client=client)
+    assert [s.query for s in series] == queries
+    cpu = series[0]
+    assert (cpu.query.metric, cpu.query.stat) == ("CPUUtilization", "Average")
+    # Pages arrive out of order; the series is kept ascending
+    assert cpu.values == [30.0, 40.0] and cpu.timestamps == [T0, T0 + timedelta(minutes=5)]
+    assert cloudwatch_metrics.METRICS_CACHE.to_dict()["api_calls"] == 2
+
+
+def test_repeated_fetches_are_served_from_the_cache(client):
+    client, stubber = client
+    queries = preset_queries("db-1", "AWS/RDS")
+    stubber.add_response("get_metric_data", {
+        "MetricDataResults": [_result(f"q{i}", [0], [float(i)]) for i in range(len(queries))],
+    })
+    first = fetch_metrics(queries, client=client)
+    second = fetch_metrics(queries, client=client)  # The stubber would fail on a second API call
+    assert [s.values for s in second] == [s.values for s in first]
+    stats = cloudwatch_metrics.METRICS_CACHE.to_dict()
+    assert stats["api_calls"] == 1 and stats["hits"] == len(queries)
+
+
+def test_extra_metrics_extend_the_preset():
+    queries = preset_queries("i-123", "AWS/EC2", extra_metrics=["CPUCreditBalance", "CPUUtilization"])
+    names = [(q.metric, q.stat) for q in queries]
+    assert names[-2:] == [("CPUCreditBalance", "Average"), ("CPUCreditBalance", "Maximum")]
+    assert names.count(("CPUUtilization", "Average")) == 1
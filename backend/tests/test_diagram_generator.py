@@ -0,0 +1,73 @@
+from diagram_generator import build_dependency_graph, collect_resources, extract_architecture
+from hcl_validation import parse_hcl
+
+CONFIG = """
+provider "aws" {
+  region = "us-east-1"
+}
+
+resource "aws_vpc" "main" {
+  cidr_block = "10.0.0.0/16"
+}
+
+resource "aws_subnet" "public" {
+  vpc_id     = aws_vpc.main.id
+  cidr_block = "10.0.1.0/24"
+}
+
+resource "aws_lb" "front" {
+  subnets = [aws_subnet.public.id]
+}
+
+resource "aws_lb_target_group" "web" {
+  vpc_id = aws_vpc.main.id
+}
+
+resource "aws_lb_target_group_attachment" "web" {
+  target_group_arn = aws_lb_target_group.web.arn
+  target_id        = aws_instance.web.id
+}
+
+resource "aws_lb_listener" "http" {
+  load_balancer_arn = aws_lb.front.arn
+  default_action {
+    type             = "forward"
+    target_group_arn = aws_lb_target_group.web.arn
+  }
+}
+
+resource "aws_instance" "web" {
+  ami        = "ami-123"
+  subnet_id  = aws_subnet.public.id
+  depends_on = [aws_db_instance.db]
+}
+
+resource "aws_db_instance" "db" {
+  identifier = "app"
+}
+"""
+
+
+def test_collect_resources_normalizes_labels_of_the_installed_parser():
+    resources = collect_resources(parse_hcl(CONFIG))
+    assert set(resources["aws_instance"]) == {"web"}
+    assert "aws_vpc" in resources and '"aws_vpc"' not in resources
+    assert all("__is_block__" not in names for names in resources.values())
+
+
+def test_dependency_graph_follows_references_and_depends_on():
+    index, dependencies = build_dependency_graph(collect_resources(parse_hcl(CONFIG)))
+    assert index["aws_instance.web"] == ("aws_instance", "web")
+    assert dependencies["aws_instance.web"] == {"aws_subnet.public", "aws_db_instance.db"}
+    assert dependencies["aws_subnet.public"] == {"aws_vpc.main"}
+
+
+def test_extract_architecture_draws_nodes_edges_and_clusters():
+    architecture = extract_architecture(collect_resources(parse_hcl(CONFIG)))
+    assert architecture["drawn"] == {"aws_lb.front", "aws_instance.web", "aws_db_instance.db"}
+    assert architecture["cluster_vpcs"] == {"aws_vpc.main"}
+    assert architecture["parent"]["aws_instance.web"] == "aws_subnet.public"
+    edges = {(source, target): label for source, target, label in architecture["edges"]}
+    # Direct reference, and one contracted through the listener / target group / attachment
+    assert edges[("aws_instance.web", "aws_db_instance.db")] == "SQL Connection"
+    assert edges[("aws_lb.front", "aws_instance.web")] == "routes traffic"
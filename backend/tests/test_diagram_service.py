@@ -0,0 +1,45 @@
+import os
+
+import diagram_generator
+from diagram_service import DIAGRAM_EXECUTOR, render_status, request_render
+from hcl_validation import parse_hcl
+
+CONFIG = 'resource "aws_s3_bucket" "assets" {\n  bucket = "assets"\n}\n'
+
+
+def _wait_for_renders():
+    DIAGRAM_EXECUTOR.submit(lambda: None).result()
+
+
+def test_successful_render_swaps_in_the_png(tmp_path, monkeypatch):
+    def fake_render(all_resources, path):
+        with open(f"{path}.png", "wb") as f:
+            f.write(b"png")
+    monkeypatch.setattr(diagram_generator, "render_diagram", fake_render)
+
+    path = request_render(str(tmp_path), parse_hcl(CONFIG))
+    _wait_for_renders()
+    assert path == str(tmp_path / "architecture_diagram.png") and os.path.exists(path)
+    assert render_status(str(tmp_path)) == {"status": "ready", "error": ""}
+    # An unchanged resource graph reuses the image
+    assert request_render(str(tmp_path), parse_hcl(CONFIG)) == path
+    assert render_status(str(tmp_path))["status"] == "ready"
+
+
+def test_failed_render_is_reported_and_cleaned_up(tmp_path, monkeypatch):
+    def failing_render(all_resources, path):
+        open(path, "w").close()
+        open(f"{path}.png", "w").close()
+        raise RuntimeError("dot not found")
+    monkeypatch.setattr(diagram_generator, "render_diagram", failing_render)
+
+    path = request_render(str(tmp_path), parse_hcl(CONFIG))
+    _wait_for_renders()
+    assert not os.path.exists(path)
+    assert render_status(str(tmp_path)) == {"status": "failed", "error": "RuntimeError: dot not found"}
+    assert sorted(os.listdir(tmp_path)) == ["diagram_error.log"]
+
+
+def test_nothing_to_draw(tmp_path):
+    assert request_render(str(tmp_path), parse_hcl('provider "aws" {\n  region = "us-east-1"\n}\n')) == ""
+    assert render_status(str(tmp_path))["status"] == "none"
@@ -0,0 +1,70 @@
+import pytest
+
+from hcl_patch import PatchError, apply_patch, split_blocks
+
+MAIN_TF = """terraform {
+  required_providers {
+    aws = { source = "hashicorp/aws" }
+  }
+}
+
+provider "aws" {
+  region = "us-east-1"
+}
+
+# Web tier { not a brace }
+resource "aws_instance" "web" {
+  ami           = "ami-123"
+  instance_type = "t3.micro"
+  user_data     = <<-EOT
+    echo "}" > /tmp/brace
+  EOT
+}
+
+data "aws_ami" "ubuntu" {
+  most_recent = true
+}
+"""
+
+BUCKET = 'resource "aws_s3_bucket" "logs" {\n  bucket = "logs"\n}'
+
+
+def test_split_blocks_skips_braces_in_strings_comments_and_heredocs():
+    addresses = [block.address for block in split_blocks(MAIN_TF)]
+    assert addresses == ["terraform", "provider.aws", "aws_instance.web", "data.aws_ami.ubuntu"]
+
+
+def test_replace_keeps_other_blocks_byte_for_byte():
+    web = 'resource "aws_instance" "web" {\n  ami           = "ami-456"\n  instance_type = "t3.small"\n}'
+    patched = apply_patch(MAIN_TF, [{"op": "replace", "address": "resource.aws_instance.web", "hcl": web}])
+    assert web in patched and "ami-123" not in patched
+    assert patched.startswith(MAIN_TF[:MAIN_TF.index("# Web tier")])
+    assert patched.endswith('data "aws_ami" "ubuntu" {\n  most_recent = true\n}\n')
+
+
+def test_add_and_remove():
+    patched = apply_patch(MAIN_TF, [
+        {"op": "add", "address": "aws_s3_bucket.logs", "hcl": BUCKET},
+        {"op": "remove", "address": "data.aws_ami.ubuntu"},
+    ])
+    assert [block.address for block in split_blocks(patched)] == [
+        "terraform", "provider.aws", "aws_instance.web", "aws_s3_bucket.logs",
+    ]
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "add", "address": "aws_instance.web", "hcl": 'resource "aws_instance" "web" {}'},
+    {"op": "replace", "address": "aws_s3_bucket.logs", "hcl": BUCKET},
+    {"op": "remove", "address": "aws_s3_bucket.logs"},
+    {"op": "replace", "address": "aws_instance.web", "hcl": BUCKET},
+    {"op": "replace", "address": "aws_instance.web", "hcl": ""},
+    {"op": "rename", "address": "aws_instance.web"},
+])
+def test_invalid_operations_raise(operation):
+    with pytest.raises(PatchError):
+        apply_patch(MAIN_TF, [operation])
+
+
+def test_unbalanced_braces_raise():
+    with pytest.raises(PatchError):
+        split_blocks('resource "aws_s3_bucket" "logs" {\n')
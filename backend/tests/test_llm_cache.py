@@ -0,0 +1,43 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+import llm_cache
+from llm_cache import CachedLLM, ResponseCache
+
+
+class CountingLLM:
+    model = "counting"
+    temperature = 0.0
+
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt, config=None, **kwargs):
+        self.calls += 1
+        return AIMessage(content=f"reply {self.calls}")
+
+
+def test_whitespace_variants_share_an_entry():
+    llm = CountingLLM()
+    cached = CachedLLM(llm, ResponseCache("memory"))
+
+    async def main():
+        first = await cached.ainvoke("classify:\n    hello")
+        second = await cached.ainvoke("classify: hello")
+        return first.content, second.content
+
+    assert asyncio.run(main()) == ("reply 1", "reply 1")
+    assert llm.calls == 1 and cached.cache.to_dict()["hits"] == 1
+
+
+def test_sqlite_entries_survive_a_new_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    llm = CountingLLM()
+    asyncio.run(CachedLLM(llm, ResponseCache("sqlite")).ainvoke("hello"))
+
+    restarted = ResponseCache("sqlite")
+    response = asyncio.run(CachedLLM(llm, restarted).ainvoke("hello"))
+    assert response.content == "reply 1" and llm.calls == 1
+    stats = restarted.to_dict()
+    assert stats["backend"] == "sqlite" and stats["hits"] == 1 and stats["memory_entries"] == 1
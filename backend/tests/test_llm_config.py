@@ -0,0 +1,64 @@
+import asyncio
+
+from langchain_core.messages import HumanMessage
+
+import agent_logic
+from llm_config import STUB_HCL, StubChatModel, llm_for, model_config
+from llm_resilience import ResilientLLM
+from terraform_runner import ValidationResult
+
+
+def test_env_overrides_per_node(monkeypatch):
+    monkeypatch.setenv("LLM_INTENT_ROUTER_MODEL", "local-classifier")
+    monkeypatch.setenv("LLM_INTENT_ROUTER_HEDGE", "no")
+    monkeypatch.setenv("LLM_INTENT_ROUTER_MAX_TOKENS", "5")
+    config = model_config("intent_router")
+    assert (config.model, config.hedge, config.max_output_tokens) == ("local-classifier", False, 5)
+    assert model_config("generate_code").model != "local-classifier"
+
+
+def test_stub_model_cycles_replies_and_streams_words():
+    model = StubChatModel(node="test", replies=["first reply", "second"])
+
+    async def main():
+        chunks = [chunk.content async for chunk in model.astream("hi") if chunk.content]
+        second = await model.ainvoke("hi")
+        third = await model.ainvoke("hi")
+        return chunks, second.content, third.content
+
+    chunks, second, third = asyncio.run(main())
+    assert chunks == ["first ", "reply "]
+    assert (second, third) == ("second", "first reply")
+
+
+def test_llm_for_wraps_one_stub_per_node():
+    llm = llm_for("generate_code")
+    assert isinstance(llm, ResilientLLM) and llm is llm_for("generate_code")
+    assert isinstance(llm.llm, StubChatModel) and llm.llm is not llm_for("design_agent").llm
+    assert asyncio.run(llm.ainvoke("write main.tf")).content == STUB_HCL
+
+
+def _new_state(work_dir, message):
+    return {
+        "work_dir": work_dir, "initial_request": "", "conversation_history": [HumanMessage(content=message)],
+        "intent": "", "chat_response": "", "iac_code": "", "iac_diagram_path": "", "plan_output": "",
+        "apply_output": "", "clarification_questions": [], "error_message": "", "conversation_summary": "",
+        "summarized_upto": 0, "last_plan_status": "",
+    }
+
+
+def test_graph_turns_run_offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent_logic, "validate_config", lambda work_dir: ValidationResult(errors=[], skipped="offline"))
+    graph = agent_logic.create_graph("two_step")
+
+    async def main():
+        chat = await graph.ainvoke(_new_state(str(tmp_path / "chat"), "thanks!"))
+        (tmp_path / "code").mkdir()
+        code = await graph.ainvoke(_new_state(str(tmp_path / "code"), "Create an S3 bucket named logs"))
+        return chat, code
+
+    chat, code = asyncio.run(main())
+    assert chat["intent"] == "GENERAL_CHAT" and "stub reply" in chat["chat_response"]
+    assert code["intent"] == "CODE_MODIFICATION" and not code["error_message"]
+    assert 'resource "aws_s3_bucket" "stub"' in code["iac_code"]
+    assert (tmp_path / "code" / "main.tf").read_text().strip() == code["iac_code"].strip()
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import llm_resilience
+from llm_resilience import CircuitBreaker, LLMUnavailable, ResilientLLM
+
+
+class FakeLLM:
+    """Plays back a script of outcomes: a value to return, an exception to raise, or a delay in seconds."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def ainvoke(self, prompt, config=None, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, float):
+            await asyncio.sleep(outcome)
+            return "slow"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _resilient(llm, breaker=None, attempts=3, deadline=5.0, attempt_timeout=None):
+    wrapped = ResilientLLM(llm, "test_node", "test-model", deadline=deadline, attempt_timeout=attempt_timeout,
+                           attempts=attempts, hedge=False)
+    wrapped.breaker = breaker or CircuitBreaker(failures=2, reset_seconds=60)
+    return wrapped
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "BACKOFF_BASE", 0.0)
+
+
+def test_retries_retryable_errors_until_success():
+    llm = FakeLLM(ConnectionError("reset"), asyncio.TimeoutError(), "ok")
+    assert asyncio.run(_resilient(llm).ainvoke("hi")) == "ok"
+    assert llm.calls == 3
+
+
+def test_request_errors_are_not_retried_and_do_not_open_the_circuit():
+    llm, breaker = FakeLLM(ValueError("bad schema")), CircuitBreaker(failures=1, reset_seconds=60)
+    with pytest.raises(ValueError):
+        asyncio.run(_resilient(llm, breaker).ainvoke("hi"))
+    assert llm.calls == 1 and breaker.state == "closed"
+
+
+def test_per_attempt_timeout_is_retried():
+    llm = FakeLLM(1.0, "ok")
+    assert asyncio.run(_resilient(llm, attempt_timeout=0.05).ainvoke("hi")) == "ok"
+
+
+def test_circuit_opens_fails_fast_and_closes_after_a_successful_trial():
+    breaker = CircuitBreaker(failures=2, reset_seconds=60)
+    llm = FakeLLM(ConnectionError(), ConnectionError(), "ok")
+    wrapped = _resilient(llm, breaker, attempts=1)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            asyncio.run(wrapped.ainvoke("hi"))
+    assert breaker.state == "open"
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(wrapped.ainvoke("hi"))
+    assert llm.calls == 2 and breaker.rejected == 1
+
+    breaker.reset_seconds = 0
+    assert breaker.state == "half_open"
+    assert asyncio.run(wrapped.ainvoke("hi")) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    opened_at = breaker.opened_at
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(_resilient(FakeLLM(ConnectionError()), breaker, attempts=1).ainvoke("hi"))
+    assert breaker.opened_at > opened_at and not breaker.trial_in_flight
+
+
+def test_cancelled_trial_lets_the_next_call_through():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    wrapped = _resilient(FakeLLM(10.0, "ok"), breaker, attempts=1)
+
+    async def main():
+        trial = asyncio.create_task(wrapped.ainvoke("hi"))
+        await asyncio.sleep(0.01)
+        assert breaker.trial_in_flight
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert not breaker.trial_in_flight
+        return await wrapped.ainvoke("hi")
+
+    assert asyncio.run(main()) == "ok"
+    assert breaker.state == "closed"
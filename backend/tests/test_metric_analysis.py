@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from metric_analysis import analyze_series, build_fleet_digest, change_points, describe, trend_slope
+
+START = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+def _timestamps(n, period_minutes=5):
+    return [START + timedelta(minutes=period_minutes * i) for i in range(n)]
+
+
+def _seconds(n):
+    return np.array([ts.timestamp() for ts in _timestamps(n)])
+
+
+def test_trend_slope_on_epoch_timestamps():
+    assert trend_slope(_seconds(48), np.full(48, 37.5)) == 0.0
+    # 0.5 per 5-minute point is 6 per hour
+    slope = trend_slope(_seconds(48), 10 + 0.5 * np.arange(48))
+    assert abs(slope - 6.0) < 1e-9
+    assert trend_slope(_seconds(1), np.array([1.0])) is None
+
+
+def test_change_points_find_a_level_shift_but_not_noise():
+    rng = np.random.default_rng(0)
+    shifted = np.concatenate([rng.normal(20, 1, 30), rng.normal(60, 1, 30)])
+    assert change_points(shifted) == [30]
+    assert change_points(rng.normal(20, 1, 60)) == []
+
+
+def test_analyze_series_reports_breaches():
+    values = [10.0] * 20 + [95.0] * 6 + [10.0] * 4
+    analysis = analyze_series("i-123", "CPUUtilization", "Average", _timestamps(30), values)
+    assert analysis.breach.points == 6 and analysis.breach.longest_run == 6
+    assert analysis.breach.first_at == _timestamps(30)[20]
+    line = describe(analysis, 300)
+    assert "> 80 for 6/30 pts (longest 30 min" in line
+
+
+def test_flat_series_digest_has_no_float_residue():
+    analysis = analyze_series("i-123", "CPUUtilization", "Average", _timestamps(24), [0.1] * 24)
+    assert "trend +0/h" in describe(analysis, 300)
+
+
+def test_fleet_digest_ranks_breaching_resources_first():
+    healthy = analyze_series("i-ok", "CPUUtilization", "Average", _timestamps(12), [20.0] * 12)
+    hot = analyze_series("i-hot", "CPUUtilization", "Average", _timestamps(12), [90.0] * 12)
+    digest = build_fleet_digest({"i-ok": [healthy], "i-hot": [hot]}, 300, detailed=1)
+    lines = digest.splitlines()
+    assert lines[0] == "i-hot:"
+    assert lines[-1] == "i-ok: CPUUtilization Average p50 20, p90 20; no breaches"
@@ -0,0 +1,32 @@
+from hcl_validation import parse_hcl
+from resource_resolver import MonitoredResource, from_hcl, resolve_resources
+
+CONFIG = """
+resource "aws_db_instance" "orders" {
+  identifier = "orders-db"
+}
+
+resource "aws_db_instance" "reports" {
+  identifier = "reports-${var.env}"
+}
+
+resource "aws_db_instance" "users" {
+  identifier = var.users_db
+}
+"""
+
+
+def test_from_hcl_reads_unquoted_literal_identifiers():
+    assert from_hcl(parse_hcl(CONFIG)) == [
+        MonitoredResource("orders-db", "AWS/RDS", "DBInstanceIdentifier", "aws_db_instance.orders"),
+    ]
+
+
+def test_from_hcl_filters_by_hint():
+    assert from_hcl(parse_hcl(CONFIG), hint="orders")
+    assert from_hcl(parse_hcl(CONFIG), hint="billing") == []
+
+
+def test_unmatched_hint_falls_back_to_every_resource(tmp_path):
+    resolved = resolve_resources(str(tmp_path), parse_hcl(CONFIG), hint="billing")
+    assert [resource.resource_id for resource in resolved] == ["orders-db"]
@@ -0,0 +1,113 @@
+import os
+import stat
+import asyncio
+
+import pytest
+
+import terraform_runner
+from agent_logic import deployment_planning_tool, execution_tool
+from jobs import JobManager
+from terraform_runner import validate_config
+
+FAKE_TERRAFORM = """#!/bin/sh
+case "$2" in
+  fmt) exit 0 ;;
+  init) echo "Terraform has been successfully initialized!"; exit 0 ;;
+  validate)
+    echo "Warning: provider development overrides are in effect" >&2
+    %s
+    echo '{"valid": false, "diagnostics": [{"severity": "warning", "summary": "Deprecated"}, {"severity": "error", "summary": "Missing required argument", "detail": "\\"bucket\\" is required", "range": {"filename": "main.tf", "start": {"line": 3}}}]}'
+    exit 1 ;;
+  plan)
+    echo "${FAKE_PLAN_OUTPUT:-Plan: 1 to add, 0 to change, 0 to destroy.}"
+    [ "${FAKE_PLAN_EXIT:-0}" = 0 ] && touch "${1#-chdir=}/tfplan"
+    exit "${FAKE_PLAN_EXIT:-0}" ;;
+  apply)
+    echo "${FAKE_APPLY_OUTPUT:-Apply complete! Resources: 1 added.}"
+    exit "${FAKE_APPLY_EXIT:-0}" ;;
+esac
+"""
+
+
+@pytest.fixture
+def fake_terraform(tmp_path, monkeypatch):
+    def install(before_output=""):
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        script = bin_dir / "terraform"
+        script.write_text(FAKE_TERRAFORM % before_output)
+        script.chmod(script.stat().st_mode | stat.S_IEXEC)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setattr(terraform_runner, "PLUGIN_CACHE_DIR", str(tmp_path / "plugins"))
+        work_dir = tmp_path / "work"
+        work_dir.mkdir()
+        (work_dir / "main.tf").write_text('resource "aws_s3_bucket" "logs" {}\n')
+        return str(work_dir)
+    return install
+
+
+def test_validate_reads_json_from_stdout_despite_stderr_warnings(fake_terraform):
+    result = validate_config(fake_terraform())
+    assert not result.skipped
+    assert result.errors == ['main.tf:3: Missing required argument: "bucket" is required']
+
+
+def test_validate_timeout_skips_instead_of_failing(fake_terraform, monkeypatch):
+    monkeypatch.setattr(terraform_runner, "VALIDATE_TIMEOUT", 0.5)
+    result = validate_config(fake_terraform(before_output="sleep 5"))
+    assert result.errors == [] and "timed out" in result.skipped
+
+
+def _run_job(tool, work_dir):
+    recorded = {}
+
+    async def main():
+        job = JobManager().start("session", "job", tool, {"work_dir": work_dir},
+                                 on_complete=lambda job, result: recorded.update(result))
+        await job.task
+        return job
+
+    return asyncio.run(main()), recorded
+
+
+def test_failing_plan_and_apply_fail_their_jobs(fake_terraform, monkeypatch):
+    work_dir = fake_terraform()
+    monkeypatch.setenv("FAKE_PLAN_EXIT", "1")
+    monkeypatch.setenv("FAKE_PLAN_OUTPUT", "Error: No valid credential sources found")
+    job, result = _run_job(deployment_planning_tool, work_dir)
+    assert job.status == "failed"
+    assert result["error_message"].startswith("Terraform Plan Failed (exit code 1)")
+    assert not os.path.exists(os.path.join(work_dir, "tfplan"))
+
+    monkeypatch.setenv("FAKE_PLAN_EXIT", "0")
+    monkeypatch.setenv("FAKE_APPLY_EXIT", "1")
+    monkeypatch.setenv("FAKE_APPLY_OUTPUT", "Error: apply failed")
+    assert _run_job(deployment_planning_tool, work_dir)[0].status == "succeeded"
+    job, result = _run_job(execution_tool, work_dir)
+    assert job.status == "failed"
+    assert "Error: apply failed" in result["error_message"]
+
+
+def test_successful_plan_and_apply(fake_terraform):
+    work_dir = fake_terraform()
+    job, result = _run_job(deployment_planning_tool, work_dir)
+    assert job.status == "succeeded" and "error_message" not in result
+    job, result = _run_job(execution_tool, work_dir)
+    assert job.status == "succeeded" and result["apply_output"].startswith("Apply complete!")
+
+
+def test_apply_refuses_without_a_matching_saved_plan(fake_terraform):
+    work_dir = fake_terraform()
+    assert _run_job(deployment_planning_tool, work_dir)[0].status == "succeeded"
+    with open(os.path.join(work_dir, "main.tf"), "a") as f:
+        f.write('\nresource "null_resource" "extra" {}\n')
+    job, result = _run_job(execution_tool, work_dir)
+    assert job.status == "failed"
+    assert result["apply_output"] == "" and result["plan_output"] == ""
+    assert "Run a new plan" in result["error_message"]
+
+    # A second apply after the saved plan was consumed is refused the same way
+    assert _run_job(deployment_planning_tool, work_dir)[0].status == "succeeded"
+    assert _run_job(execution_tool, work_dir)[0].status == "succeeded"
+    job, result = _run_job(execution_tool, work_dir)
+    assert job.status == "failed" and result["apply_output"] == ""
@@ -0,0 +1,108 @@
+import asyncio
+
+from terraform_scheduler import TerraformScheduler
+
+
+async def _hold(scheduler, key, started, release, log):
+    async with scheduler.slot(key):
+        log.append(key)
+        started.set()
+        await release.wait()
+
+
+def test_same_work_dir_runs_one_at_a_time():
+    async def main():
+        scheduler = TerraformScheduler(max_concurrent=2)
+        first_started, second_started = asyncio.Event(), asyncio.Event()
+        release, log = asyncio.Event(), []
+        first = asyncio.create_task(_hold(scheduler, "a", first_started, release, log))
+        second = asyncio.create_task(_hold(scheduler, "a", second_started, release, log))
+        await first_started.wait()
+        await asyncio.sleep(0)
+        assert log == ["a"] and scheduler.queue_depth == 1
+        release.set()
+        await asyncio.gather(first, second)
+        assert log == ["a", "a"]
+        assert scheduler.to_dict()["running"] == 0
+
+    asyncio.run(main())
+
+
+def test_global_cap_hands_out_slots_round_robin():
+    async def main():
+        scheduler = TerraformScheduler(max_concurrent=1)
+        release, log = asyncio.Event(), []
+        holder_started = asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, "a", holder_started, release, log))
+        await holder_started.wait()
+        # "a" queues two more runs before "b" queues one: "b" must not wait behind both
+        queued = [asyncio.create_task(_hold(scheduler, key, asyncio.Event(), release, log)) for key in ("a", "a", "b")]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *queued)
+        assert log == ["a", "a", "b", "a"]
+
+    asyncio.run(main())
+
+
+def test_waiter_cancelled_in_the_releasing_tick_is_skipped():
+    async def main():
+        scheduler = TerraformScheduler(max_concurrent=1)
+        holder_started, holder_release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, "a", holder_started, holder_release, []))
+        await holder_started.wait()
+        log, release = [], asyncio.Event()
+        cancelled = asyncio.create_task(_hold(scheduler, "b", asyncio.Event(), release, log))
+        survivor = asyncio.create_task(_hold(scheduler, "c", asyncio.Event(), release, log))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 2
+
+        # The holder wakes up (and releases) before the cancelled waiter's task runs
+        holder_release.set()
+        cancelled.cancel()
+        release.set()
+        await holder
+        await asyncio.wait_for(survivor, 1)
+        assert cancelled.cancelled()
+        assert log == ["c"]
+        assert scheduler.to_dict()["running"] == 0 and scheduler.queue_depth == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_is_forgotten():
+    async def main():
+        scheduler = TerraformScheduler(max_concurrent=1)
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, "a", started, release, []))
+        await started.wait()
+        waiter = asyncio.create_task(_hold(scheduler, "b", asyncio.Event(), release, []))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 0
+        release.set()
+        await holder
+        assert scheduler.to_dict()["running"] == 0
+
+    asyncio.run(main())
+
+
+def test_try_slot_never_waits():
+    async def main():
+        scheduler = TerraformScheduler(max_concurrent=2)
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, "a", started, release, []))
+        await started.wait()
+        async with scheduler.try_slot("a") as acquired:
+            assert not acquired  # Same work dir is busy
+        async with scheduler.try_slot("b") as acquired:
+            assert acquired
+            async with scheduler.try_slot("c") as inner:
+                assert not inner  # Global cap reached
+        release.set()
+        await holder
+        stats = scheduler.to_dict()
+        assert stats["running"] == 0 and stats["skipped"] == 2 and stats["started"] == 2
+
+    asyncio.run(main())